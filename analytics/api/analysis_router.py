@@ -1,29 +1,189 @@
+import asyncio
+import json
+
 import openai
 from backend_shared.schemas.analysis_schema import AnalysisPrompts, AnalysisResponse
 from backend_shared.schemas.ingestion_schema import ContentRequest
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
+from fastapi.responses import StreamingResponse
 
+from analytics.api.schemas import (
+    BatchAnalysisItem,
+    BatchAnalysisResponse,
+    JobResponse,
+)
 from analytics.config import settings
-from analytics.service.analysis_service import AnalysisService
+from analytics.custom_logging import logger
+from analytics.errors import InvalidData, NotFound, NotSupported, ServiceUnavailable
+from analytics.service.analysis_service import ANALYSIS_MODES, AnalysisService
+from analytics.service.circuit_breaker_service import CircuitOpenError
+from analytics.service.job_service import get_job_queue, job_workers
+from analytics.service.llm_service import LLM_ERRORS
 
 analysis_router = APIRouter(prefix="/analyse", tags=["Analyse"])
 
 
+# Whether the LLM API refused the request because of its content filter
+def is_content_filtered(e: openai.BadRequestError) -> bool:
+    return "content_filter_result" in str(e) and "ResponsibleAIPolicyViolation" in str(
+        e
+    )
+
+
+# The tasks are run as set in ANALYSIS_MODE, or as given in `mode`: "concurrent",
+# "sequential" or "combined" (one LLM call for all tasks)
 @analysis_router.post("")
-async def analyse(article: ContentRequest) -> AnalysisResponse:
+async def analyse(
+    article: ContentRequest, response: Response, mode: str | None = None
+) -> AnalysisResponse:
+    if mode is not None and mode not in ANALYSIS_MODES:
+        raise InvalidData("unknown analysis mode", mode=mode, modes=ANALYSIS_MODES)
+
     service = AnalysisService(model=f"{settings.AZURE_RESOURCE_PREFIX}-gpt-4o")
+    response.headers["X-Prompt-Version"] = service.catalogue.version
     try:
-        results = await service.analyse_all(article)
+        results = await service.analyse(article, mode=mode)
         return results
+    except CircuitOpenError as e:
+        raise ServiceUnavailable("LLM provider is failing", provider=e.provider)
     except openai.BadRequestError as e:
-        if "content_filter_result" in str(e) and "ResponsibleAIPolicyViolation" in str(
-            e
-        ):
+        if is_content_filtered(e):
             return {"error": "[LLM API filtered]"}
         else:
             raise HTTPException(status_code=500, detail=str(e))
 
 
+@analysis_router.post("/batch")
+async def analyse_batch(articles: list[ContentRequest]) -> BatchAnalysisResponse:
+    if len(articles) > settings.BATCH_MAX_ARTICLES:
+        raise InvalidData(
+            "too many articles in the batch",
+            count=len(articles),
+            max_articles=settings.BATCH_MAX_ARTICLES,
+        )
+
+    service = AnalysisService(model=f"{settings.AZURE_RESOURCE_PREFIX}-gpt-4o")
+    # All the LLM calls of the batch share the same limit
+    semaphore = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+
+    # Errors are returned per article, so one failure doesn't sink the whole batch
+    async def analyse_article(article: ContentRequest) -> BatchAnalysisItem:
+        try:
+            results = await service.analyse(article, semaphore=semaphore)
+            return BatchAnalysisItem(id=article.id, result=results)
+        except openai.BadRequestError as e:
+            if is_content_filtered(e):
+                return BatchAnalysisItem(id=article.id, error="[LLM API filtered]")
+            logger.warning(f"Batch analysis failed for article {article.id}: {e}")
+            return BatchAnalysisItem(id=article.id, error=str(e))
+        except LLM_ERRORS as e:
+            logger.warning(f"Batch analysis failed for article {article.id}: {e}")
+            return BatchAnalysisItem(id=article.id, error=str(e))
+        except Exception:
+            # A bug fails the article with its traceback in the log, the other
+            # articles of the batch still get their results
+            logger.exception(
+                f"Batch analysis failed unexpectedly for article {article.id}"
+            )
+            return BatchAnalysisItem(id=article.id, error="Internal error")
+
+    items = await asyncio.gather(*(analyse_article(article) for article in articles))
+    return BatchAnalysisResponse(results=items)
+
+
+# Formats one streamed event either as a line of JSON or as a server-sent event
+def format_event(format: str, name: str, data: dict) -> str:
+    data = json.dumps(data, ensure_ascii=False)
+    if format == "sse":
+        return f"event: {name}\ndata: {data}\n\n"
+    return f"{data}\n"
+
+
+@analysis_router.post("/stream")
+async def analyse_stream(article: ContentRequest, format: str = "ndjson"):
+    if format not in ["ndjson", "sse"]:
+        raise InvalidData("unknown stream format", format=format)
+
+    service = AnalysisService(model=f"{settings.AZURE_RESOURCE_PREFIX}-gpt-4o")
+
+    # Each task is sent as soon as it is done, followed by a final "done" event
+    async def events():
+        async for prompt_name, result in service.analyse_stream(article):
+            yield format_event(
+                format, "result", {"task": prompt_name, "result": result}
+            )
+        yield format_event(
+            format, "done", {"done": True, "prompt_version": service.catalogue.version}
+        )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream" if format == "sse" else "application/x-ndjson",
+        headers={"X-Prompt-Version": service.catalogue.version},
+    )
+
+
+# Streams the answer to one task item by item as the LLM writes it, e.g. each person
+# of the "people" task, followed by the whole answer
+@analysis_router.post("/stream/{prompt_name}")
+async def analyse_stream_task(
+    prompt_name: str, article: ContentRequest, format: str = "ndjson"
+):
+    if format not in ["ndjson", "sse"]:
+        raise InvalidData("unknown stream format", format=format)
+
+    service = AnalysisService(model=f"{settings.AZURE_RESOURCE_PREFIX}-gpt-4o")
+    if prompt_name not in service.streamable_tasks():
+        raise NotSupported(
+            "task can't be streamed", task=prompt_name, tasks=service.streamable_tasks()
+        )
+
+    # The response has already started, so an error of the LLM call is sent as the
+    # final "error" event instead of an error status
+    async def events():
+        try:
+            async for kind, value in service.stream_task(article, prompt_name):
+                if kind == "item":
+                    if isinstance(value, tuple):
+                        value = {"key": value[0], "value": value[1]}
+                    yield format_event(
+                        format, "item", {"task": prompt_name, "item": value}
+                    )
+                else:
+                    yield format_event(
+                        format,
+                        "done",
+                        {"task": prompt_name, "result": value, "done": True},
+                    )
+        except LLM_ERRORS as e:
+            logger.warning(f"Streaming task {prompt_name} failed: {e}")
+            yield format_event(
+                format, "error", {"task": prompt_name, "error": str(e), "done": True}
+            )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream" if format == "sse" else "application/x-ndjson",
+        headers={"X-Prompt-Version": service.catalogue.version},
+    )
+
+
+# Queues the article for analysis and returns the id of the job straight away
+@analysis_router.post("/jobs", status_code=202)
+async def create_job(article: ContentRequest) -> JobResponse:
+    job_id = await get_job_queue().submit(article.model_dump(mode="json"))
+    job_workers.notify()
+    return JobResponse(id=job_id, status="queued")
+
+
+@analysis_router.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> JobResponse:
+    job = await get_job_queue().get(job_id)
+    if job is None:
+        raise NotFound("job", job_id=job_id)
+    return JobResponse(**job)
+
+
 @analysis_router.post("/prompts")
 async def get_prompts(article: ContentRequest) -> AnalysisPrompts:
     service = AnalysisService(model=f"{settings.AZURE_RESOURCE_PREFIX}-gpt-4o")
@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+
+from analytics.service.metrics_service import metrics
+
+metrics_router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+
+@metrics_router.get("")
+async def get_metrics() -> dict:
+    return metrics.snapshot()
@@ -0,0 +1,24 @@
+from pydantic import BaseModel
+
+
+class BatchAnalysisItem(BaseModel):
+    """Result of one article in a batch, either the analysis or the error."""
+
+    id: str | None = None
+    result: dict | None = None
+    error: str | None = None
+
+
+class BatchAnalysisResponse(BaseModel):
+    results: list[BatchAnalysisItem]
+
+
+class JobResponse(BaseModel):
+    """State of an analysis job, with the results once it is done."""
+
+    id: str
+    status: str
+    result: dict | None = None
+    error: str | None = None
+    created: float | None = None
+    updated: float | None = None
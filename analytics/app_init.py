@@ -1,8 +1,28 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
+from analytics.config import settings
+from analytics.service.client_service import clients
+from analytics.service.job_service import job_workers
+
+
+# Builds the long-lived LLM clients and starts the job workers on startup, and
+# stops them on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    clients.warm_up()
+    if settings.JOB_WORKERS > 0:
+        await job_workers.start(settings.JOB_WORKERS)
+    yield
+    await job_workers.stop()
+    await clients.close()
+
+
 app = FastAPI(
     title="Arkistokanta - Analytics API",
     redoc_url=None,
     docs_url="/docs",  # settings.API_DOCS
     version="0.1.0",
+    lifespan=lifespan,
 )
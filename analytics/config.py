@@ -27,7 +27,18 @@ class Settings(BaseSettings):
     AZURE_RESOURCE_PREFIX: str = "ark"
     AZURE_OPENAI_CHAT_ENDPOINT: str = ""
     AZURE_OPENAI_API_KEY: str = ""
+    # JSON schema answers need 2024-08-01-preview or later, and a model version that
+    # supports them, which only the deployment knows
+    AZURE_API_VERSION: str = "2024-02-15-preview"
+    AZURE_STRUCTURED_OUTPUT: bool = False  # for AZURE_OPENAI_CHAT_ENDPOINT
     KEY_VAULT_ENDPOINT: str = ""
+    # Pool of equivalent Azure OpenAI deployments as JSON, e.g.
+    # [{"name": "sweden", "endpoint": "...", "api_key": "...", "deployment":
+    #   "ark-gpt-4o", "models": ["ark-gpt-4o"], "weight": 2, "rpm": 300, "tpm": 50000,
+    #   "structured_output": true}]
+    # If empty, AZURE_OPENAI_CHAT_ENDPOINT is used for all the Azure models.
+    AZURE_DEPLOYMENTS: list[dict] = []
+    AZURE_DEPLOYMENT_COOLDOWN: float = 10.0  # seconds a failed deployment sits out
 
     # Other LLM settings
     OPENAI_API_KEY: str = ""
@@ -37,6 +48,92 @@ class Settings(BaseSettings):
     GOOGLE_ENDPOINT: str = ""
     EXCEL_PATH: str = ""
 
+    # Connection pool for the LLM clients, shared between requests
+    LLM_MAX_CONNECTIONS: int = 100
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    LLM_KEEPALIVE_EXPIRY: float = 30.0  # seconds
+    LLM_HTTP2: bool = False  # needs the h2 package installed
+
+    # Client-side rate limits per provider or "provider/model", given as JSON, e.g.
+    # {"azure/ark-gpt-4o": {"rpm": 300, "tpm": 50000}}
+    LLM_RATE_LIMITS: dict[str, dict[str, int]] = {}
+    LLM_EXPECTED_OUTPUT_TOKENS: int = 500  # used to estimate the tokens of a call
+
+    # Adaptive limit for the LLM calls in flight per provider
+    LLM_ADAPTIVE_CONCURRENCY: bool = True
+    LLM_CONCURRENCY_INITIAL: int = 8
+    LLM_CONCURRENCY_MIN: int = 1
+    LLM_CONCURRENCY_MAX: int = 64
+    LLM_CONCURRENCY_BACKOFF: float = 0.5  # the limit is multiplied by this on a 429
+    LLM_LATENCY_TOLERANCE: float = 2.0  # slower than average by this stops growth
+
+    # Circuit breaker per provider, and the models to use while one is open, e.g.
+    # {"ark-gpt-4o": "gpt-4o"}
+    LLM_BREAKER_FAILURE_THRESHOLD: int = 5  # failures in a row that open the breaker
+    LLM_BREAKER_RESET_TIMEOUT: float = (
+        30.0  # seconds before a trial call is let through
+    )
+    LLM_BREAKER_HALF_OPEN_CALLS: int = 1  # trial calls at a time while half-open
+    LLM_FALLBACK_MODELS: dict[str, str] = {}
+
+    # Hedged requests for the temperature 0 calls: a slow call is duplicated, to the
+    # model in LLM_HEDGE_MODELS or to another deployment of the same model
+    LLM_HEDGING: bool = False
+    LLM_HEDGE_PERCENTILE: float = 0.95  # latency after which the duplicate is sent
+    LLM_HEDGE_BUDGET_PERCENT: float = 5.0  # max extra tokens spent on duplicates
+    LLM_HEDGE_MIN_SAMPLES: int = 20  # calls to observe before hedging a task
+    LLM_HEDGE_MODELS: dict[str, str] = {}
+
+    # Cache for the LLM responses
+    LLM_CACHE_BACKEND: str = "memory"  # "memory", "sqlite" or "none"
+    LLM_CACHE_MAX_SIZE: int = 2048  # entries, only used by the memory cache
+    LLM_CACHE_TTL: float = 7 * 24 * 60 * 60  # seconds
+    LLM_CACHE_PATH: str = "llm_cache.sqlite3"
+    LLM_CACHE_MAX_TEMPERATURE: float = 0.0  # calls above this are not cached
+    LLM_COALESCE: bool = True  # identical temperature 0 calls in flight share one
+
+    # Ask the models that support it to answer in the JSON schema of the task, with
+    # response_format (OpenAI compatible APIs) or a forced tool call (Anthropic)
+    LLM_STRUCTURED_OUTPUT: bool = True
+
+    # Retries for LLM answers that can't be parsed as JSON
+    PARSE_RETRY_MAX_ATTEMPTS: int = 4  # attempts per LLM call, including the first
+    PARSE_RETRY_BUDGET: int = 8  # retries per task of one analysis, over all its calls
+    PARSE_RETRY_TEMPERATURE_STEP: float = 0.0  # added to the temperature per retry
+    PARSE_RETRY_BACKOFF: float = 0.5  # seconds, doubled per retry, with jitter
+    PARSE_RETRY_BACKOFF_MAX: float = 5.0
+
+    # Store for the full analysis results of articles
+    RESULT_STORE_ENABLED: bool = True
+    RESULT_STORE_PATH: str = "analysis_results.sqlite3"
+    ANALYSIS_INCREMENTAL: bool = True  # only rerun the tasks whose inputs changed
+
+    # Queue for asynchronous analysis jobs
+    JOB_STORE_PATH: str = "analysis_jobs.sqlite3"
+    JOB_WORKERS: int = 4  # 0 turns the workers off
+    JOB_POLL_INTERVAL: float = 1.0  # seconds
+    JOB_LEASE: float = 60.0  # seconds a running job is held without a heartbeat
+    JOB_RETENTION: float = 7 * 24 * 60 * 60  # seconds finished jobs are kept
+
+    # Prompts
+    PROMPTS_RELOAD_INTERVAL: float = 5.0  # seconds between checks, 0 disables
+    # "article_first" sends the article and then the instructions in one message,
+    # "instructions_first" sends the instructions as a system message that the
+    # providers can cache, and the article last
+    PROMPT_LAYOUT: str = "article_first"
+
+    # Token budget for the article in each prompt. Context windows of models that
+    # aren't known, or that are configured differently, e.g. {"gemma3:27b": 32768}
+    LLM_CONTEXT_LIMITS: dict[str, int] = {}
+    LLM_OUTPUT_TOKEN_RESERVE: int = 2000  # tokens kept free for the answer
+    ARTICLE_TOKEN_BUDGET: int = 6000  # max article tokens for the capped tasks
+
+    # Analysis execution
+    ANALYSIS_MODE: str = "concurrent"  # "concurrent", "sequential" or "combined"
+    ANALYSIS_CONCURRENCY: int = 8  # max simultaneous LLM calls per request
+    BATCH_CONCURRENCY: int = 32  # max simultaneous LLM calls for a whole batch
+    BATCH_MAX_ARTICLES: int = 100
+
     model_config = ConfigDict(env_file=".env", case_sensitive=True)
 
 
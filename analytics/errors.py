@@ -48,3 +48,8 @@ class NotAllowed(APIError):
 class InternalError(APIError):
     _status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
     _prefix = "Internal Server Error"
+
+
+class ServiceUnavailable(APIError):
+    _status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    _prefix = "Service unavailable"
@@ -15,6 +15,7 @@ from fastapi.middleware.trustedhost import TrustedHostMiddleware
 
 # from pydantic import TypeAdapter
 from analytics.api.analysis_router import analysis_router
+from analytics.api.metrics_router import metrics_router
 from analytics.app_init import app
 
 # === imports from service, analytics, and api ===
@@ -30,6 +31,7 @@ from analytics.middleware.cache_control import NoCacheMiddleware
 setup_logging(json_logs=settings.LOG_JSON_FORMAT, log_level="INFO")
 
 app.include_router(analysis_router)
+app.include_router(metrics_router)
 
 # === Middleware starts ===
 # The order of the middleware is important. The first middleware in the list is the outermost middleware, and the last middleware is the innermost middleware.
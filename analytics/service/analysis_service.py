@@ -1,8 +1,112 @@
+import asyncio
+import hashlib
 import json
-import os
+from collections import Counter
+from contextlib import nullcontext
 
-from analytics.service.json_service import parse_json, strip_openai_json
-from analytics.service.llm_service import basic_chat
+from analytics.config import settings
+from analytics.service.concurrency_service import gather_or_cancel
+from analytics.service.json_service import JSONStreamParser, extract_json
+from analytics.service.llm_service import LLM_ERRORS, basic_chat
+from analytics.service.metrics_service import metrics
+from analytics.service.prompt_service import get_catalogue
+from analytics.service.result_service import get_result_store
+from analytics.service.retry_service import RetryBudget, is_parse_error, parse_retry
+from analytics.service.schema_service import matches_task_schema, unwrap
+from analytics.service.token_service import token_budget
+
+# How the article is fitted into the token budget of the model for each prompt, see
+# token_service.py. The extraction tasks and the summary need the whole text, so a
+# long article is analysed in chunks and their answers are merged. The other tasks
+# mostly need what the article is about, which is in its beginning and end.
+TASK_STRATEGIES = {
+    "people": "chunk",
+    "locations": "chunk",
+    "organisations": "chunk",
+    "summary": "chunk",
+    "hyperlocation": "chunk",
+    "user_need": "head_tail",
+    "tone": "head_tail",
+    "theme": "head_tail",
+    "topics": "head_tail",
+    "combined": "full",
+}
+
+# Rounds of summarising the summaries of the chunks of a long article at most
+SUMMARY_MAX_DEPTH = 3
+
+# The type of the answer to each task, used to check the answers of a combined call.
+# The theme is the plain answer of the LLM, the others are parsed from JSON.
+TASK_TYPES = {
+    "people": list,
+    "locations": list,
+    "organisations": list,
+    "summary": list,
+    "hyperlocation": dict,
+    "user_need": dict,
+    "tone": dict,
+    "theme": str,
+    "topics": list,
+}
+
+ANALYSIS_MODES = ["concurrent", "sequential", "combined"]
+
+
+# Whether the answer of the LLM has JSON in it, which decides if it is worth caching
+def parses_as_json(message):
+    return not is_parse_error(extract_json(message))
+
+
+# Whether the result of a task is an error, or has an error nested in it
+def is_error(result):
+    return isinstance(result, dict) and ("error" in result or has_errors(result))
+
+
+# Whether any of the results is an error
+def has_errors(results):
+    return any(is_error(result) for result in results.values())
+
+
+# The names found in the chunks of an article, in the order they were first found.
+# The same name can be written in a different case in different parts of the text.
+# With `surnames=True` a name that is the end of exactly one longer name, like
+# "Marin" of "Sanna Marin", is taken to be the same person and merged into it.
+def merge_names(results, surnames=False):
+    merged = {}
+    for result in results:
+        for name in result if isinstance(result, list) else []:
+            merged.setdefault(str(name).strip().casefold(), name)
+
+    full_names = {}
+    if surnames:
+        for key in merged:
+            longer = [other for other in merged if other.endswith(f" {key}")]
+            if len(longer) == 1:
+                full_names[key] = longer[0]
+
+    names = {}
+    for key, name in merged.items():
+        if key in full_names:
+            key = full_names[key]
+            name = merged[key]
+        names.setdefault(key, name)
+    return list(names.values())
+
+
+# The location that most chunks of the article give for it, the earliest on a tie
+def merge_locations(results):
+    places = [
+        result
+        for result in results
+        if isinstance(result, dict) and any(result.values())
+    ]
+    if not places:
+        return results[0]
+    cities = Counter(str(place.get("city", "")).casefold() for place in places)
+    city = max(cities, key=cities.get)
+    return next(
+        place for place in places if str(place.get("city", "")).casefold() == city
+    )
 
 
 class AnalysisService:
@@ -17,126 +121,544 @@ class AnalysisService:
             "tone": 0,
             "theme_and_topics": 0,
         }
-        self.themes = self.load_data("../../prompts.json")["themes"]
-        self.prompts = self.load_data("../../prompts.json")["prompts"]
-        self.user_needs = self.load_data("../../prompts.json")["user_needs"]
-        self.tone = self.load_data("../../prompts.json")["tone"]
+        # Snapshot of the prompts, so all tasks of the service use the same version
+        self.catalogue = get_catalogue()
+        self.themes = self.catalogue.themes
+        self.prompts = self.catalogue.prompts
+        self.user_needs = self.catalogue.user_needs
+        self.tone = self.catalogue.tone
         self.model = model
 
-    # Load data from a file
-    def load_data(self, filename):
-        # Try to load from relative path first
-        try:
-            file_path = os.path.abspath(
-                os.path.join(os.path.dirname(__file__), filename)
-            )
-            with open(file_path, "r") as file:
-                data = json.load(file)
-            return data
-        except FileNotFoundError:
-            # If relative path fails, try absolute path
-            try:
-                project_root = os.path.abspath(
-                    os.path.join(os.path.dirname(__file__), "../../..")
-                )
-                file_path = os.path.join(
-                    project_root, "backend_analytics", "prompts.json"
-                )
-                with open(file_path, "r") as file:
-                    data = json.load(file)
-                return data
-            except FileNotFoundError:
-                raise FileNotFoundError(
-                    f"Could not find prompts.json file at {filename} or at {file_path}"
-                )
-
     # Change the model in use for the service
     def change_model(self, model):
         self.model = model
 
-    # Provides context for the LLM. This includes currently only the article that is given for the prompt
-    def context(self, data):
-        cleaned_data = {
+    # The parts of the article that are given to the LLM
+    def clean(self, data):
+        return {
             "title": data.title,
             "kicker": data.kicker,
             "ingress": data.ingress,
             "body": data.body.split("Lue myös:")[0].strip(),
         }
-        return f'Artikkeli: "{cleaned_data}".\n\n'
+
+    # Provides context for the LLM. This includes currently only the article that is given for the prompt
+    def context(self, data):
+        return self.render_context(self.clean(data))
+
+    # The context from the cleaned fields of the article
+    def render_context(self, fields):
+        return f'Artikkeli: "{fields}".\n\n'
+
+    # The context for a prompt with the given instructions, with the body of the
+    # article fitted into the token budget of the model with the strategy of the task
+    def fitted_context(self, data, prompt_name, instructions):
+        fields = self.clean(data)
+        fields["body"] = token_budget.fit(
+            fields["body"],
+            self.model,
+            TASK_STRATEGIES[prompt_name],
+            self.overhead(fields, instructions),
+        )
+        return self.render_context(fields)
+
+    # Tokens of the prompt without the body of the article
+    def overhead(self, fields, instructions):
+        return token_budget.count(
+            self.render_context({**fields, "body": ""}) + instructions
+        )
+
+    # The fields of the article once for each chunk of its body, split to fit the
+    # token budget of the model for the task
+    def chunk_fields(self, fields, prompt_name):
+        bodies = token_budget.split(
+            fields["body"],
+            self.model,
+            self.overhead(fields, self.catalogue.templates[prompt_name]),
+        )
+        return [{**fields, "body": body} for body in bodies]
+
+    # Hash of the article content as it is given to the LLM
+    def content_hash(self, article):
+        data = json.dumps(self.clean(article), sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
 
     # Provides the prompts for the LLM. This includes currently only the article that is given for the prompt
     def build_prompt(self, article, prompt_name):
-        if prompt_name == "theme":
-            return f"{self.context(article)} {self.prompts['theme_and_topics']['theme']}\n\n Teemat: {self.themes}."
-        elif prompt_name == "topics":
-            return (
-                f"{self.context(article)} {self.prompts['theme_and_topics']['topics']}"
+        instructions = self.catalogue.templates[prompt_name]
+        return self.catalogue.render(
+            self.fitted_context(article, prompt_name, instructions), prompt_name
+        )
+
+    # The system message and the user message for the instructions and the context.
+    # The "instructions_first" layout puts the static instructions in the system
+    # message and the article last, so that the calls for the same task share a long
+    # prefix that the provider can cache. "article_first" sends one user message.
+    def layout(self, context, instructions):
+        if settings.PROMPT_LAYOUT == "instructions_first":
+            return instructions.strip(), context
+        elif settings.PROMPT_LAYOUT == "article_first":
+            return None, f"{context}{instructions}"
+        raise ValueError(f"Unknown prompt layout: {settings.PROMPT_LAYOUT}")
+
+    # The system message and the user message for one task
+    def build_messages(self, article, prompt_name):
+        instructions = self.catalogue.templates[prompt_name]
+        return self.layout(
+            self.fitted_context(article, prompt_name, instructions), instructions
+        )
+
+    # Calls the LLM with the prompt, holding the semaphore while the call is running
+    async def chat(
+        self,
+        prompt,
+        prompt_name,
+        semaphore=None,
+        temperature=None,
+        cache=None,
+        system=None,
+        schema=None,
+        accept=None,
+    ):
+        if temperature is None:
+            temperature = self.temperatures[prompt_name]
+        async with semaphore or nullcontext():
+            return await basic_chat(
+                prompt,
+                temperature=temperature,
+                model=self.model,
+                cache=cache,
+                task=prompt_name,
+                system=system,
+                schema=schema,
+                accept=accept,
             )
-        elif prompt_name == "user_need":
-            return f"{self.context(article)} {self.prompts['user_need']}\n\n Käyttäjätarpeet: {self.user_needs}."
-        elif prompt_name == "tone":
-            return f"{self.context(article)} {self.prompts['tone']}\n\n Sävyt: {self.tone}."
-        else:
-            return f"{self.context(article)} {self.prompts[prompt_name]}"
+
+    # Calls the LLM with the prompt and parses the JSON in the answer. The models that
+    # support it answer in the JSON schema of the task, the answers of the others are
+    # extracted from the text. Answers that can't be parsed are retried according to
+    # the retry policy, bypassing the cache, and are never cached themselves so that
+    # the same broken answer isn't served again.
+    async def chat_json(
+        self, prompt, prompt_name, semaphore=None, budget=None, system=None, schema=None
+    ):
+        async def attempt(number):
+            message = await self.chat(
+                prompt,
+                prompt_name,
+                semaphore,
+                temperature=parse_retry.temperature(
+                    self.temperatures[prompt_name], number
+                ),
+                cache=None if number == 1 else False,
+                system=system,
+                schema=schema,
+                accept=parses_as_json,
+            )
+
+            # Find the JSON in the response and parse it into a Python format
+            return unwrap(extract_json(message))
+
+        return await parse_retry.run(attempt, task=prompt_name, budget=budget)
 
     # Analyses one aspect in the article, based on the prompt. Returns json.
-    async def analyse_one(self, article, prompt_name, round=1):
+    async def analyse_one(self, article, prompt_name, semaphore=None, budget=None):
         if prompt_name == "theme_and_topics":
-            theme_prompt = self.build_prompt(article, "theme")
-            message_theme = await basic_chat(
-                theme_prompt,
-                temperature=self.temperatures[prompt_name],
-                model=self.model,
+            theme_system, theme_prompt = self.build_messages(article, "theme")
+            topic_system, topic_prompt = self.build_messages(article, "topics")
+            message_theme, json_topics = await gather_or_cancel(
+                self.chat(theme_prompt, prompt_name, semaphore, system=theme_system),
+                self.chat_json(
+                    topic_prompt,
+                    prompt_name,
+                    semaphore,
+                    budget,
+                    system=topic_system,
+                    schema=self.catalogue.schemas.get("topics"),
+                ),
             )
-            topic_prompt = self.build_prompt(article, "topics")
-            message_topic = await basic_chat(
-                topic_prompt,
-                temperature=self.temperatures[prompt_name],
-                model=self.model,
+            return {
+                "theme": message_theme,
+                "topics": json_topics,
+            }
+        else:
+            if TASK_STRATEGIES[prompt_name] == "chunk":
+                chunks = self.chunk_fields(self.clean(article), prompt_name)
+                if len(chunks) > 1:
+                    return await self.analyse_chunked(
+                        chunks, prompt_name, semaphore, budget
+                    )
+
+            system, full_prompt = self.build_messages(article, prompt_name)
+            return await self.chat_json(
+                full_prompt,
+                prompt_name,
+                semaphore,
+                budget,
+                system=system,
+                schema=self.catalogue.schemas.get(prompt_name),
             )
 
-            # Extract the JSON portion of the response
-            json_str = strip_openai_json(message_topic)
+    # Analyses an article that is too long for one call in chunks, all at the same
+    # time. The names found in the chunks are merged, the location is the one most of
+    # them give, and the summaries of the chunks are summarised into one. `depth` is
+    # the round of summarising that the chunks are for.
+    async def analyse_chunked(
+        self, chunks, prompt_name, semaphore=None, budget=None, depth=1
+    ):
+        metrics.increment("chunked_tasks", task=prompt_name)
+        instructions = self.catalogue.templates[prompt_name]
+        results = await gather_or_cancel(
+            *(
+                self.chat_json(
+                    prompt,
+                    prompt_name,
+                    semaphore,
+                    budget,
+                    system=system,
+                    schema=self.catalogue.schemas.get(prompt_name),
+                )
+                for system, prompt in (
+                    self.layout(self.render_context(fields), instructions)
+                    for fields in chunks
+                )
+            )
+        )
+        # A chunk that failed would leave the answer incomplete
+        for result in results:
+            if is_error(result):
+                return result
 
-            json_full = parse_json(json_str, message_topic)
+        if prompt_name == "summary":
+            return await self.reduce_summaries(
+                chunks[0], results, semaphore, budget, depth
+            )
+        if prompt_name == "hyperlocation":
+            return merge_locations(results)
+        return merge_names(results, surnames=prompt_name == "people")
 
-            if type(json_full) == dict and "error" in json_full.keys() and round <= 3:
-                return self.analyse_one(article, prompt_name, round=round + 1)
-            else:
-                return {
-                    "theme": message_theme,
-                    "topics": json_full,
-                }
+    # Summarises the summaries of the chunks as if they were the body of the article,
+    # in chunks again if they are too long for one call. After SUMMARY_MAX_DEPTH
+    # rounds the points are cut to fit one call, in case the summaries don't get
+    # any shorter.
+    async def reduce_summaries(
+        self, fields, summaries, semaphore=None, budget=None, depth=1
+    ):
+        points = [
+            str(point)
+            for summary in summaries
+            if isinstance(summary, list)
+            for point in summary
+        ]
+        fields = {**fields, "body": "\n".join(points)}
+        instructions = self.catalogue.templates["summary"]
+        if depth < SUMMARY_MAX_DEPTH:
+            chunks = self.chunk_fields(fields, "summary")
+            if len(chunks) > 1:
+                return await self.analyse_chunked(
+                    chunks, "summary", semaphore, budget, depth + 1
+                )
         else:
-            full_prompt = self.build_prompt(article, prompt_name)
-            message = await basic_chat(
-                full_prompt,
-                temperature=self.temperatures[prompt_name],
-                model=self.model,
+            fields["body"] = token_budget.fit(
+                fields["body"],
+                self.model,
+                "full",
+                self.overhead(fields, instructions),
             )
 
-            # Extract the JSON portion of the response
-            json_str = strip_openai_json(message)
+        system, prompt = self.layout(self.render_context(fields), instructions)
+        return await self.chat_json(
+            prompt,
+            "summary",
+            semaphore,
+            budget,
+            system=system,
+            schema=self.catalogue.schemas.get("summary"),
+        )
+
+    # Analyses the given tasks of the article. Returns json with the answers to them.
+    # In "concurrent" mode all tasks are started at once and at most `concurrency`
+    # LLM calls are running at the same time, "sequential" runs them one by one.
+    # A semaphore can be given to share the limit with other analyses.
+    async def analyse_tasks(
+        self, article, prompt_names, mode=None, concurrency=None, semaphore=None
+    ):
+        mode = mode or settings.ANALYSIS_MODE
+        budget = RetryBudget(settings.PARSE_RETRY_BUDGET)
+        results = {}
+
+        if mode == "sequential":
+            # Go through the prompts one by one and store the results.
+            for prompt_name in prompt_names:
+                result = await self.analyse_one(
+                    article, prompt_name, semaphore=semaphore, budget=budget
+                )
+                results[prompt_name] = result
+        elif mode == "concurrent":
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(
+                    concurrency or settings.ANALYSIS_CONCURRENCY
+                )
+            answers = await gather_or_cancel(
+                *(
+                    self.analyse_one(
+                        article, prompt_name, semaphore=semaphore, budget=budget
+                    )
+                    for prompt_name in prompt_names
+                )
+            )
+            results = dict(zip(prompt_names, answers))
+        elif mode == "combined":
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(
+                    concurrency or settings.ANALYSIS_CONCURRENCY
+                )
+            results = await self.analyse_combined(
+                article, prompt_names, semaphore=semaphore, budget=budget
+            )
+        else:
+            raise ValueError(f"Unknown analysis mode: {mode}")
+
+        return results
+
+    # The answer of a combined call to one task, or None if it is missing, isn't of the
+    # right type or doesn't match the schema of the task
+    def combined_answer(self, answer, prompt_name):
+        if prompt_name == "theme_and_topics":
+            theme = self.combined_answer(answer, "theme")
+            topics = self.combined_answer(answer, "topics")
+            if theme is None or topics is None:
+                return None
+            return {"theme": theme, "topics": topics}
 
-            # Parse the JSON string into a Python format
-            json_full = parse_json(json_str, message)
+        value = answer.get(prompt_name.lower())
+        if not isinstance(value, TASK_TYPES[prompt_name]):
+            return None
+        schema = self.catalogue.schemas.get(prompt_name)
+        if schema is not None and not matches_task_schema(value, schema):
+            return None
+        return value
 
-            if type(json_full) == dict and "error" in json_full.keys() and round <= 3:
-                return self.analyse_one(article, prompt_name, round=round + 1)
+    # Analyses the tasks of the article with one LLM call. The answer is checked per
+    # task, and the tasks that are missing or malformed are run again one by one.
+    async def analyse_combined(
+        self, article, prompt_names, semaphore=None, budget=None
+    ):
+        answer = await self.combine_prompts(article, prompt_names, semaphore)
+        if not isinstance(answer, dict) or "error" in answer:
+            answer = {}
+        # The task names in the prompt are capitalised, e.g. "Theme"
+        answer = {str(key).lower(): value for key, value in answer.items()}
+
+        results = {}
+        failed = []
+        for prompt_name in prompt_names:
+            result = self.combined_answer(answer, prompt_name)
+            if result is None:
+                failed.append(prompt_name)
             else:
-                return json_full
+                results[prompt_name] = result
+
+        metrics.increment("combined_tasks", len(results), result="ok")
+        if failed:
+            metrics.increment("combined_tasks", len(failed), result="rerun")
+            answers = await gather_or_cancel(
+                *(
+                    self.analyse_one(
+                        article, prompt_name, semaphore=semaphore, budget=budget
+                    )
+                    for prompt_name in failed
+                )
+            )
+            results.update(zip(failed, answers))
+
+        return {prompt_name: results[prompt_name] for prompt_name in prompt_names}
 
     # Analyses all aspects in the article. Returns json with the answers to all tasks.
-    async def analyse_all(self, article):
-        results = {}
+    async def analyse_all(self, article, mode=None, concurrency=None, semaphore=None):
+        results = await self.analyse_tasks(
+            article,
+            list(self.prompts.keys()),
+            mode=mode,
+            concurrency=concurrency,
+            semaphore=semaphore,
+        )
+        results["prompt_version"] = self.catalogue.version
+        return results
 
-        # Go through all prompts one by one and store the results.
-        for prompt_name in self.prompts.keys():
-            result = await self.analyse_one(article, prompt_name)
-            results[prompt_name] = result
+    # The tasks that have to be rerun, given the previous state of the article. Every
+    # prompt gets the whole cleaned article, so a change to its content reruns every
+    # task, and otherwise only the tasks whose prompts have a new version are rerun.
+    def stale_tasks(self, content_hash, state):
+        if (
+            state is None
+            or state["model"] != self.model
+            or state.get("content_hash") != content_hash
+        ):
+            return list(self.prompts.keys())
+
+        stale = []
+        for prompt_name in self.prompts:
+            previous = state["results"].get(prompt_name)
+            if (
+                previous is None
+                or state["task_versions"].get(prompt_name)
+                != self.catalogue.task_versions[prompt_name]
+                or is_error(previous)
+            ):
+                stale.append(prompt_name)
+        return stale
+
+    # Analyses the article, only rerunning the tasks whose inputs or prompts have
+    # changed since the article was last analysed
+    async def analyse_incremental(self, article, mode=None, semaphore=None):
+        result_store = get_result_store()
+        content_hash = self.content_hash(article)
+        state = await result_store.get_state(article.id)
+        stale = self.stale_tasks(content_hash, state)
 
+        metrics.increment("analysis_tasks", len(stale), result="run")
+        metrics.increment(
+            "analysis_tasks", len(self.prompts) - len(stale), result="reused"
+        )
+
+        if len(stale) == len(self.prompts):
+            results = await self.analyse_all(article, mode=mode, semaphore=semaphore)
+        else:
+            answers = {}
+            if stale:
+                answers = await self.analyse_tasks(
+                    article, stale, mode=mode, semaphore=semaphore
+                )
+            results = {
+                prompt_name: answers[prompt_name]
+                if prompt_name in answers
+                else state["results"][prompt_name]
+                for prompt_name in self.prompts
+            }
+            results["prompt_version"] = self.catalogue.version
+
+        await result_store.set_state(
+            article.id,
+            {
+                "model": self.model,
+                "content_hash": content_hash,
+                "task_versions": self.catalogue.task_versions,
+                "results": {
+                    prompt_name: results[prompt_name] for prompt_name in self.prompts
+                },
+            },
+        )
+        return results
+
+    # Key of the article's results in the result store
+    def result_key(self, content_hash):
+        return f"{content_hash}:{self.catalogue.version}:{self.model}"
+
+    # Analyses the article, or returns the stored results if the same content has
+    # already been analysed with the same prompts and model
+    async def analyse(self, article, mode=None, semaphore=None):
+        result_store = get_result_store()
+        if result_store is None:
+            return await self.analyse_all(article, mode=mode, semaphore=semaphore)
+
+        content_hash = self.content_hash(article)
+        version = self.catalogue.version
+        key = self.result_key(content_hash)
+        stored = await result_store.get(key)
+        if stored is not None:
+            return stored
+
+        if settings.ANALYSIS_INCREMENTAL and article.id:
+            results = await self.analyse_incremental(
+                article, mode=mode, semaphore=semaphore
+            )
+        else:
+            results = await self.analyse_all(article, mode=mode, semaphore=semaphore)
+        if not has_errors(results):
+            await result_store.set(key, content_hash, version, self.model, results)
         return results
 
+    # Analyses all aspects in the article, yielding (task name, result) pairs as soon
+    # as each task finishes. A task that fails yields a dict with the error instead,
+    # so the other tasks keep going.
+    async def analyse_stream(self, article, concurrency=None):
+        content_hash = self.content_hash(article)
+        key = self.result_key(content_hash)
+        result_store = get_result_store()
+        if result_store is not None:
+            stored = await result_store.get(key)
+            if stored is not None:
+                for prompt_name in self.prompts:
+                    yield prompt_name, stored[prompt_name]
+                return
+
+        semaphore = asyncio.Semaphore(concurrency or settings.ANALYSIS_CONCURRENCY)
+        budget = RetryBudget(settings.PARSE_RETRY_BUDGET)
+
+        async def run(prompt_name):
+            try:
+                result = await self.analyse_one(
+                    article, prompt_name, semaphore=semaphore, budget=budget
+                )
+            except LLM_ERRORS as e:
+                result = {"error": str(e)}
+            return prompt_name, result
+
+        tasks = [asyncio.create_task(run(prompt_name)) for prompt_name in self.prompts]
+        results = {}
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                prompt_name, result = await next_done
+                results[prompt_name] = result
+                yield prompt_name, result
+        finally:
+            # Stop the remaining LLM calls if the client goes away
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        results["prompt_version"] = self.catalogue.version
+        if result_store is not None and not has_errors(results):
+            await result_store.set(
+                key, content_hash, self.catalogue.version, self.model, results
+            )
+
+    # The tasks whose answers can be streamed item by item, the ones that answer with
+    # a JSON list or dictionary
+    def streamable_tasks(self):
+        return [
+            prompt_name
+            for prompt_name in self.prompts
+            if TASK_TYPES.get(prompt_name) in (list, dict)
+        ]
+
+    # Streams the answer to one task from the LLM, yielding ("item", item) as soon as
+    # each item of a list, or (key, value) pair of a dictionary, is complete, and at
+    # the end ("result", the whole parsed answer).
+    async def stream_task(self, article, prompt_name, semaphore=None):
+        if prompt_name not in self.streamable_tasks():
+            raise ValueError(f"Task can't be streamed: {prompt_name}")
+
+        system, prompt = self.build_messages(article, prompt_name)
+        parser = JSONStreamParser()
+        pieces = []
+        async with semaphore or nullcontext():
+            stream = await basic_chat(
+                prompt,
+                temperature=self.temperatures[prompt_name],
+                model=self.model,
+                task=prompt_name,
+                system=system,
+                stream=True,
+            )
+            async for piece in stream:
+                pieces.append(piece)
+                for item in parser.feed(piece):
+                    yield "item", item
+
+        yield "result", extract_json("".join(pieces))
+
     # Returns the prompts for the article
     def get_prompts(self, article):
         prompts = {}
@@ -148,31 +670,30 @@ class AnalysisService:
                 prompts[prompt_name] = self.build_prompt(article, prompt_name)
         return prompts
 
-    # Combines the prompts together to mkae less LLM calls during analysis
-    async def combine_prompts(self, article):
+    # Combines the prompts together to mkae less LLM calls during analysis. By default
+    # all tasks are combined, or only the given ones.
+    async def combine_prompts(self, article, prompt_names=None, semaphore=None):
         prompt = "Tehtävänäsi on analysoida artikkeli usealla eri tavalla, ja poimia tietoa artikkelista tehtävän mukaan. Jokaisen tehtävän kohdalla suorita se täysin ennen kuin siirryt seuraavaan. Älä siirry seuraavaan tehtävään ennen kuin nykyinen tehtävä on täysin valmis. Pidä artikkeli aina auki ja referoi siihen tarvittaessa. Tulosta JSON-tiedosto seuraavassa muodossa: {tehtävän nimi: [tehtävä 1:n tulos], tehtävän nimi: [tehtävä 2:n tulos], tehtävän nimi: [tehtävä 3:n tulos], ...}.\n\n"
-        prompt += f"{self.context(article)}"
-        for key in self.prompts.keys():
-            if key == "theme_and_topics":
-                prompt += f"\n\nTehtävä Theme: {self.prompts[key]['theme']}\n\n Teemat: {self.themes}."
-                prompt += f"\n\nTehtävä Topics: {self.prompts[key]['topics']}"
-            elif key == "user_need":
-                prompt += f"\n\nTehtävä {key}: {self.prompts[key]}\n\n Käyttäjätarpeet: {self.user_needs}."
-            elif key == "tone":
-                prompt += (
-                    f"\n\nTehtävä {key}: {self.prompts[key]}\n\n Sävy: {self.tone}"
-                )
-            else:
-                prompt += f"\n\nTehtävä {key}: {self.prompts[key]}"
+        if prompt_names is None or set(prompt_names) == set(self.prompts):
+            tasks = self.catalogue.combined
+        else:
+            tasks = self.catalogue.render_combined(prompt_names)
+        context = self.fitted_context(article, "combined", prompt + tasks)
+        if settings.PROMPT_LAYOUT == "instructions_first":
+            system, prompt = self.layout(context, prompt + tasks.lstrip())
+        else:
+            system = None
+            prompt += context
+            prompt += tasks
 
-        message = await basic_chat(
+        message = await self.chat(
             prompt,
+            "combined",
+            semaphore,
             temperature=0,
-            model=self.model,
+            system=system,
+            accept=parses_as_json,
         )
 
-        # Extract the JSON portion of the response
-        json_str = strip_openai_json(message)
-
-        # Parse the JSON string into a Python format
-        return parse_json(json_str, message)
+        # Find the JSON in the response and parse it into a Python format
+        return extract_json(message)
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from analytics.config import settings
+from analytics.service.metrics_service import metrics
+
+
+# Key for a cached LLM response, a hash of everything that affects the answer
+def cache_key(model, temperature, *parts) -> str:
+    data = json.dumps([model, temperature, *parts], ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class MemoryCache:
+    """LRU cache in the process memory, entries expire after `ttl` seconds."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str):
+        self.entries[key] = (value, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def clear(self):
+        self.entries.clear()
+
+
+class SQLiteCache:
+    """Cache on disk in a SQLite file, so cached answers survive restarts."""
+
+    def __init__(self, path: str, ttl: float):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+
+    def _get(self, key: str):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, expires FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                with self.connection:
+                    self.connection.execute(
+                        "DELETE FROM llm_cache WHERE key = ?", (key,)
+                    )
+                return None
+            return row[0]
+
+    def _set(self, key: str, value: str):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires) "
+                "VALUES (?, ?, ?)",
+                (key, value, time.time() + self.ttl),
+            )
+
+    def _clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM llm_cache")
+
+    async def get(self, key: str):
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str):
+        await asyncio.to_thread(self._set, key, value)
+
+    async def clear(self):
+        await asyncio.to_thread(self._clear)
+
+
+class ResponseCache:
+    """
+    Exact-match cache for LLM responses, keyed on the model, temperature and a
+    hash of the full prompt. By default only calls with a temperature at or
+    below `max_temperature` are cached, as only their answers are repeatable.
+    """
+
+    def __init__(self, backend, max_temperature: float = 0):
+        self.backend = backend
+        self.max_temperature = max_temperature
+
+    def enabled_for(self, temperature: float) -> bool:
+        return self.backend is not None and temperature <= self.max_temperature
+
+    async def get(self, key: str):
+        if self.backend is None:
+            return None
+        value = await self.backend.get(key)
+        metrics.increment("llm_cache", result="hit" if value is not None else "miss")
+        return value
+
+    async def set(self, key: str, value: str):
+        if self.backend is not None and value is not None:
+            await self.backend.set(key, value)
+
+    async def clear(self):
+        if self.backend is not None:
+            await self.backend.clear()
+
+
+def build_cache() -> ResponseCache:
+    if settings.LLM_CACHE_BACKEND == "memory":
+        backend = MemoryCache(settings.LLM_CACHE_MAX_SIZE, settings.LLM_CACHE_TTL)
+    elif settings.LLM_CACHE_BACKEND == "sqlite":
+        backend = SQLiteCache(settings.LLM_CACHE_PATH, settings.LLM_CACHE_TTL)
+    elif settings.LLM_CACHE_BACKEND == "none":
+        backend = None
+    else:
+        raise ValueError(f"Unknown LLM cache backend: {settings.LLM_CACHE_BACKEND}")
+    return ResponseCache(backend, settings.LLM_CACHE_MAX_TEMPERATURE)
+
+
+response_cache = build_cache()
@@ -0,0 +1,137 @@
+import time
+from contextlib import asynccontextmanager
+
+import anthropic
+import openai
+
+from analytics.config import settings
+from analytics.service.metrics_service import metrics
+
+# Errors that mean the provider is down or failing, rather than the request being bad
+PROVIDER_ERRORS = (
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    anthropic.APIConnectionError,
+    anthropic.InternalServerError,
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# State of the breaker as a number for the metrics
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+    def __init__(self, provider: str):
+        super().__init__(f"Circuit breaker open for provider: {provider}")
+        self.provider = provider
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one provider. After `failure_threshold` failures in a row
+    the breaker opens and calls fail fast for `reset_timeout` seconds. Then it
+    goes half-open and lets `half_open_calls` trial calls through: if they succeed
+    it closes again, and if one fails it opens for another `reset_timeout`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        reset_timeout: float,
+        half_open_calls: int = 1,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trials = 0
+        self.publish()
+
+    def publish(self):
+        metrics.set("llm_circuit_state", STATE_VALUES[self.state], provider=self.name)
+
+    def set_state(self, state: str):
+        self.state = state
+        self.trials = 0
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            metrics.increment("llm_circuit_opened", provider=self.name)
+        self.publish()
+
+    # Whether a call may go through now
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self.trials >= self.half_open_calls:
+                return False
+            self.trials += 1
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        if self.state == HALF_OPEN:
+            self.set_state(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.set_state(OPEN)
+
+    # A trial call that ended without telling anything about the provider
+    def record_release(self):
+        if self.state == HALF_OPEN:
+            self.trials = max(0, self.trials - 1)
+
+    @asynccontextmanager
+    async def guard(self):
+        if not self.allow():
+            metrics.increment("llm_circuit_rejected", provider=self.name)
+            raise CircuitOpenError(self.name)
+        try:
+            yield
+        except PROVIDER_ERRORS:
+            self.record_failure()
+            raise
+        except Exception:
+            # The provider answered, even if the request itself failed
+            self.record_success()
+            raise
+        except BaseException:
+            self.record_release()
+            raise
+        else:
+            self.record_success()
+
+
+class CircuitBreakerRegistry:
+    """One circuit breaker per provider, created when the provider is first used."""
+
+    def __init__(self):
+        self.breakers = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                failure_threshold=settings.LLM_BREAKER_FAILURE_THRESHOLD,
+                reset_timeout=settings.LLM_BREAKER_RESET_TIMEOUT,
+                half_open_calls=settings.LLM_BREAKER_HALF_OPEN_CALLS,
+            )
+            self.breakers[name] = breaker
+        return breaker
+
+
+circuit_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,104 @@
+import httpx
+from anthropic import AsyncAnthropic
+from anthropic import DefaultAsyncHttpxClient as AnthropicHttpxClient
+from openai import AsyncAzureOpenAI, AsyncOpenAI
+from openai import DefaultAsyncHttpxClient as OpenAIHttpxClient
+
+from analytics.config import settings
+from analytics.custom_logging import logger
+
+
+class ClientRegistry:
+    """
+    Keeps one long-lived LLM client per (provider, endpoint, key), so that the
+    HTTP connection pool and TLS sessions are reused between requests instead of
+    being thrown away after every call.
+    """
+
+    def __init__(self):
+        self._clients = {}
+
+    # The endpoint and key used for a provider when they are not given explicitly
+    def credentials(self, provider: str) -> tuple[str | None, str]:
+        if provider == "anthropic":
+            return None, settings.ANTHROPIC_API_KEY
+        elif provider == "openai":
+            return None, settings.OPENAI_API_KEY
+        elif provider == "leviathan":
+            return settings.LEVIATHAN_ENDPOINT, "ollama"
+        elif provider == "google":
+            return settings.GOOGLE_ENDPOINT, settings.GOOGLE_API_KEY
+        elif provider == "azure":
+            return settings.AZURE_OPENAI_CHAT_ENDPOINT, settings.AZURE_OPENAI_API_KEY
+        raise ValueError(f"Unknown provider: {provider}")
+
+    def get(
+        self, provider: str, endpoint: str | None = None, api_key: str | None = None
+    ):
+        """
+        Return the shared client for the provider, building it on first use.
+
+        Args:
+            provider (str): Name of the provider, e.g. "azure" or "anthropic".
+            endpoint (str | None): Endpoint to use instead of the configured one.
+            api_key (str | None): Key to use instead of the configured one.
+
+        Returns:
+            AsyncOpenAI | AsyncAzureOpenAI | AsyncAnthropic: The client.
+        """
+        if endpoint is None and api_key is None:
+            endpoint, api_key = self.credentials(provider)
+
+        key = (provider, endpoint, api_key)
+        client = self._clients.get(key)
+        if client is None:
+            client = self._build(provider, endpoint, api_key)
+            self._clients[key] = client
+        return client
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+        )
+
+    def _build(self, provider: str, endpoint: str | None, api_key: str):
+        if provider == "anthropic":
+            return AsyncAnthropic(
+                api_key=api_key,
+                http_client=AnthropicHttpxClient(
+                    limits=self._limits(), http2=settings.LLM_HTTP2
+                ),
+            )
+
+        http_client = OpenAIHttpxClient(limits=self._limits(), http2=settings.LLM_HTTP2)
+        if provider == "azure":
+            return AsyncAzureOpenAI(
+                azure_endpoint=endpoint,
+                api_key=api_key,
+                api_version=settings.AZURE_API_VERSION,
+                http_client=http_client,
+            )
+        return AsyncOpenAI(base_url=endpoint, api_key=api_key, http_client=http_client)
+
+    # Builds the clients for every provider that has been configured
+    def warm_up(self):
+        for provider in ["azure", "openai", "anthropic", "google", "leviathan"]:
+            endpoint, api_key = self.credentials(provider)
+            if provider in ["azure", "google", "leviathan"] and not endpoint:
+                continue
+            if not api_key:
+                continue
+            self.get(provider)
+        logger.info(f"LLM clients ready: {[key[0] for key in self._clients]}")
+
+    # Closes all the clients and their connection pools
+    async def close(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.close()
+
+
+clients = ClientRegistry()
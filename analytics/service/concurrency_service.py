@@ -0,0 +1,143 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import anthropic
+import openai
+
+from analytics.config import settings
+from analytics.service.metrics_service import metrics
+
+# Errors that mean the provider is overloaded and we should send less
+OVERLOAD_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    anthropic.RateLimitError,
+    anthropic.APITimeoutError,
+    asyncio.TimeoutError,
+)
+
+
+# Like asyncio.gather, but the first exception cancels the awaitables that are still
+# running, so that a failed analysis doesn't keep making LLM calls nobody waits for
+async def gather_or_cancel(*aws):
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    if not tasks:
+        return []
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for task in done:
+        if task.exception() is not None:
+            raise task.exception()
+    return [task.result() for task in tasks]
+
+
+class AdaptiveLimiter:
+    """
+    Limit for the number of LLM calls in flight to one provider, adjusted with
+    AIMD (additive increase, multiplicative decrease). The limit grows by about
+    one for every `limit` calls that finish with a stable latency, and is cut by
+    `backoff` when the provider answers with a rate limit error or times out.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        backoff: float = 0.5,
+        latency_tolerance: float = 2.0,
+    ):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.latency = None  # moving average of the call latency in seconds
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+        self.publish()
+
+    def publish(self):
+        metrics.set("llm_concurrency_limit", int(self.limit), provider=self.name)
+        metrics.set("llm_in_flight", self.in_flight, provider=self.name)
+
+    async def acquire(self):
+        async with self.condition:
+            while self.in_flight >= int(self.limit):
+                await self.condition.wait()
+            self.in_flight += 1
+            self.publish()
+
+    async def release(self, latency: float | None = None, overloaded: bool = False):
+        async with self.condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            elif latency is not None:
+                stable = (
+                    self.latency is None
+                    or latency <= self.latency * self.latency_tolerance
+                )
+                if stable:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.latency = (
+                    latency
+                    if self.latency is None
+                    else 0.9 * self.latency + 0.1 * latency
+                )
+            self.publish()
+            self.condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except OVERLOAD_ERRORS:
+            await self.release(overloaded=True)
+            raise
+        except BaseException:
+            await self.release()
+            raise
+        else:
+            await self.release(latency=time.monotonic() - start)
+
+
+class AdaptiveLimiterRegistry:
+    """One adaptive limiter per provider, created when the provider is first used."""
+
+    def __init__(self):
+        self.limiters = {}
+
+    def get(self, name: str) -> AdaptiveLimiter:
+        limiter = self.limiters.get(name)
+        if limiter is None:
+            limiter = AdaptiveLimiter(
+                name,
+                initial=settings.LLM_CONCURRENCY_INITIAL,
+                min_limit=settings.LLM_CONCURRENCY_MIN,
+                max_limit=settings.LLM_CONCURRENCY_MAX,
+                backoff=settings.LLM_CONCURRENCY_BACKOFF,
+                latency_tolerance=settings.LLM_LATENCY_TOLERANCE,
+            )
+            self.limiters[name] = limiter
+        return limiter
+
+    @asynccontextmanager
+    async def slot(self, name: str):
+        if not settings.LLM_ADAPTIVE_CONCURRENCY:
+            yield
+            return
+        async with self.get(name).slot():
+            yield
+
+
+concurrency_limiters = AdaptiveLimiterRegistry()
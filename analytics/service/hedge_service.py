@@ -0,0 +1,108 @@
+import asyncio
+import math
+import time
+from collections import defaultdict, deque
+
+from analytics.config import settings
+from analytics.service.metrics_service import metrics
+
+
+class LatencyTracker:
+    """Latencies of the latest `window` calls per key, for their percentiles."""
+
+    def __init__(self, window: int, min_samples: int):
+        self.min_samples = min_samples
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, key: str, latency: float):
+        self.samples[key].append(latency)
+
+    # The q-th percentile of the latencies, or None until there are enough samples
+    def percentile(self, key: str, q: float) -> float | None:
+        samples = self.samples.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+
+class HedgeBudget:
+    """
+    Caps the tokens spent on hedged calls to `percent` of the tokens of the calls
+    that were hedgeable in the first place.
+    """
+
+    def __init__(self, percent: float):
+        self.percent = percent
+        self.spent = 0
+        self.hedged = 0
+
+    def spend(self, tokens: int):
+        self.spent += tokens
+
+    def take(self, tokens: int) -> bool:
+        if self.hedged + tokens > self.spent * self.percent / 100:
+            return False
+        self.hedged += tokens
+        return True
+
+
+class Hedger:
+    """
+    Hedged requests: if a call hasn't returned within the `percentile` latency of
+    earlier calls with the same key, a duplicate is sent and whichever answers
+    first wins, while the other one is cancelled.
+    """
+
+    def __init__(
+        self,
+        percentile: float,
+        budget_percent: float,
+        window: int = 200,
+        min_samples: int = 20,
+    ):
+        self.percentile = percentile
+        self.latencies = LatencyTracker(window, min_samples)
+        self.budget = HedgeBudget(budget_percent)
+
+    # Runs `primary`, and `hedge` too if the primary is slow. Both are functions that
+    # return a new coroutine for the call.
+    async def run(self, key: str, tokens: int, primary, hedge):
+        self.budget.spend(tokens)
+        delay = self.latencies.percentile(key, self.percentile)
+        start = time.monotonic()
+        first = asyncio.ensure_future(primary())
+        pending = {first}
+        hedged = delay is None
+        error = None
+        try:
+            while pending:
+                timeout = None if hedged else delay - (time.monotonic() - start)
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedged = True
+                    if self.budget.take(tokens):
+                        metrics.increment("llm_hedged_calls", key=key)
+                        pending.add(asyncio.ensure_future(hedge()))
+                    continue
+
+                for task in done:
+                    if task.exception() is None:
+                        self.latencies.record(key, time.monotonic() - start)
+                        if task is not first:
+                            metrics.increment("llm_hedge_wins", key=key)
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+hedger = Hedger(
+    percentile=settings.LLM_HEDGE_PERCENTILE,
+    budget_percent=settings.LLM_HEDGE_BUDGET_PERCENT,
+    min_samples=settings.LLM_HEDGE_MIN_SAMPLES,
+)
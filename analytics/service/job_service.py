@@ -0,0 +1,258 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from functools import lru_cache
+
+from backend_shared.schemas.ingestion_schema import ContentRequest
+
+from analytics.config import settings
+from analytics.custom_logging import logger
+from analytics.service.analysis_service import AnalysisService
+from analytics.service.llm_service import LLM_ERRORS
+from analytics.service.metrics_service import metrics
+
+# How often finished jobs past JOB_RETENTION are deleted, in seconds
+SWEEP_INTERVAL = 60 * 60
+
+
+class JobQueue:
+    """
+    Persistent queue of analysis jobs in SQLite, so that queued jobs survive a
+    restart of the service. Jobs go from "queued" to "running" and end up either
+    "done" with the results or "failed" with the error. A running job is leased
+    to the process that claimed it (`owner`), which keeps renewing the lease while
+    it works. A job whose lease runs out, because its process stopped, is claimed
+    again by any process sharing the file.
+    """
+
+    def __init__(self, path: str, owner: str | None = None, lease: float = 60.0):
+        self.owner = owner or uuid.uuid4().hex
+        self.lease = lease
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, "
+                "status TEXT NOT NULL, "
+                "article TEXT NOT NULL, "
+                "result TEXT, "
+                "error TEXT, "
+                "created REAL NOT NULL, "
+                "updated REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)"
+            )
+            # Files from before the leases don't have their columns yet
+            columns = {
+                row["name"]
+                for row in self.connection.execute("PRAGMA table_info(jobs)")
+            }
+            if "claimed_by" not in columns:
+                self.connection.execute("ALTER TABLE jobs ADD COLUMN claimed_by TEXT")
+            if "lease_until" not in columns:
+                self.connection.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+
+    def _submit(self, article: dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO jobs (id, status, article, created, updated) "
+                "VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, json.dumps(article, ensure_ascii=False), now, now),
+            )
+        return job_id
+
+    def _get(self, job_id: str):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id, status, result, error, created, updated "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    # Takes the oldest queued job, or a running one whose lease has run out, and
+    # leases it to this process
+    def _claim(self):
+        now = time.time()
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "UPDATE jobs SET status = 'running', claimed_by = ?, lease_until = ?, "
+                "updated = ? "
+                "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' "
+                "OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY created LIMIT 1) "
+                "RETURNING id, article",
+                (self.owner, now + self.lease, now, now),
+            ).fetchone()
+        if row is None:
+            return None
+        return row["id"], json.loads(row["article"])
+
+    # Extends the lease of a job that this process is still running. Returns False
+    # if the job has been claimed by another process in the meantime.
+    def _renew(self, job_id: str) -> bool:
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET lease_until = ? "
+                "WHERE id = ? AND status = 'running' AND claimed_by = ?",
+                (time.time() + self.lease, job_id, self.owner),
+            )
+        return cursor.rowcount == 1
+
+    # Only the process that holds the lease finishes the job
+    def _finish(self, job_id: str, status: str, result=None, error=None):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated = ?, "
+                "lease_until = NULL "
+                "WHERE id = ? AND status = 'running' AND claimed_by = ?",
+                (
+                    status,
+                    json.dumps(result, ensure_ascii=False) if result else None,
+                    error,
+                    time.time(),
+                    job_id,
+                    self.owner,
+                ),
+            )
+
+    # Deletes the jobs that finished before `before`
+    def _purge(self, before: float) -> int:
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?",
+                (before,),
+            )
+        return cursor.rowcount
+
+    async def submit(self, article: dict) -> str:
+        return await asyncio.to_thread(self._submit, article)
+
+    async def get(self, job_id: str):
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def claim(self):
+        return await asyncio.to_thread(self._claim)
+
+    async def renew(self, job_id: str) -> bool:
+        return await asyncio.to_thread(self._renew, job_id)
+
+    async def complete(self, job_id: str, result: dict):
+        await asyncio.to_thread(self._finish, job_id, "done", result=result)
+
+    async def fail(self, job_id: str, error: str):
+        await asyncio.to_thread(self._finish, job_id, "failed", error=error)
+
+    async def purge(self, before: float) -> int:
+        return await asyncio.to_thread(self._purge, before)
+
+
+# Runs the analysis for the article of one job
+async def analyse_job(article: dict) -> dict:
+    service = AnalysisService(model=f"{settings.AZURE_RESOURCE_PREFIX}-gpt-4o")
+    return await service.analyse(ContentRequest(**article))
+
+
+class JobWorkers:
+    """
+    Pool of workers inside the service that drain the job queue. Workers are
+    woken up when a job is submitted, and also poll the queue so that jobs whose
+    lease has run out get picked up. While a job runs its lease is renewed, and
+    finished jobs older than JOB_RETENTION are deleted about once an hour.
+    """
+
+    def __init__(self, queue: JobQueue | None = None, handler=analyse_job):
+        self.queue = queue
+        self.handler = handler
+        self.wakeup = asyncio.Event()
+        self.tasks = []
+
+    async def start(self, workers: int):
+        if self.queue is None:
+            self.queue = get_job_queue()
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(workers)]
+        self.tasks.append(asyncio.create_task(self.sweep()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def notify(self):
+        self.wakeup.set()
+
+    # Renews the lease of the job at a third of its length until cancelled
+    async def heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.queue.lease / 3)
+            if not await self.queue.renew(job_id):
+                logger.warning(f"Lost the lease of analysis job {job_id}")
+                return
+
+    async def sweep(self):
+        while True:
+            purged = await self.queue.purge(time.time() - settings.JOB_RETENTION)
+            if purged:
+                logger.info(f"Deleted {purged} finished analysis jobs")
+            await asyncio.sleep(SWEEP_INTERVAL)
+
+    async def work(self):
+        while True:
+            claimed = await self.queue.claim()
+            if claimed is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(
+                        self.wakeup.wait(), timeout=settings.JOB_POLL_INTERVAL
+                    )
+                except TimeoutError:
+                    pass
+                continue
+
+            job_id, article = claimed
+            heartbeat = asyncio.create_task(self.heartbeat(job_id))
+            try:
+                result = await self.handler(article)
+            except (*LLM_ERRORS, ValueError) as e:
+                # The LLM failed, or the article of the job isn't valid
+                logger.warning(f"Analysis job {job_id} failed: {e}")
+                metrics.increment("analysis_jobs", status="failed")
+                await self.queue.fail(job_id, str(e))
+            except Exception:
+                # A bug fails the job with its traceback in the log, and the worker
+                # goes on with the next job
+                logger.exception(f"Analysis job {job_id} failed unexpectedly")
+                metrics.increment("analysis_jobs", status="failed")
+                await self.queue.fail(job_id, "Internal error")
+            else:
+                metrics.increment("analysis_jobs", status="done")
+                await self.queue.complete(job_id, result)
+            finally:
+                heartbeat.cancel()
+
+
+@lru_cache
+def open_job_queue(path: str) -> JobQueue:
+    return JobQueue(path, lease=settings.JOB_LEASE)
+
+
+# The queue at JOB_STORE_PATH, opened on first use so that importing the service
+# doesn't create the file
+def get_job_queue() -> JobQueue:
+    return open_job_queue(settings.JOB_STORE_PATH)
+
+
+job_workers = JobWorkers()
@@ -1,6 +1,14 @@
 import json
 import re
 
+# The characters that matter when following the nesting of JSON in a text
+JSON_TOKENS = re.compile(r'[{}\[\]"\\]')
+JSON_OPENER = re.compile(r"[{\[]")
+OPENERS = {"}": "{", "]": "["}
+DECODER = json.JSONDecoder()
+# Groups nested deeper than this aren't tried, as the decoder would give up on them
+MAX_DEPTH = 500
+
 
 def is_valid_json(s):
     try:
@@ -10,36 +18,203 @@ def is_valid_json(s):
         return False
 
 
-def strip_openai_json(s):
-    if is_valid_json(s):
-        return s
-    else:
-        pattern = r"```json\s*\n(.*?)\n```"
-        match = re.search(pattern, s, re.DOTALL)
-        output = match.group(1).strip() if match else None
+# The JSON candidates in the text from `pos` on, found in one pass that follows the
+# nesting, strings and escapes. Each candidate is a balanced group of brackets, given
+# as (start, end, groups, depth), with the balanced groups directly inside it to try
+# if it doesn't parse, and how deep the nesting in it goes. When brackets never
+# close, or close with the wrong bracket, the groups that closed inside them are
+# candidates of their own, and the scan carries on from there, so every character is
+# only looked at once.
+def scan_json(s, pos=0):
+    stack = []  # (opener, start, the groups that closed inside it)
+    in_string = False
+    escaped = -1
+    for match in JSON_TOKENS.finditer(s, pos):
+        i = match.start()
+        c = s[i]
+        if i == escaped:
+            continue
+        if in_string:
+            if c == "\\":
+                escaped = i + 1
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            # Quotes outside of JSON are just text
+            in_string = bool(stack)
+        elif c in "{[":
+            stack.append((c, i, []))
+        elif c in "}]" and stack:
+            opener, start, groups = stack.pop()
+            if opener != OPENERS[c]:
+                stack.append((opener, start, groups))
+                for _, _, closed in stack:
+                    yield from closed
+                stack.clear()
+            else:
+                depth = 1 + max((group[3] for group in groups), default=0)
+                if stack:
+                    stack[-1][2].append((start, i + 1, groups, depth))
+                else:
+                    yield start, i + 1, groups, depth
+    for _, _, closed in stack:
+        yield from closed
 
-        # Check if the extracted output is valid JSON
-        if output and is_valid_json(output):
-            return output
-        else:
-            # Pattern to extract any JSON-like structure
-            pattern = r'\{(?:[^{}"]|"[^"]*"|\d+|true|false|null)*\}'
-            match = re.search(pattern, s, re.DOTALL)
-            return match.group(0).strip() if match else None
 
+# Where to start looking for JSON: in the ``` fenced block first, if there is one
+def json_starts(s):
+    fence = s.find("```")
+    return (fence, 0) if fence > 0 else (0,)
 
-def parse_json(s, m):
-    try:
-        if s:
-            result = json.loads(s)
-            return result
-        else:
-            return {"error": "Could not extract JSON from response", "raw_response": m}
-    except json.JSONDecodeError as e:
-        # Handle the case where the response isn't valid JSON
-        print(f"Error parsing JSON: {e}")
-        print(f"Raw response: {m}")
-        print(f"Extracted JSON string: {s}")
-
-        # Return a dictionary with error information
-        return {"error": "Failed to parse response as JSON", "raw_response": m}
+
+# The first JSON candidate in the text that parses, as (value, start, end), trying the
+# groups inside a candidate that doesn't parse. Returns None if no candidate parses,
+# and False if there are no candidates at all.
+def find_json(s):
+    found = False
+    for pos in json_starts(s):
+        for candidate in scan_json(s, pos):
+            found = True
+            pending = [candidate]
+            while pending:
+                start, end, groups, depth = pending.pop()
+                if depth > MAX_DEPTH:
+                    pending.extend(reversed(groups))
+                    continue
+                try:
+                    value, parsed_end = DECODER.raw_decode(s, start)
+                except (json.JSONDecodeError, RecursionError):
+                    pending.extend(reversed(groups))
+                    continue
+                if parsed_end == end:
+                    return value, start, end
+                pending.extend(reversed(groups))
+    return None if found else False
+
+
+# The first JSON object or array in the answer of the LLM, parsed into Python. If the
+# answer has no JSON that can be parsed, returns a dict with the error instead.
+def extract_json(message):
+    message = message or ""
+
+    # Usually the first candidate is the answer, so it is parsed straight from the
+    # text, which also finds where it ends. The scan is only needed if it fails.
+    first = JSON_OPENER.search(message, json_starts(message)[0])
+    if first is not None:
+        try:
+            return DECODER.raw_decode(message, first.start())[0]
+        except (json.JSONDecodeError, RecursionError):
+            pass
+
+    found = find_json(message)
+    if found is False:
+        return {
+            "error": "Could not extract JSON from response",
+            "raw_response": message,
+        }
+    if found is None:
+        return {"error": "Failed to parse response as JSON", "raw_response": message}
+    return found[0]
+
+
+# The characters that a JSON value can start with, and what can follow the opening
+# bracket of an array or an object
+VALUE_STARTS = set('"{[-0123456789tfn')
+FIRST_AFTER = {"[": VALUE_STARTS | {"]"}, "{": {'"', "}"}}
+
+
+class JSONStreamParser:
+    """
+    Incremental parser for JSON that the LLM streams in pieces. Gives the items of
+    the top-level array, or the (key, value) pairs of the top-level object, as soon
+    as each one is complete. Text before the JSON, such as a ``` fence, is skipped.
+    A bracket in the text before the JSON is let go of as soon as what follows it
+    can't be the JSON: when it isn't followed by the start of a value, when its
+    first item doesn't parse, or when a ``` fence starts before it has given any
+    items, in which case the JSON is looked for inside the fence.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0  # how far the buffer has been read
+        self.container = None  # "[" or "{" once the top-level JSON has started
+        self.start = None  # where the container started
+        self.item_start = None
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.opened = False  # whether anything but whitespace followed the opener
+        self.found = 0  # items given so far
+        self.done = False
+
+    # Lets go of the current container and looks for the next one from `pos`
+    def restart(self, pos: int):
+        self.container = None
+        self.pos = pos
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    # Adds the next piece of the answer, and returns the items it completed
+    def feed(self, delta: str) -> list:
+        self.buffer += delta
+        items = []
+        while self.pos < len(self.buffer) and not self.done:
+            c = self.buffer[self.pos]
+            if self.container is not None and not self.opened and not c.isspace():
+                if c not in FIRST_AFTER[self.container]:
+                    self.restart(self.start + 1)
+                    continue
+                self.opened = True
+
+            if self.container is None:
+                if c in "{[":
+                    self.container = c
+                    self.start = self.pos
+                    self.depth = 1
+                    self.item_start = self.pos + 1
+                    self.opened = False
+            elif self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif c == "\\":
+                    self.escaped = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c == "`" and not self.found:
+                self.restart(self.pos + 1)
+                continue
+            elif c in "{[":
+                self.depth += 1
+            elif c in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    if not self.complete(items):
+                        self.restart(self.start + 1)
+                        continue
+                    self.done = True
+            elif c == "," and self.depth == 1:
+                if not self.complete(items):
+                    self.restart(self.start + 1)
+                    continue
+                self.item_start = self.pos + 1
+            self.pos += 1
+        return items
+
+    # Parses the item that just ended. Returns False if the first item of the
+    # container doesn't parse, the later ones that aren't valid JSON are skipped.
+    def complete(self, items: list) -> bool:
+        text = self.buffer[self.item_start : self.pos].strip()
+        if not text:
+            return True
+        try:
+            if self.container == "[":
+                items.append(json.loads(text))
+            else:
+                items.extend(json.loads(f"{{{text}}}").items())
+        except json.JSONDecodeError:
+            return self.found > 0
+        self.found += 1
+        return True
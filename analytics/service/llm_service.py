@@ -1,9 +1,8 @@
-from anthropic import AsyncAnthropic
-from openai import (
-    AsyncAzureOpenAI,
-    AsyncOpenAI,
-    RateLimitError,
-)
+import asyncio
+
+import anthropic
+import openai
+from openai import RateLimitError
 from tenacity import (
     retry,
     retry_if_exception_type,
@@ -12,91 +11,262 @@ from tenacity import (
 )
 
 from analytics.config import settings
+from analytics.service.cache_service import cache_key, response_cache
+from analytics.service.circuit_breaker_service import (
+    CircuitOpenError,
+    circuit_breakers,
+)
+from analytics.service.concurrency_service import concurrency_limiters
+from analytics.service.hedge_service import hedger
+from analytics.service.metrics_service import metrics
+from analytics.service.provider_service import (  # noqa: F401
+    Completion,
+    models,
+    providers,
+)
+from analytics.service.rate_limit_service import rate_limiters
+from analytics.service.singleflight_service import llm_calls
+from analytics.service.token_service import estimate_call_tokens
+
+# Errors of the LLM calls that fail one analysis, as opposed to errors in the service
+LLM_ERRORS = (
+    openai.APIError,
+    anthropic.APIError,
+    CircuitOpenError,
+    asyncio.TimeoutError,
+)
+
+
+# API call to the LLMs, retried when the provider is rate limiting
+@retry(
+    stop=stop_after_attempt(10),
+    wait=wait_exponential(multiplier=1, min=1, max=10),
+    retry=retry_if_exception_type(RateLimitError),
+)
+async def chat_with_retry(message, temperature, model, system=None, schema=None):
+    provider = providers.resolve(model)
+
+    # Wait for the provider's rate limits before sending the call
+    limiter = rate_limiters.get(provider.name, model)
+    estimated_tokens = estimate_call_tokens(message, system)
+    if limiter is not None:
+        await limiter.acquire(estimated_tokens)
+
+    # The number of calls in flight adapts to how the provider is coping
+    async with concurrency_limiters.slot(provider.name):
+        completion = await provider.chat(
+            message, temperature, model, system, schema=schema
+        )
+
+    if limiter is not None:
+        limiter.reconcile(estimated_tokens, completion.total_tokens)
+    record_usage(provider.name, model, completion)
+    return completion.text
+
+
+# Counts the prompt tokens of the call and how many of them the provider served
+# from its prompt cache, and keeps the cached share up to date in the metrics
+def record_usage(provider, model, completion):
+    labels = {"provider": provider, "model": model}
+    metrics.increment("llm_prompt_tokens", completion.prompt_tokens, **labels)
+    metrics.increment("llm_cached_tokens", completion.cached_tokens, **labels)
+    prompt_tokens = metrics.get("llm_prompt_tokens", **labels)
+    if prompt_tokens:
+        cached_tokens = metrics.get("llm_cached_tokens", **labels)
+        metrics.set("llm_cached_token_ratio", cached_tokens / prompt_tokens, **labels)
+
+
+# API call behind the circuit breaker of the provider. While the breaker is open the
+# call goes to the fallback model from LLM_FALLBACK_MODELS, or fails straight away.
+# Returns the answer and the model that gave it.
+async def chat_with_breaker(
+    message, temperature, model, system=None, schema=None, tried=()
+):
+    provider = providers.resolve(model)
+    try:
+        async with circuit_breakers.get(provider.name).guard():
+            text = await chat_with_retry(
+                message, temperature, model, system=system, schema=schema
+            )
+            return text, model
+    except CircuitOpenError:
+        fallback = settings.LLM_FALLBACK_MODELS.get(model)
+        if fallback is None or fallback in tried:
+            raise
+        metrics.increment("llm_fallback_calls", model=model, fallback=fallback)
+        return await chat_with_breaker(
+            message,
+            temperature,
+            fallback,
+            system=system,
+            schema=schema,
+            tried=(*tried, model),
+        )
+
 
-# Currently supported models
-models = {
-    "openai": [
-        "gpt-4o",
-        "gpt-4o-mini",
-        "gpt-3.5-turbo",
-        "gpt-4.5-preview",
-        "gpt-4.1",
-        "o4-mini",
-        "o3",
-    ],
-    "azure": [
-        f"{settings.AZURE_RESOURCE_PREFIX}-gpt-4o",
-        f"{settings.AZURE_RESOURCE_PREFIX}-gpt-4o-mini",
-    ],
-    "leviathan": ["llama3.3:70b", "gemma3:27b", "deepseek-r1:32b", "qwq:latest"],
-    "anthropic": [
-        "claude-3-7-sonnet-20250219",
-        "claude-opus-4-20250514",
-        "claude-sonnet-4-20250514",
-    ],
-    "google": [
-        "gemini-2.0-flash",
-    ],
-}
-
-
-# API call to the LLMs
+# API call that is hedged when hedging is on and the call is deterministic. The
+# latency percentile is kept per model and task.
+async def chat_with_hedging(
+    message, temperature, model, system=None, task=None, schema=None
+):
+    if not settings.LLM_HEDGING or temperature != 0:
+        return await chat_with_breaker(
+            message, temperature, model, system=system, schema=schema
+        )
+
+    hedge_model = settings.LLM_HEDGE_MODELS.get(model, model)
+    return await hedger.run(
+        key=f"{model}/{task}" if task else model,
+        tokens=estimate_call_tokens(message, system),
+        primary=lambda: chat_with_breaker(
+            message, temperature, model, system=system, schema=schema
+        ),
+        hedge=lambda: chat_with_breaker(
+            message, temperature, hedge_model, system=system, schema=schema
+        ),
+    )
+
+
+# Opens the stream of the answer and waits for its first piece, retried when the
+# provider is rate limiting. Once the answer has started it isn't retried anymore.
 @retry(
     stop=stop_after_attempt(10),
     wait=wait_exponential(multiplier=1, min=1, max=10),
     retry=retry_if_exception_type(RateLimitError),
 )
+async def open_stream(provider, message, temperature, model, system=None):
+    stream = provider.stream(message, temperature, model, system)
+    return await anext(stream, None), stream
+
+
+# Streamed API call to the LLMs, yielding the pieces of the answer as they come,
+# with the same rate limits, adaptive concurrency and circuit breaker as chat calls
+async def stream_chat(message, temperature, model, system=None):
+    provider = providers.resolve(model)
+
+    limiter = rate_limiters.get(provider.name, model)
+    estimated_tokens = estimate_call_tokens(message, system)
+    if limiter is not None:
+        await limiter.acquire(estimated_tokens)
+
+    # The tokens are accounted for also when the stream fails or the caller stops
+    # reading it early. The usage comes with the last pieces, so a stream cut short
+    # keeps the estimate.
+    usage = Completion(text="")
+    try:
+        async with (
+            circuit_breakers.get(provider.name).guard(),
+            concurrency_limiters.slot(provider.name),
+        ):
+            piece, stream = await open_stream(
+                provider, message, temperature, model, system
+            )
+            try:
+                while piece is not None:
+                    if piece.text:
+                        yield piece.text
+                    usage.prompt_tokens += piece.prompt_tokens
+                    usage.completion_tokens += piece.completion_tokens
+                    usage.cached_tokens += piece.cached_tokens
+                    piece = await anext(stream, None)
+            finally:
+                await stream.aclose()
+    finally:
+        if limiter is not None:
+            limiter.reconcile(estimated_tokens, usage.total_tokens or estimated_tokens)
+        record_usage(provider.name, model, usage)
+
+
+# Key of the answer in the response cache. The schema is part of the key, as the
+# answer in a schema can be shaped differently from the one asked in the prompt.
+def chat_key(message, temperature, model, system=None, schema=None):
+    parts = [system] if system is not None else []
+    if schema is not None:
+        parts.append(schema)
+    return cache_key(model, temperature, *parts, message)
+
+
+# Streamed API call with the response cache. A cached answer comes as one piece, and
+# a streamed answer is cached once it is complete.
+async def cached_stream(message, temperature, model, cache, system=None):
+    key = chat_key(message, temperature, model, system)
+    if cache:
+        cached = await response_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    pieces = []
+    async for piece in stream_chat(message, temperature, model, system):
+        pieces.append(piece)
+        yield piece
+    if cache:
+        await response_cache.set(key, "".join(pieces))
+
+
+# Cached API call, which gives the answer from the cache or calls the LLM and
+# caches the answer, if `accept` doesn't reject it
+async def cached_chat(
+    key, message, temperature, model, system=None, task=None, schema=None, accept=None
+):
+    cached = await response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    result, answered_by = await chat_with_hedging(
+        message, temperature, model, system=system, task=task, schema=schema
+    )
+    # Answers of another model are not cached as answers of the requested one
+    if answered_by == model and (accept is None or accept(result)):
+        await response_cache.set(key, result)
+    return result
+
+
+# API call to the LLMs. The answers are cached when `cache` is True, and by default
+# for the deterministic (temperature 0) calls. Identical deterministic calls that
+# run at the same time share one call to the LLM, whether they are cached or not.
+# A `system` message can be given for the static instructions, which the providers
+# can then cache between calls, and a JSON `schema` that the models that support it
+# answer in. `accept` tells which answers are good enough to cache, e.g. the ones
+# that parse as JSON.
+# With `stream=True` returns an async iterator over the pieces of the answer instead.
 async def basic_chat(
-    message, temperature, model=f"{settings.AZURE_RESOURCE_PREFIX}-gpt-4o"
+    message,
+    temperature,
+    model=f"{settings.AZURE_RESOURCE_PREFIX}-gpt-4o",
+    cache=None,
+    task=None,
+    system=None,
+    stream=False,
+    schema=None,
+    accept=None,
 ):
-    for key, value in models.items():
-        if model in value:
-            if key == "anthropic":
-                client = AsyncAnthropic(
-                    api_key=settings.ANTHROPIC_API_KEY,
-                )
-
-                message = await client.messages.create(
-                    model=model,
-                    max_tokens=4000,
-                    temperature=temperature,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": message,
-                        }
-                    ],
-                )
-
-                return message.content[0].text
-
-            else:
-                if key == "openai":
-                    client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-                elif key == "leviathan":
-                    client = AsyncOpenAI(
-                        base_url=settings.LEVIATHAN_ENDPOINT,
-                        api_key="ollama",
-                    )
-                elif key == "google":
-                    client = AsyncOpenAI(
-                        base_url=settings.GOOGLE_ENDPOINT,
-                        api_key=settings.GOOGLE_API_KEY,
-                    )
-                else:
-                    client = AsyncAzureOpenAI(
-                        azure_endpoint=settings.AZURE_OPENAI_CHAT_ENDPOINT,
-                        api_key=settings.AZURE_OPENAI_API_KEY,
-                        api_version="2024-02-15-preview",
-                    )
-
-                if model == "o4-mini" or model == "o3":
-                    temperature = 1
-
-                completion = await client.chat.completions.create(
-                    model=model,
-                    temperature=temperature,
-                    messages=[{"role": "user", "content": message}],
-                )
-
-                return completion.choices[0].message.content
+    if cache is None:
+        cache = response_cache.enabled_for(temperature)
+    if stream:
+        return cached_stream(message, temperature, model, cache, system=system)
+
+    key = chat_key(message, temperature, model, system, schema)
+
+    async def call():
+        if not cache:
+            result, _ = await chat_with_hedging(
+                message, temperature, model, system=system, task=task, schema=schema
+            )
+            return result
+        return await cached_chat(
+            key,
+            message,
+            temperature,
+            model,
+            system=system,
+            task=task,
+            schema=schema,
+            accept=accept,
+        )
+
+    # Uncached answers at a higher temperature are meant to differ, and a call that
+    # bypasses the cache doesn't take the answer of one that may come from it
+    if not settings.LLM_COALESCE or (temperature > 0 and not cache):
+        return await call()
+    return await llm_calls.run(key if cache else f"{key}:uncached", call)
@@ -0,0 +1,39 @@
+from collections import defaultdict
+
+
+class Metrics:
+    """
+    In-process counters and gauges, e.g. cache hits or the current concurrency
+    limit. Labels are folded into the metric name, like `llm_cache{result=hit}`.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.gauges = {}
+
+    @staticmethod
+    def key(name: str, labels: dict) -> str:
+        if not labels:
+            return name
+        label_str = ",".join(f"{k}={v}" for k, v in sorted(labels.items()))
+        return f"{name}{{{label_str}}}"
+
+    def increment(self, name: str, value: float = 1, **labels):
+        self.counters[self.key(name, labels)] += value
+
+    def set(self, name: str, value: float, **labels):
+        self.gauges[self.key(name, labels)] = value
+
+    def get(self, name: str, **labels) -> float:
+        key = self.key(name, labels)
+        return self.counters.get(key, self.gauges.get(key, 0))
+
+    def snapshot(self) -> dict:
+        return {"counters": dict(self.counters), "gauges": dict(self.gauges)}
+
+    def reset(self):
+        self.counters.clear()
+        self.gauges.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import time
+from functools import lru_cache
+
+from analytics.config import settings
+from analytics.custom_logging import logger
+from analytics.service.schema_service import task_schemas
+
+PROMPTS_FILE = "../../prompts.json"
+
+
+# Finds the prompts file, first relative to this folder and then from the project root
+def resolve_path(filename):
+    file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), filename))
+    if os.path.exists(file_path):
+        return file_path
+
+    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+    fallback_path = os.path.join(project_root, "backend_analytics", "prompts.json")
+    if os.path.exists(fallback_path):
+        return fallback_path
+
+    raise FileNotFoundError(
+        f"Could not find prompts.json file at {file_path} or at {fallback_path}"
+    )
+
+
+# Load data from a file
+def load_data(filename):
+    with open(resolve_path(filename), "r") as file:
+        return json.load(file)
+
+
+class PromptCatalogue:
+    """
+    The prompts from prompts.json, with the static parts of every prompt (the
+    task instructions and the theme, user need and tone lists) rendered into
+    templates once, so that building a prompt only needs the article context.
+    Also holds the JSON schemas of the answers, which follow the same lists.
+    """
+
+    def __init__(self, data: dict, version: str = ""):
+        self.version = version
+        self.prompts = data["prompts"]
+        self.themes = data["themes"]
+        self.user_needs = data["user_needs"]
+        self.tone = data["tone"]
+        self.templates = self.render_templates()
+        self.combined = self.render_combined()
+        self.task_versions = self.render_task_versions()
+        self.schemas = task_schemas(self.tone, self.user_needs)
+
+    # The part of each prompt that comes after the article context
+    def render_templates(self) -> dict[str, str]:
+        templates = {}
+        for key, prompt in self.prompts.items():
+            if key == "theme_and_topics":
+                templates["theme"] = f" {prompt['theme']}\n\n Teemat: {self.themes}."
+                templates["topics"] = f" {prompt['topics']}"
+            elif key == "user_need":
+                templates[key] = f" {prompt}\n\n Käyttäjätarpeet: {self.user_needs}."
+            elif key == "tone":
+                templates[key] = f" {prompt}\n\n Sävyt: {self.tone}."
+            else:
+                templates[key] = f" {prompt}"
+        return templates
+
+    # Version of the prompt of each task, so that a change to one prompt can be told
+    # apart from changes to the others
+    def render_task_versions(self) -> dict[str, str]:
+        versions = {}
+        for key in self.prompts:
+            if key == "theme_and_topics":
+                template = self.templates["theme"] + self.templates["topics"]
+            else:
+                template = self.templates[key]
+            versions[key] = hashlib.sha256(template.encode("utf-8")).hexdigest()[:12]
+        return versions
+
+    # All of the tasks, or the given ones, in one block, used when the tasks are
+    # combined into one prompt
+    def render_combined(self, prompt_names: list[str] | None = None) -> str:
+        combined = ""
+        for key, prompt in self.prompts.items():
+            if prompt_names is not None and key not in prompt_names:
+                continue
+            if key == "theme_and_topics":
+                combined += (
+                    f"\n\nTehtävä Theme: {prompt['theme']}\n\n Teemat: {self.themes}."
+                )
+                combined += f"\n\nTehtävä Topics: {prompt['topics']}"
+            elif key == "user_need":
+                combined += (
+                    f"\n\nTehtävä {key}: {prompt}\n\n"
+                    f" Käyttäjätarpeet: {self.user_needs}."
+                )
+            elif key == "tone":
+                combined += f"\n\nTehtävä {key}: {prompt}\n\n Sävy: {self.tone}"
+            else:
+                combined += f"\n\nTehtävä {key}: {prompt}"
+        return combined
+
+    def render(self, context: str, prompt_name: str) -> str:
+        return f"{context}{self.templates[prompt_name]}"
+
+    @classmethod
+    def from_file(cls, file_path: str) -> "PromptCatalogue":
+        with open(file_path, "rb") as file:
+            raw = file.read()
+        version = hashlib.sha256(raw).hexdigest()[:12]
+        return cls(json.loads(raw), version=version)
+
+
+class PromptStore:
+    """
+    Holds the current PromptCatalogue and swaps in a new one when prompts.json
+    changes on disk. The file's mtime is polled at most once every
+    `reload_interval` seconds, and a new catalogue is only published after it
+    has been fully parsed and rendered, so requests never see a half-loaded one.
+    """
+
+    def __init__(self, filename: str, reload_interval: float):
+        self.file_path = resolve_path(filename)
+        self.reload_interval = reload_interval
+        self.mtime = os.path.getmtime(self.file_path)
+        self.current = PromptCatalogue.from_file(self.file_path)
+        self.checked_at = time.monotonic()
+
+    def get(self) -> PromptCatalogue:
+        if self.reload_interval > 0:
+            now = time.monotonic()
+            if now - self.checked_at >= self.reload_interval:
+                self.checked_at = now
+                self.reload_if_changed()
+        return self.current
+
+    def reload_if_changed(self):
+        try:
+            mtime = os.path.getmtime(self.file_path)
+            if mtime == self.mtime:
+                return
+            catalogue = PromptCatalogue.from_file(self.file_path)
+        except (OSError, ValueError, KeyError) as e:
+            # Keep serving the previous prompts if the new file is broken
+            logger.warning(f"Could not reload prompts from {self.file_path}: {e}")
+            return
+
+        self.mtime = mtime
+        if catalogue.version != self.current.version:
+            logger.info(
+                f"Prompts reloaded: {self.current.version} -> {catalogue.version}"
+            )
+            self.current = catalogue
+
+
+# The store is created once per process and shared by all the services
+@lru_cache(maxsize=1)
+def get_store() -> PromptStore:
+    return PromptStore(PROMPTS_FILE, settings.PROMPTS_RELOAD_INTERVAL)
+
+
+def get_catalogue() -> PromptCatalogue:
+    return get_store().get()
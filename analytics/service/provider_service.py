@@ -0,0 +1,571 @@
+import json
+import random
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+
+import openai
+
+from analytics.config import settings
+from analytics.custom_logging import logger
+from analytics.service.client_service import clients
+from analytics.service.metrics_service import metrics
+from analytics.service.rate_limit_service import RateLimiter
+from analytics.service.token_service import estimate_call_tokens
+
+# Currently supported models
+models = {
+    "openai": [
+        "gpt-4o",
+        "gpt-4o-mini",
+        "gpt-3.5-turbo",
+        "gpt-4.5-preview",
+        "gpt-4.1",
+        "o4-mini",
+        "o3",
+    ],
+    "azure": [
+        f"{settings.AZURE_RESOURCE_PREFIX}-gpt-4o",
+        f"{settings.AZURE_RESOURCE_PREFIX}-gpt-4o-mini",
+    ],
+    "leviathan": ["llama3.3:70b", "gemma3:27b", "deepseek-r1:32b", "qwq:latest"],
+    "anthropic": [
+        "claude-3-7-sonnet-20250219",
+        "claude-opus-4-20250514",
+        "claude-sonnet-4-20250514",
+    ],
+    "google": [
+        "gemini-2.0-flash",
+    ],
+}
+
+
+@dataclass
+class Completion:
+    """Answer of the LLM together with the tokens that the call used."""
+
+    text: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0  # prompt tokens served from the provider's prompt cache
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+class Provider:
+    """
+    Adapter for one LLM provider. Knows which client to use and how to call it,
+    and holds the provider specific quirks, such as models that only accept a
+    fixed temperature, or the models that can answer in a JSON schema.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fixed_temperatures: dict | None = None,
+        structured_models: list[str] = (),
+    ):
+        self.name = name
+        self.fixed_temperatures = fixed_temperatures or {}
+        self.structured_models = set(structured_models)
+
+    def client(self):
+        return clients.get(self.name)
+
+    # The temperature that the model actually accepts
+    def temperature(self, model: str, temperature: float) -> float:
+        return self.fixed_temperatures.get(model, temperature)
+
+    # The JSON schema that the answer is asked in, or None if the model can't answer
+    # in one, when the answer is parsed from its text instead
+    def schema(self, model: str, schema: dict | None) -> dict | None:
+        if not settings.LLM_STRUCTURED_OUTPUT or model not in self.structured_models:
+            return None
+        return schema
+
+    async def chat(
+        self,
+        message: str,
+        temperature: float,
+        model: str,
+        system: str | None = None,
+        schema: dict | None = None,
+    ) -> Completion:
+        raise NotImplementedError
+
+    # Streams the answer as it is generated, as Completions with the new piece of
+    # text. The tokens used come in the piece where the provider reports them.
+    def stream(
+        self, message: str, temperature: float, model: str, system: str | None = None
+    ) -> AsyncIterator[Completion]:
+        raise NotImplementedError
+
+
+class OpenAIProvider(Provider):
+    """
+    Providers with an OpenAI compatible chat completions API. The system message
+    goes first, so that calls sharing it can use the automatic prefix caching.
+    `stream_usage` tells whether the API reports the tokens of streamed answers.
+    A JSON schema is sent as a strict `response_format`. If the API rejects it, the
+    call is sent again without it, and so are the later calls to the same model.
+    """
+
+    def __init__(self, name: str, stream_usage: bool = True, **kwargs):
+        super().__init__(name, **kwargs)
+        self.stream_usage = stream_usage
+        self.schema_rejected = set()
+
+    async def chat(
+        self,
+        message: str,
+        temperature: float,
+        model: str,
+        system: str | None = None,
+        schema: dict | None = None,
+    ) -> Completion:
+        return await self.complete(
+            self.client(),
+            message,
+            temperature,
+            model,
+            system,
+            self.schema(model, schema),
+        )
+
+    async def stream(
+        self, message: str, temperature: float, model: str, system: str | None = None
+    ) -> AsyncIterator[Completion]:
+        async for piece in self.stream_from(
+            self.client(), message, temperature, model, system
+        ):
+            yield piece
+
+    def request(
+        self,
+        message: str,
+        temperature: float,
+        model: str,
+        system: str | None,
+        schema: dict | None = None,
+    ) -> dict:
+        messages = [{"role": "user", "content": message}]
+        if system is not None:
+            messages.insert(0, {"role": "system", "content": system})
+        request = {
+            "model": model,
+            "temperature": self.temperature(model, temperature),
+            "messages": messages,
+        }
+        if schema is not None:
+            request["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "answer", "schema": schema, "strict": True},
+            }
+        return request
+
+    @staticmethod
+    def completion(text: str, usage) -> Completion:
+        details = getattr(usage, "prompt_tokens_details", None)
+        return Completion(
+            text=text,
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+            cached_tokens=getattr(details, "cached_tokens", None) or 0,
+        )
+
+    async def complete(
+        self,
+        client,
+        message: str,
+        temperature: float,
+        model: str,
+        system: str | None = None,
+        schema: dict | None = None,
+    ) -> Completion:
+        if model in self.schema_rejected:
+            schema = None
+        try:
+            completion = await client.chat.completions.create(
+                **self.request(message, temperature, model, system, schema)
+            )
+        except openai.BadRequestError as e:
+            if schema is None or not rejects_schema(e):
+                raise
+            logger.warning(f"{self.name} model {model} doesn't take JSON schemas: {e}")
+            metrics.increment("llm_schema_rejected", provider=self.name, model=model)
+            self.schema_rejected.add(model)
+            return await self.complete(client, message, temperature, model, system)
+        return self.completion(completion.choices[0].message.content, completion.usage)
+
+    async def stream_from(
+        self,
+        client,
+        message: str,
+        temperature: float,
+        model: str,
+        system: str | None = None,
+    ) -> AsyncIterator[Completion]:
+        kwargs = (
+            {"stream_options": {"include_usage": True}} if self.stream_usage else {}
+        )
+        stream = await client.chat.completions.create(
+            **self.request(message, temperature, model, system), stream=True, **kwargs
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield Completion(text=chunk.choices[0].delta.content)
+            if getattr(chunk, "usage", None):
+                yield self.completion("", chunk.usage)
+
+
+# Whether the API rejected the call because of its JSON schema, as older models and
+# API versions do, rather than because of what was asked
+def rejects_schema(error: openai.BadRequestError) -> bool:
+    return any(word in str(error) for word in ("response_format", "json_schema"))
+
+
+class Deployment:
+    """
+    One Azure OpenAI deployment: where it is, which models it serves, how much
+    of the load it should get (`weight`), its own quota, and whether its model
+    version answers in JSON schemas (`structured_output`).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        endpoint: str,
+        api_key: str,
+        deployment: str,
+        models: list[str],
+        weight: float = 1.0,
+        rpm: int | None = None,
+        tpm: int | None = None,
+        structured_output: bool = False,
+    ):
+        self.name = name
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.deployment = deployment
+        self.models = models
+        self.weight = weight
+        self.structured_output = structured_output
+        self.limiter = RateLimiter(f"azure/{name}", rpm=rpm, tpm=tpm)
+        self.outstanding = 0
+        self.cooldown_until = 0.0
+
+    def client(self):
+        return clients.get("azure", self.endpoint, self.api_key)
+
+    def available(self) -> bool:
+        return self.cooldown_until <= time.monotonic()
+
+
+# Errors after which the call is sent to the next deployment
+FAILOVER_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+)
+
+
+class AzureProvider(OpenAIProvider):
+    """
+    Azure OpenAI with a pool of equivalent deployments. Each call goes to the
+    deployment with the fewest outstanding requests for its weight, and if that
+    one answers with a 429 or a 5xx the call fails over to the next one, while
+    the failed deployment sits out for a cooldown.
+    """
+
+    def __init__(self, name: str, deployments: list[Deployment], **kwargs):
+        super().__init__(name, **kwargs)
+        self.deployments = deployments
+
+    def candidates(self, model: str) -> list[Deployment]:
+        serving = [d for d in self.deployments if model in d.models]
+        if not serving:
+            raise ValueError(f"No Azure deployment serves the model: {model}")
+
+        # Least outstanding requests first, random order between equals
+        random.shuffle(serving)
+        serving.sort(key=lambda d: (not d.available(), (d.outstanding + 1) / d.weight))
+        return serving
+
+    async def chat(
+        self,
+        message: str,
+        temperature: float,
+        model: str,
+        system: str | None = None,
+        schema: dict | None = None,
+    ) -> Completion:
+        # Whether the schema is sent depends on the model and on each deployment, which
+        # has to be set up with `structured_output` for it
+        schema = self.schema(model, schema)
+        error = None
+        for deployment in self.candidates(model):
+            estimated_tokens = estimate_call_tokens(message, system)
+            await deployment.limiter.acquire(estimated_tokens)
+            deployment.outstanding += 1
+            try:
+                completion = await self.complete(
+                    deployment.client(),
+                    message,
+                    temperature,
+                    deployment.deployment,
+                    system,
+                    schema if deployment.structured_output else None,
+                )
+            except FAILOVER_ERRORS as e:
+                error = e
+                deployment.cooldown_until = (
+                    time.monotonic() + settings.AZURE_DEPLOYMENT_COOLDOWN
+                )
+                metrics.increment(
+                    "azure_deployment_calls",
+                    deployment=deployment.name,
+                    result="failed",
+                )
+                logger.warning(f"Azure deployment {deployment.name} failed: {e}")
+                continue
+            finally:
+                deployment.outstanding -= 1
+
+            deployment.limiter.reconcile(estimated_tokens, completion.total_tokens)
+            metrics.increment(
+                "azure_deployment_calls", deployment=deployment.name, result="ok"
+            )
+            return completion
+
+        # Every deployment failed, let the caller's retry deal with the last error
+        raise error
+
+    # Streams from the first deployment that starts answering. Once the answer has
+    # started it can't fail over anymore.
+    async def stream(
+        self, message: str, temperature: float, model: str, system: str | None = None
+    ) -> AsyncIterator[Completion]:
+        error = None
+        for deployment in self.candidates(model):
+            estimated_tokens = estimate_call_tokens(message, system)
+            await deployment.limiter.acquire(estimated_tokens)
+            deployment.outstanding += 1
+            started = False
+            used_tokens = 0
+            try:
+                async for piece in self.stream_from(
+                    deployment.client(),
+                    message,
+                    temperature,
+                    deployment.deployment,
+                    system,
+                ):
+                    started = True
+                    used_tokens += piece.total_tokens
+                    yield piece
+            except FAILOVER_ERRORS as e:
+                if started:
+                    raise
+                error = e
+                deployment.cooldown_until = (
+                    time.monotonic() + settings.AZURE_DEPLOYMENT_COOLDOWN
+                )
+                metrics.increment(
+                    "azure_deployment_calls",
+                    deployment=deployment.name,
+                    result="failed",
+                )
+                logger.warning(f"Azure deployment {deployment.name} failed: {e}")
+                continue
+            finally:
+                deployment.outstanding -= 1
+                # Also when the stream fails or the caller stops reading it early. The
+                # usage comes with the last pieces, so a stream cut short keeps the
+                # estimate.
+                deployment.limiter.reconcile(
+                    estimated_tokens, used_tokens or estimated_tokens
+                )
+
+            metrics.increment(
+                "azure_deployment_calls", deployment=deployment.name, result="ok"
+            )
+            return
+
+        raise error
+
+
+# The Azure deployments from the AZURE_DEPLOYMENTS setting, or the single deployment
+# at AZURE_OPENAI_CHAT_ENDPOINT serving the Azure models under their own names
+def load_deployments() -> list[Deployment]:
+    if settings.AZURE_DEPLOYMENTS:
+        return [Deployment(**deployment) for deployment in settings.AZURE_DEPLOYMENTS]
+    return [
+        Deployment(
+            name=model,
+            endpoint=settings.AZURE_OPENAI_CHAT_ENDPOINT,
+            api_key=settings.AZURE_OPENAI_API_KEY,
+            deployment=model,
+            models=[model],
+            structured_output=settings.AZURE_STRUCTURED_OUTPUT,
+        )
+        for model in models["azure"]
+    ]
+
+
+class AnthropicProvider(Provider):
+    """
+    Anthropic messages API. The system message is marked for prompt caching, so
+    calls that share it only pay for it once while the cache is warm. A JSON schema
+    is sent as the input of a tool that the model is made to call.
+    """
+
+    max_tokens = 4000
+    tool = "answer"
+
+    async def chat(
+        self,
+        message: str,
+        temperature: float,
+        model: str,
+        system: str | None = None,
+        schema: dict | None = None,
+    ) -> Completion:
+        schema = self.schema(model, schema)
+        response = await self.client().messages.create(
+            **self.request(message, temperature, model, system, schema)
+        )
+        if schema is None:
+            return self.completion(response.content[0].text, response.usage)
+
+        # The answer is the input of the tool call, given on as JSON text
+        tool_use = next(block for block in response.content if block.type == "tool_use")
+        return self.completion(
+            json.dumps(tool_use.input, ensure_ascii=False), response.usage
+        )
+
+    async def stream(
+        self, message: str, temperature: float, model: str, system: str | None = None
+    ) -> AsyncIterator[Completion]:
+        async with self.client().messages.stream(
+            **self.request(message, temperature, model, system)
+        ) as stream:
+            async for text in stream.text_stream:
+                yield Completion(text=text)
+            response = await stream.get_final_message()
+        yield self.completion("", response.usage)
+
+    def request(
+        self,
+        message: str,
+        temperature: float,
+        model: str,
+        system: str | None,
+        schema: dict | None = None,
+    ) -> dict:
+        request = {
+            "model": model,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature(model, temperature),
+            "messages": [
+                {
+                    "role": "user",
+                    "content": message,
+                }
+            ],
+        }
+        if system is not None:
+            request["system"] = [
+                {
+                    "type": "text",
+                    "text": system,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ]
+        if schema is not None:
+            request["tools"] = [{"name": self.tool, "input_schema": schema}]
+            request["tool_choice"] = {"type": "tool", "name": self.tool}
+        return request
+
+    @staticmethod
+    def completion(text: str, usage) -> Completion:
+        # The input tokens don't include the ones read from or written to the cache
+        cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+        cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+        return Completion(
+            text=text,
+            prompt_tokens=usage.input_tokens + cache_read + cache_write,
+            completion_tokens=usage.output_tokens,
+            cached_tokens=cache_read,
+        )
+
+
+class ProviderRegistry:
+    """
+    Routing table from model name to the provider adapter that serves it. New
+    providers and models can be registered without touching basic_chat.
+    """
+
+    def __init__(self):
+        self.providers = {}
+        self.routes = {}
+
+    def register(self, provider: Provider, models: list[str] = ()) -> Provider:
+        self.providers[provider.name] = provider
+        for model in models:
+            self.routes[model] = provider
+        return provider
+
+    def register_model(self, model: str, provider_name: str):
+        self.routes[model] = self.providers[provider_name]
+
+    def resolve(self, model: str) -> Provider:
+        try:
+            return self.routes[model]
+        except KeyError:
+            raise ValueError(f"Unsupported model: {model}")
+
+
+# Builds the routing table for the models in the config above
+def build_registry() -> ProviderRegistry:
+    registry = ProviderRegistry()
+    # The older OpenAI models and the local Leviathan models don't support JSON
+    # schemas, so their answers are parsed from the text
+    registry.register(
+        OpenAIProvider(
+            "openai",
+            fixed_temperatures={"o4-mini": 1, "o3": 1},
+            structured_models=["gpt-4o", "gpt-4o-mini", "gpt-4.1", "o4-mini", "o3"],
+        ),
+        models["openai"],
+    )
+    deployments = load_deployments()
+    azure_models = models["azure"] + sorted(
+        {model for deployment in deployments for model in deployment.models}
+    )
+    # Only the OpenAI API itself is known to report the tokens of streamed answers.
+    # The Azure deployments each tell whether they take JSON schemas.
+    registry.register(
+        AzureProvider(
+            "azure", deployments, stream_usage=False, structured_models=azure_models
+        ),
+        azure_models,
+    )
+    registry.register(
+        OpenAIProvider("leviathan", stream_usage=False), models["leviathan"]
+    )
+    registry.register(
+        OpenAIProvider(
+            "google", stream_usage=False, structured_models=models["google"]
+        ),
+        models["google"],
+    )
+    registry.register(
+        AnthropicProvider("anthropic", structured_models=models["anthropic"]),
+        models["anthropic"],
+    )
+    return registry
+
+
+providers = build_registry()
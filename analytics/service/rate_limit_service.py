@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+from analytics.config import settings
+from analytics.service.metrics_service import metrics
+
+
+class TokenBucket:
+    """
+    Token bucket that refills `per_minute` units every minute. Waiters are served
+    in the order they arrive, and the level can go below zero when a call turns
+    out to use more than was estimated, which makes the next callers wait longer.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Waits until `amount` units are available and takes them. Returns the wait time.
+    async def acquire(self, amount: float) -> float:
+        # A single call larger than the whole bucket only has to wait for a full one
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        async with self.lock:
+            self._refill()
+            while self.level < amount:
+                delay = (amount - self.level) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+                self._refill()
+            self.level -= amount
+        return waited
+
+    def adjust(self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+
+class RateLimiter:
+    """
+    Client-side limit for requests per minute and tokens per minute of one
+    provider or deployment. Calls wait in a local queue instead of being sent
+    and rejected with a 429.
+    """
+
+    def __init__(self, name: str, rpm: int | None = None, tpm: int | None = None):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    async def acquire(self, estimated_tokens: int):
+        waited = 0.0
+        if self.requests is not None:
+            waited += await self.requests.acquire(1)
+        if self.tokens is not None:
+            waited += await self.tokens.acquire(estimated_tokens)
+        if waited:
+            metrics.increment("rate_limit_wait_seconds", waited, limiter=self.name)
+
+    # Corrects the token bucket with the tokens that the call actually used
+    def reconcile(self, estimated_tokens: int, used_tokens: int):
+        if self.tokens is not None and used_tokens:
+            self.tokens.adjust(used_tokens - estimated_tokens)
+
+
+class RateLimiterRegistry:
+    """
+    Rate limiters built from the LLM_RATE_LIMITS setting, which maps a provider
+    ("azure") or a provider and a model or deployment ("azure/ark-gpt-4o") to
+    its limits, e.g. {"azure/ark-gpt-4o": {"rpm": 300, "tpm": 50000}}.
+    """
+
+    def __init__(self, limits: dict):
+        self.limiters = {
+            name: RateLimiter(name, rpm=limit.get("rpm"), tpm=limit.get("tpm"))
+            for name, limit in limits.items()
+        }
+
+    def get(self, provider: str, model: str | None = None) -> RateLimiter | None:
+        if model is not None and f"{provider}/{model}" in self.limiters:
+            return self.limiters[f"{provider}/{model}"]
+        return self.limiters.get(provider)
+
+
+rate_limiters = RateLimiterRegistry(settings.LLM_RATE_LIMITS)
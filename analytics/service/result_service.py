@@ -0,0 +1,114 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+from analytics.config import settings
+from analytics.service.metrics_service import metrics
+
+
+class ResultStore:
+    """
+    Stores the full analysis of an article in SQLite, indexed by a hash of the
+    cleaned article content, the prompt version and the model. A duplicate
+    submission can then be answered without calling the LLM at all.
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_results ("
+                "key TEXT PRIMARY KEY, "
+                "content_hash TEXT NOT NULL, "
+                "prompt_version TEXT NOT NULL, "
+                "model TEXT NOT NULL, "
+                "result TEXT NOT NULL, "
+                "created REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS analysis_results_content_hash "
+                "ON analysis_results (content_hash)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS article_state ("
+                "article_id TEXT PRIMARY KEY, "
+                "state TEXT NOT NULL, "
+                "updated REAL NOT NULL)"
+            )
+
+    def _get(self, key: str):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT result FROM analysis_results WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set(
+        self, key: str, content_hash: str, prompt_version: str, model: str, result
+    ):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO analysis_results "
+                "(key, content_hash, prompt_version, model, result, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    content_hash,
+                    prompt_version,
+                    model,
+                    json.dumps(result, ensure_ascii=False),
+                    time.time(),
+                ),
+            )
+
+    def _get_state(self, article_id: str):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT state FROM article_state WHERE article_id = ?", (article_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_state(self, article_id: str, state: dict):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO article_state (article_id, state, updated) "
+                "VALUES (?, ?, ?)",
+                (article_id, json.dumps(state, ensure_ascii=False), time.time()),
+            )
+
+    async def get(self, key: str):
+        result = await asyncio.to_thread(self._get, key)
+        metrics.increment("result_store", result="hit" if result else "miss")
+        return result
+
+    async def set(
+        self, key: str, content_hash: str, prompt_version: str, model: str, result
+    ):
+        await asyncio.to_thread(
+            self._set, key, content_hash, prompt_version, model, result
+        )
+
+    # The last analysed version of an article: its content hash, the prompt version of
+    # each task and the results, used for incremental re-analysis
+    async def get_state(self, article_id: str):
+        return await asyncio.to_thread(self._get_state, article_id)
+
+    async def set_state(self, article_id: str, state: dict):
+        await asyncio.to_thread(self._set_state, article_id, state)
+
+
+@lru_cache
+def open_result_store(path: str) -> ResultStore:
+    return ResultStore(path)
+
+
+# The store at RESULT_STORE_PATH, opened on first use so that importing the service
+# doesn't create the file, or None if the store is turned off
+def get_result_store() -> ResultStore | None:
+    if not settings.RESULT_STORE_ENABLED:
+        return None
+    return open_result_store(settings.RESULT_STORE_PATH)
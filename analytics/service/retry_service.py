@@ -0,0 +1,96 @@
+import asyncio
+import random
+
+from analytics.config import settings
+from analytics.service.metrics_service import metrics
+
+
+# Whether the parsed answer of the LLM is the error returned by extract_json
+def is_parse_error(result) -> bool:
+    return isinstance(result, dict) and "error" in result
+
+
+class RetryBudget:
+    """
+    Number of retries that each task of one analysis can use over all of its LLM
+    calls, e.g. the calls for the chunks of a long article. One task with a model
+    that keeps giving broken answers can't use up the retries of the others.
+    """
+
+    def __init__(self, retries: int):
+        self.retries = retries
+        self.used = {}
+
+    def take(self, task: str) -> bool:
+        used = self.used.get(task, 0)
+        if used >= self.retries:
+            return False
+        self.used[task] = used + 1
+        return True
+
+
+class RetryPolicy:
+    """
+    Retries LLM calls whose answer could not be parsed as JSON. Each retry waits
+    for a jittered, exponentially growing delay and can raise the temperature a
+    bit, so that the model doesn't give the same broken answer again.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int,
+        temperature_step: float = 0.0,
+        backoff: float = 0.5,
+        backoff_max: float = 5.0,
+    ):
+        self.max_attempts = max_attempts
+        self.temperature_step = temperature_step
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+
+    # Temperature for the attempt, the first attempt uses the task's own temperature
+    def temperature(self, temperature: float, attempt: int) -> float:
+        return min(1.0, temperature + self.temperature_step * (attempt - 1))
+
+    # Delay before the next attempt, "full jitter" exponential backoff
+    def delay(self, attempt: int) -> float:
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff * 2 ** (attempt - 1))
+        )
+
+    async def run(self, call, task: str, budget: RetryBudget | None = None):
+        """
+        Call `call(attempt)` until it returns something else than a parse error,
+        the attempts run out or the budget is used up.
+
+        Args:
+            call: Async function taking the attempt number (starting from 1).
+            task (str): Name of the task, used for the retry counters.
+            budget (RetryBudget | None): Retries shared with the other calls of
+                the task.
+
+        Returns:
+            The parsed result, or the last parse error.
+        """
+        attempt = 1
+        while True:
+            result = await call(attempt)
+            if not is_parse_error(result):
+                return result
+            if attempt >= self.max_attempts or (
+                budget is not None and not budget.take(task)
+            ):
+                metrics.increment("parse_failures", task=task)
+                return result
+
+            metrics.increment("parse_retries", task=task)
+            await asyncio.sleep(self.delay(attempt))
+            attempt += 1
+
+
+parse_retry = RetryPolicy(
+    max_attempts=settings.PARSE_RETRY_MAX_ATTEMPTS,
+    temperature_step=settings.PARSE_RETRY_TEMPERATURE_STEP,
+    backoff=settings.PARSE_RETRY_BACKOFF,
+    backoff_max=settings.PARSE_RETRY_BACKOFF_MAX,
+)
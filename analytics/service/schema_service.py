@@ -0,0 +1,134 @@
+import re
+
+# The root of a schema has to be an object, so list answers are wrapped under this key
+LIST_KEY = "items"
+
+# A user need in prompts.json is named like "Anna neuvoja (Toimi)", with its base need
+USER_NEED = re.compile(r"^(?P<need>.+?)\s*\((?P<base>[^()]+)\)$")
+
+
+# Object with the given properties, all of them required, as strict schemas need
+def object_schema(properties: dict) -> dict:
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+def list_schema(items: dict) -> dict:
+    return object_schema({LIST_KEY: {"type": "array", "items": items}})
+
+
+# The answer of a list task without the object it was wrapped in for the schema
+def unwrap(result):
+    if isinstance(result, dict) and list(result) == [LIST_KEY]:
+        return result[LIST_KEY]
+    return result
+
+
+# Whether the value is valid against the schema. Covers the parts of JSON schema that
+# the task schemas use: objects with required properties, arrays, strings with or
+# without an enum, and numbers.
+def matches_schema(value, schema: dict) -> bool:
+    kind = schema.get("type")
+    if kind == "object":
+        if not isinstance(value, dict):
+            return False
+        properties = schema.get("properties", {})
+        if any(key not in value for key in schema.get("required", [])):
+            return False
+        if schema.get("additionalProperties") is False and any(
+            key not in properties for key in value
+        ):
+            return False
+        return all(
+            matches_schema(value[key], child)
+            for key, child in properties.items()
+            if key in value
+        )
+    if kind == "array":
+        return isinstance(value, list) and all(
+            matches_schema(item, schema.get("items", {})) for item in value
+        )
+    if kind == "string":
+        return isinstance(value, str) and value in schema.get("enum", [value])
+    if kind == "number":
+        return isinstance(value, int | float) and not isinstance(value, bool)
+    return True
+
+
+# Whether the answer of a task is valid against its schema, with list answers checked
+# without the object they are wrapped in for the schema
+def matches_task_schema(answer, schema: dict) -> bool:
+    if list(schema.get("properties", {})) == [LIST_KEY]:
+        schema = schema["properties"][LIST_KEY]
+    return matches_schema(answer, schema)
+
+
+# {area: {analysis, tone}} with the tone picked from the options of the area
+def tone_schema(tone: dict) -> dict:
+    return object_schema(
+        {
+            area: object_schema(
+                {
+                    "analysis": {"type": "string"},
+                    "tone": {"type": "string", "enum": list(options)},
+                }
+            )
+            for area, options in tone.items()
+        }
+    )
+
+
+# {analysis, drive, scoring, detailed_scoring} as the user_need prompt asks, or None
+# if the needs in prompts.json don't name their base need
+def user_need_schema(user_needs: dict) -> dict | None:
+    bases = list(user_needs["pohjat"])
+    needs = {base: [] for base in bases}
+    for name in user_needs["tarpeet"]:
+        match = USER_NEED.match(name)
+        if match is None or match["base"] not in needs:
+            return None
+        needs[match["base"]].append(match["need"])
+
+    number = {"type": "number"}
+    return object_schema(
+        {
+            "analysis": {"type": "string"},
+            "drive": {"type": "string", "enum": bases},
+            "scoring": object_schema({base: number for base in bases}),
+            "detailed_scoring": object_schema(
+                {
+                    base: object_schema({need: number for need in needs[base]})
+                    for base in bases
+                }
+            ),
+        }
+    )
+
+
+# JSON schema of the answer of each task that answers in JSON. The tone and user need
+# schemas follow the options in prompts.json.
+def task_schemas(tone: dict, user_needs: dict) -> dict[str, dict]:
+    names = list_schema({"type": "string"})
+    schemas = {
+        "people": names,
+        "locations": names,
+        "organisations": names,
+        "summary": names,
+        "topics": names,
+        "hyperlocation": object_schema(
+            {
+                "country": {"type": "string"},
+                "city": {"type": "string"},
+                "neighborhood": {"type": "string"},
+            }
+        ),
+        "tone": tone_schema(tone),
+    }
+    user_need = user_need_schema(user_needs)
+    if user_need is not None:
+        schemas["user_need"] = user_need
+    return schemas
@@ -0,0 +1,52 @@
+import asyncio
+
+from analytics.service.metrics_service import metrics
+
+
+class SingleFlight:
+    """
+    Coalesces identical calls that are in flight at the same time: the first
+    call with a key runs, and the calls that arrive with the same key before it
+    finishes wait for its result instead of running again. The call is cancelled
+    when every caller waiting for it has been cancelled.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = {}
+        self.waiters = {}
+
+    # Runs `call`, a function that returns a new coroutine, unless a call with the
+    # same key is already running
+    async def run(self, key: str, call):
+        future = self.calls.get(key)
+        if future is not None:
+            metrics.increment("coalesced_calls", calls=self.name)
+        else:
+            future = asyncio.ensure_future(call())
+            self.calls[key] = future
+            future.add_done_callback(lambda done: self.finish(key, done))
+
+        self.waiters[future] = self.waiters.get(future, 0) + 1
+        try:
+            # One caller giving up doesn't cancel the call for the others
+            return await asyncio.shield(future)
+        finally:
+            self.waiters[future] -= 1
+            if not self.waiters[future]:
+                del self.waiters[future]
+                # The last caller gave up, so nobody is waiting for the call any more
+                if not future.done():
+                    future.cancel()
+                    if self.calls.get(key) is future:
+                        del self.calls[key]
+
+    def finish(self, key: str, future: asyncio.Future):
+        if self.calls.get(key) is future:
+            del self.calls[key]
+        # Marks the error as seen even if every caller gave up waiting
+        if not future.cancelled():
+            future.exception()
+
+
+llm_calls = SingleFlight("llm")
@@ -0,0 +1,147 @@
+import math
+import re
+
+from analytics.config import settings
+from analytics.service.metrics_service import metrics
+
+# Context windows of the supported models, in tokens. The Leviathan models run on
+# Ollama, which gives them the context it has been configured with, not their full one.
+CONTEXT_LIMITS = {
+    "gpt-4o": 128_000,
+    "gpt-4o-mini": 128_000,
+    "gpt-3.5-turbo": 16_385,
+    "gpt-4.5-preview": 128_000,
+    "gpt-4.1": 1_047_576,
+    "o4-mini": 200_000,
+    "o3": 200_000,
+    f"{settings.AZURE_RESOURCE_PREFIX}-gpt-4o": 128_000,
+    f"{settings.AZURE_RESOURCE_PREFIX}-gpt-4o-mini": 128_000,
+    "llama3.3:70b": 8_192,
+    "gemma3:27b": 8_192,
+    "deepseek-r1:32b": 8_192,
+    "qwq:latest": 8_192,
+    "claude-3-7-sonnet-20250219": 200_000,
+    "claude-opus-4-20250514": 200_000,
+    "claude-sonnet-4-20250514": 200_000,
+    "gemini-2.0-flash": 1_048_576,
+}
+DEFAULT_CONTEXT_LIMIT = 8_192
+
+# Finnish runs at about three characters per token, fewer than English, so the
+# estimate counts three to lean towards fitting
+CHARS_PER_TOKEN = 3
+
+# How the article is fitted into the budget of a task:
+# - "full": the whole text, cut only if it doesn't fit in the context of the model
+# - "head_tail": at most ARTICLE_TOKEN_BUDGET tokens, from the beginning and the end
+# - "chunk": the whole text, in parts that each fit in the context of the model if it
+#   doesn't fit as a whole
+STRATEGIES = ("full", "head_tail", "chunk")
+
+# Share of a cut text that is kept from its beginning, the rest is from its end
+HEAD_SHARE = 0.75
+GAP = "\n\n[...]\n\n"
+
+PARAGRAPHS = re.compile(r"\n+")
+SENTENCES = re.compile(r"(?<=[.!?])\s+")
+
+
+# Estimated number of tokens in a text, for all the models. Used both for fitting
+# the article into the context and for the token rate limits of the providers.
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+# Estimated tokens of an LLM call, the prompt and the expected answer
+def estimate_call_tokens(message: str, system: str | None = None) -> int:
+    return (
+        estimate_tokens(message)
+        + estimate_tokens(system or "")
+        + settings.LLM_EXPECTED_OUTPUT_TOKENS
+    )
+
+
+class TokenBudget:
+    """
+    Fits the article into what is left of the model's context window once the
+    instructions and the answer are counted. The tokens are estimated from the
+    length of the text, the same way for every model.
+    """
+
+    def count(self, text: str) -> int:
+        return estimate_tokens(text)
+
+    def context_limit(self, model: str) -> int:
+        return settings.LLM_CONTEXT_LIMITS.get(
+            model, CONTEXT_LIMITS.get(model, DEFAULT_CONTEXT_LIMIT)
+        )
+
+    # Tokens left for the article, after the rest of the prompt (`overhead`) and the
+    # answer. "head_tail" is also capped by ARTICLE_TOKEN_BUDGET.
+    def budget(self, model: str, strategy: str, overhead: int = 0) -> int:
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown token budget strategy: {strategy}")
+        available = (
+            self.context_limit(model) - overhead - settings.LLM_OUTPUT_TOKEN_RESERVE
+        )
+        if strategy == "head_tail":
+            available = min(available, settings.ARTICLE_TOKEN_BUDGET)
+        return max(available, 1)
+
+    # The first `tokens` tokens of the text, or the last ones with `end=True`
+    def cut(self, text: str, tokens: int, end: bool = False) -> str:
+        chars = tokens * CHARS_PER_TOKEN
+        return text[-chars:] if end else text[:chars]
+
+    # The text fitted into one call. A text over the budget keeps its beginning and
+    # end, where news articles have the most of what they are about. A "chunk" task
+    # that has to be done in one call is fitted like a "full" one.
+    def fit(self, text: str, model: str, strategy: str, overhead: int = 0) -> str:
+        budget = self.budget(model, strategy, overhead)
+        if self.count(text) <= budget:
+            return text
+
+        metrics.increment("article_budget", strategy=strategy, result="cut")
+        budget -= self.count(GAP)
+        head = int(budget * HEAD_SHARE)
+        return self.cut(text, head) + GAP + self.cut(text, budget - head, end=True)
+
+    # The text split into parts that each fit in the context of the model, on
+    # paragraph boundaries, or on sentences within paragraphs that are too long
+    def split(self, text: str, model: str, overhead: int = 0) -> list[str]:
+        budget = self.budget(model, "chunk", overhead)
+        if self.count(text) <= budget:
+            return [text]
+
+        # A sentence longer than the budget is cut at every `budget` tokens
+        step = budget * CHARS_PER_TOKEN
+        pieces = []
+        for paragraph in PARAGRAPHS.split(text):
+            if self.count(paragraph) <= budget:
+                pieces.append(paragraph)
+                continue
+            for sentence in SENTENCES.split(paragraph):
+                pieces.extend(
+                    sentence[start : start + step]
+                    for start in range(0, len(sentence), step)
+                )
+
+        chunks = []
+        chunk, chunk_tokens = [], 0
+        for piece in pieces:
+            if not piece.strip():
+                continue
+            tokens = self.count(piece) + 1  # and the line break
+            if chunk and chunk_tokens + tokens > budget:
+                chunks.append("\n".join(chunk))
+                chunk, chunk_tokens = [], 0
+            chunk.append(piece)
+            chunk_tokens += tokens
+        if chunk:
+            chunks.append("\n".join(chunk))
+
+        metrics.increment("article_budget", strategy="chunk", result="split")
+        return chunks
+
+
+token_budget = TokenBudget()
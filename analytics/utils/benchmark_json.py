@@ -0,0 +1,83 @@
+# Run from the root of the project with `python -m analytics.utils.benchmark_json`
+import json
+import os
+import re
+import timeit
+
+from analytics.service.json_service import extract_json
+
+DATASET = os.path.join(
+    os.path.dirname(__file__), "../../tests/assets/evaluation_dataset.json"
+)
+
+
+# The JSON extraction before extract_json, kept here as the baseline
+def previous_strip_openai_json(s):
+    try:
+        json.loads(s)
+        return s
+    except json.JSONDecodeError:
+        pass
+    match = re.search(r"```json\s*\n(.*?)\n```", s, re.DOTALL)
+    output = match.group(1).strip() if match else None
+    if output:
+        try:
+            json.loads(output)
+            return output
+        except json.JSONDecodeError:
+            pass
+    match = re.search(r'\{(?:[^{}"]|"[^"]*"|\d+|true|false|null)*\}', s, re.DOTALL)
+    return match.group(0).strip() if match else None
+
+
+def previous_extract(message):
+    s = previous_strip_openai_json(message)
+    try:
+        return json.loads(s) if s else None
+    except json.JSONDecodeError:
+        return None
+
+
+# LLM answers built from the expected answers of the evaluation dataset, in the
+# shapes the models answer in: plain JSON, a fenced block, and JSON inside text
+def recorded_outputs():
+    with open(DATASET, encoding="utf-8") as file:
+        dataset = json.load(file)
+
+    outputs = []
+    for article in dataset.values():
+        for answer in article.values():
+            data = json.dumps(answer, ensure_ascii=False, indent=2)
+            outputs.append(data)
+            outputs.append(f"```json\n{data}\n```")
+            outputs.append(
+                f"Tässä analyysi artikkelista:\n\n{data}\n\nToivottavasti auttaa!"
+            )
+    return outputs
+
+
+# Long answers where the previous regex backtracks
+def pathological_outputs():
+    return {
+        "unclosed object with digits": "{" + "1" * 18,
+        "long text with a final object": "Selitys. " * 5000 + '{"city": "Lahti"}',
+        "nested object in text": "Vastaus: " + json.dumps({"a": {"b": [1, {"c": 2}]}}),
+    }
+
+
+def benchmark(name, outputs, number):
+    previous = timeit.timeit(
+        lambda: [previous_extract(o) for o in outputs], number=number
+    )
+    current = timeit.timeit(lambda: [extract_json(o) for o in outputs], number=number)
+    print(
+        f"{name}: previous {previous / number * 1000:.3f} ms, "
+        f"extract_json {current / number * 1000:.3f} ms"
+    )
+
+
+if __name__ == "__main__":
+    outputs = recorded_outputs()
+    benchmark(f"recorded outputs ({len(outputs)})", outputs, number=20)
+    for name, output in pathological_outputs().items():
+        benchmark(name, [output], number=1)
@@ -10,10 +10,27 @@ project_root = os.path.abspath(os.path.join(__file__, "../.."))
 sys.path.append(str(project_root))
 
 from backend_analytics.analytics.config import settings
+from backend_analytics.analytics.service import result_service
 from backend_analytics.analytics.service.analysis_service import AnalysisService
 from backend_analytics.analytics.utils.excel_writer import ExcelWriter
 
 
+# The result store and the job queue of every test are in its own temporary folder,
+# so the tests never read or write the files of a service run from the same folder
+@pytest.fixture(autouse=True)
+def store_paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        result_service.settings,
+        "RESULT_STORE_PATH",
+        str(tmp_path / "analysis_results.sqlite3"),
+    )
+    monkeypatch.setattr(
+        result_service.settings,
+        "JOB_STORE_PATH",
+        str(tmp_path / "analysis_jobs.sqlite3"),
+    )
+
+
 @pytest_asyncio.fixture(scope="function")
 async def async_client():
     async with httpx.AsyncClient() as client:
@@ -8,10 +8,7 @@ import pytest
 project_root = os.path.abspath(os.path.join(__file__, "../.."))
 sys.path.append(str(project_root))
 
-from backend_analytics.analytics.service.json_service import (
-    parse_json,
-    strip_openai_json,
-)
+from backend_analytics.analytics.service.json_service import extract_json
 from backend_analytics.analytics.service.llm_service import basic_chat
 from backend_analytics.analytics.utils.transformer_service import (
     transform_to_content_request,
@@ -137,9 +134,7 @@ async def test_summary(async_client, service, writer):
 
             evaluation = await basic_chat(Eval_prompt, 0, "gpt-4o")
 
-            json_str = strip_openai_json(evaluation)
-
-            result_dict = parse_json(json_str, evaluation)
+            result_dict = extract_json(evaluation)
 
             total = {}
 
@@ -237,9 +232,7 @@ async def test_user_needs_analysis(async_client, service, writer):
 
             evaluation = await basic_chat(Eval_prompt, 0, "gpt-4o")
 
-            json_str = strip_openai_json(evaluation)
-
-            result_dict = parse_json(json_str, evaluation)
+            result_dict = extract_json(evaluation)
 
             total = {}
 
@@ -337,9 +330,7 @@ async def test_tone_analysis(async_client, service, writer):
 
             evaluation = await basic_chat(Eval_prompt, 0, "gpt-4o")
 
-            json_str = strip_openai_json(evaluation)
-
-            result_dict = parse_json(json_str, evaluation)
+            result_dict = extract_json(evaluation)
 
             total = {}
 
@@ -431,9 +422,7 @@ async def test_theme_and_topics(async_client, service, writer):
 
             evaluation = await basic_chat(Eval_prompt, 0, "gpt-4o")
 
-            json_str = strip_openai_json(evaluation)
-
-            result_dict = parse_json(json_str, evaluation)
+            result_dict = extract_json(evaluation)
 
             total = {}
 
@@ -0,0 +1,338 @@
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+# Hold the functions hand to the right folder so that imports work consistantly
+project_root = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.append(str(project_root))
+
+from backend_analytics.analytics.service import analysis_service
+from backend_analytics.analytics.service.analysis_service import (
+    merge_locations,
+    merge_names,
+)
+
+article = SimpleNamespace(id="1", title="title", kicker="", ingress="", body="body")
+
+combined_answer = {
+    "people": ["Matti Meikäläinen"],
+    "locations": ["Jyväskylä"],
+    "organisations": [],
+    "summary": ["Ensimmäinen", "Toinen", "Kolmas"],
+    "hyperlocation": {"country": "Suomi", "city": "Jyväskylä", "neighborhood": ""},
+    # Malformed: doesn't match the schema of the user need
+    "user_need": {"scoring": {}},
+    # Malformed: should be a JSON dictionary
+    "tone": "neutraali",
+    "Theme": "Politiikka",
+    "Topics": ["vaalit"],
+}
+
+
+# The combined mode makes one LLM call, and only reruns the tasks whose answers
+# are missing or malformed
+@pytest.mark.asyncio
+async def test_analyse_combined(service):
+    async def chat(prompt, task=None, **kwargs):
+        if task == "combined":
+            return json.dumps(combined_answer)
+        if task == "tone":
+            return '{"alue": {"tone": "neutraali"}}'
+        return '{"drive": "Tiedä"}'
+
+    chat = AsyncMock(side_effect=chat)
+    with patch("backend_analytics.analytics.service.analysis_service.basic_chat", chat):
+        results = await service.analyse_tasks(
+            article, list(service.prompts.keys()), mode="combined"
+        )
+
+    assert chat.await_count == 3
+    assert {call.kwargs["task"] for call in chat.await_args_list[1:]} == {
+        "user_need",
+        "tone",
+    }
+    assert results["people"] == ["Matti Meikäläinen"]
+    assert results["tone"] == {"alue": {"tone": "neutraali"}}
+    assert results["user_need"] == {"drive": "Tiedä"}
+    assert results["theme_and_topics"] == {"theme": "Politiikka", "topics": ["vaalit"]}
+    assert list(results) == list(service.prompts.keys())
+
+
+# An answer that can't be parsed at all falls back to running every task
+@pytest.mark.asyncio
+async def test_analyse_combined_unparsable(service):
+    chat = AsyncMock(return_value="not json")
+    with (
+        patch("backend_analytics.analytics.service.analysis_service.basic_chat", chat),
+        patch(
+            "backend_analytics.analytics.service.analysis_service.parse_retry.max_attempts",
+            1,
+        ),
+    ):
+        await service.analyse_tasks(article, ["people", "locations"], mode="combined")
+
+    assert [call.kwargs["task"] for call in chat.await_args_list] == [
+        "combined",
+        "people",
+        "locations",
+    ]
+
+
+# The instructions first layout sends the instructions as the system message and the
+# article last, so the same task shares the system message between articles
+@pytest.mark.asyncio
+async def test_instructions_first_layout(service):
+    chat = AsyncMock(return_value='["Matti Meikäläinen"]')
+    other = SimpleNamespace(id="2", title="other", kicker="", ingress="", body="")
+    with (
+        patch("backend_analytics.analytics.service.analysis_service.basic_chat", chat),
+        patch(
+            "backend_analytics.analytics.service.analysis_service.settings.PROMPT_LAYOUT",
+            "instructions_first",
+        ),
+    ):
+        await service.analyse_one(article, "people")
+        await service.analyse_one(other, "people")
+
+    first, second = chat.await_args_list
+    assert first.kwargs["system"] == second.kwargs["system"]
+    assert first.kwargs["system"] == service.catalogue.templates["people"].strip()
+    assert first.args[0] == service.context(article)
+
+
+# A streamed task gives each item as soon as it is complete, and the whole answer last
+@pytest.mark.asyncio
+async def test_stream_task(service):
+    async def pieces():
+        for piece in ['["Matti Meik', 'äläinen", "Maija ', 'Virtanen"]']:
+            yield piece
+
+    chat = AsyncMock(return_value=pieces())
+    with patch("backend_analytics.analytics.service.analysis_service.basic_chat", chat):
+        events = [event async for event in service.stream_task(article, "people")]
+
+    assert chat.await_args.kwargs["stream"] is True
+    assert events == [
+        ("item", "Matti Meikäläinen"),
+        ("item", "Maija Virtanen"),
+        ("result", ["Matti Meikäläinen", "Maija Virtanen"]),
+    ]
+    assert "theme_and_topics" not in service.streamable_tasks()
+
+
+# Tasks are asked in their JSON schema, and list answers are unwrapped from it
+@pytest.mark.asyncio
+async def test_analyse_one_schema(service):
+    chat = AsyncMock(return_value='{"items": ["Matti Meikäläinen"]}')
+    with patch("backend_analytics.analytics.service.analysis_service.basic_chat", chat):
+        result = await service.analyse_one(article, "people")
+
+    assert result == ["Matti Meikäläinen"]
+    assert chat.await_args.kwargs["schema"] == service.catalogue.schemas["people"]
+
+
+# A long article is cut for the tasks with a token budget, and sent whole to the
+# extraction tasks while it fits in the context of the model
+def test_article_token_budget(service):
+    body = "\n".join(f"Kappale {i}. " + "Sanoja. " * 10 for i in range(60))
+    long_article = SimpleNamespace(
+        id="3", title="title", kicker="", ingress="", body=body
+    )
+    with patch(
+        "backend_analytics.analytics.service.analysis_service.settings.ARTICLE_TOKEN_BUDGET",
+        500,
+    ):
+        _, tone_prompt = service.build_messages(long_article, "tone")
+        _, people_prompt = service.build_messages(long_article, "people")
+
+    assert "Kappale 0." in tone_prompt and "Kappale 59." in tone_prompt
+    assert "Kappale 30." not in tone_prompt
+    assert "Kappale 30." in people_prompt
+
+
+long_body = "\n".join(f"Kappale {i}. " + "Sanoja. " * 10 for i in range(60))
+long_article = SimpleNamespace(
+    id="4", title="title", kicker="", ingress="", body=long_body
+)
+
+
+# A context that leaves `tokens` tokens for the body of the long article in the task
+def small_context(service, prompt_name, tokens=500):
+    overhead = service.overhead(
+        service.clean(long_article), service.catalogue.templates[prompt_name]
+    )
+    return patch(
+        "backend_analytics.analytics.service.analysis_service.settings.LLM_CONTEXT_LIMITS",
+        {
+            service.model: overhead
+            + analysis_service.settings.LLM_OUTPUT_TOKEN_RESERVE
+            + tokens
+        },
+    )
+
+
+# A long article is analysed in chunks at the same time, and the names found in them
+# are merged without duplicates
+@pytest.mark.asyncio
+async def test_analyse_chunked_names(service):
+    async def chat(prompt, **kwargs):
+        if "Kappale 0." in prompt:
+            return '["Matti Meikäläinen", "Helsinki"]'
+        return '["matti meikäläinen", "Maija Virtanen"]'
+
+    chat = AsyncMock(side_effect=chat)
+    with (
+        patch("backend_analytics.analytics.service.analysis_service.basic_chat", chat),
+        small_context(service, "people"),
+    ):
+        result = await service.analyse_one(long_article, "people")
+
+    assert chat.await_count > 1
+    assert result == ["Matti Meikäläinen", "Helsinki", "Maija Virtanen"]
+    # Every chunk keeps the title of the article, and only a part of its body
+    prompts = [call.args[0] for call in chat.await_args_list]
+    assert all("'title': 'title'" in prompt for prompt in prompts)
+    assert sum("Kappale 30." in prompt for prompt in prompts) == 1
+
+
+# The summaries of the chunks are summarised into one
+@pytest.mark.asyncio
+async def test_analyse_chunked_summary(service):
+    async def chat(prompt, **kwargs):
+        if "Kappale" in prompt:
+            return '["Osan kohta"]'
+        return '["Yhteenveto"]'
+
+    chat = AsyncMock(side_effect=chat)
+    with (
+        patch("backend_analytics.analytics.service.analysis_service.basic_chat", chat),
+        small_context(service, "summary"),
+    ):
+        result = await service.analyse_one(long_article, "summary")
+
+    assert result == ["Yhteenveto"]
+    assert "Osan kohta" in chat.await_args.args[0]
+
+
+# The concurrent mode has at most ANALYSIS_CONCURRENCY calls in flight, and the
+# first task that fails cancels the calls of the others
+@pytest.mark.asyncio
+async def test_analyse_concurrent_limit_and_cancel(service):
+    started, in_flight, peak, cancelled = 0, 0, 0, 0
+
+    async def chat(prompt, task=None, **kwargs):
+        nonlocal started, in_flight, peak, cancelled
+        started += 1
+        in_flight += 1
+        peak = max(peak, in_flight)
+        try:
+            await asyncio.sleep(0.01 if task == "people" else 10)
+        except asyncio.CancelledError:
+            cancelled += 1
+            raise
+        finally:
+            in_flight -= 1
+        raise RuntimeError("provider down")
+
+    with (
+        patch(
+            "backend_analytics.analytics.service.analysis_service.basic_chat",
+            AsyncMock(side_effect=chat),
+        ),
+        pytest.raises(RuntimeError),
+    ):
+        await asyncio.wait_for(
+            service.analyse_tasks(
+                article, list(service.prompts), mode="concurrent", concurrency=3
+            ),
+            timeout=1,
+        )
+
+    assert peak == 3
+    assert in_flight == 0
+    # Every call but the failed one was cancelled, and the rest never started
+    assert cancelled == started - 1
+    assert started < len(service.prompts)
+
+
+# A client that stops reading the stream leaves no LLM call running behind it
+@pytest.mark.asyncio
+async def test_analyse_stream_closed_early(service):
+    in_flight = 0
+
+    async def chat(prompt, task=None, **kwargs):
+        nonlocal in_flight
+        in_flight += 1
+        try:
+            await asyncio.sleep(0 if task == "people" else 10)
+        finally:
+            in_flight -= 1
+        return json.dumps(["Matti Meikäläinen"])
+
+    with patch(
+        "backend_analytics.analytics.service.analysis_service.basic_chat",
+        AsyncMock(side_effect=chat),
+    ):
+        stream = service.analyse_stream(article)
+        prompt_name, _ = await anext(stream)
+        assert prompt_name == "people"
+        await stream.aclose()
+        assert in_flight == 0
+
+
+# Summaries that don't get shorter are only summarised again a few times, and then
+# cut to fit one call
+@pytest.mark.asyncio
+async def test_reduce_summaries_max_depth(service):
+    async def chat(prompt, **kwargs):
+        return json.dumps([f"Kappale {i}. " + "Sanoja. " * 10 for i in range(20)])
+
+    chat = AsyncMock(side_effect=chat)
+    with (
+        patch("backend_analytics.analytics.service.analysis_service.basic_chat", chat),
+        small_context(service, "summary"),
+    ):
+        result = await asyncio.wait_for(
+            service.analyse_one(long_article, "summary"), timeout=5
+        )
+
+    assert len(result) == 20
+    # The last round is one call with the points cut to fit
+    assert "[...]" in chat.await_args.args[0]
+
+
+# A surname is merged into the only full name it ends, but only for people
+def test_merge_names():
+    results = [["Marin", "Petteri Orpo"], ["Sanna Marin", "orpo"], ["Riikka Purra"]]
+    assert merge_names(results, surnames=True) == [
+        "Sanna Marin",
+        "Petteri Orpo",
+        "Riikka Purra",
+    ]
+    assert merge_names(results) == [
+        "Marin",
+        "Petteri Orpo",
+        "Sanna Marin",
+        "orpo",
+        "Riikka Purra",
+    ]
+    # A surname of two people can't be told apart
+    assert merge_names([["Marin", "Sanna Marin", "Mika Marin"]], surnames=True) == [
+        "Marin",
+        "Sanna Marin",
+        "Mika Marin",
+    ]
+
+
+def test_merge_locations():
+    helsinki = {"country": "Suomi", "city": "Helsinki", "neighborhood": "Eira"}
+    jyvaskyla = {"country": "Suomi", "city": "Jyväskylä", "neighborhood": ""}
+    empty = {"country": "", "city": "", "neighborhood": ""}
+    assert merge_locations([jyvaskyla, helsinki, empty, helsinki]) == helsinki
+    assert merge_locations([jyvaskyla, helsinki]) == jyvaskyla
+    assert merge_locations([empty, empty]) == empty
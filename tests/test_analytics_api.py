@@ -1,4 +1,5 @@
-from unittest.mock import patch
+import json
+from unittest.mock import AsyncMock, patch
 
 import pytest
 from fastapi import FastAPI
@@ -21,3 +22,176 @@ def test_analyse_endpoint(request_data, mock_analyse_all_response):
     ):
         response = client.post("/analyse", json=request_data)
         assert response.status_code == 200
+        # The prompt version is only in the header, the response model drops the field
+        assert response.headers["X-Prompt-Version"]
+
+
+@pytest.mark.api
+def test_analyse_batch_endpoint(request_data, mock_analyse_all_response):
+    failing = dict(request_data, id="failing")
+
+    async def analyse(article, **kwargs):
+        if article.id == "failing":
+            raise TimeoutError("LLM call failed")
+        return mock_analyse_all_response
+
+    # One article whose LLM calls fail should not sink the rest of the batch
+    with patch(
+        "analytics.service.analysis_service.AnalysisService.analyse",
+        side_effect=analyse,
+    ):
+        response = client.post("/analyse/batch", json=[request_data, failing])
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert results[0]["id"] == request_data["id"]
+        assert results[0]["result"] == mock_analyse_all_response
+        assert results[0]["error"] is None
+        assert results[1]["id"] == "failing"
+        assert results[1]["result"] is None
+        assert "LLM call failed" in results[1]["error"]
+
+
+# A bug in the analysis of one article fails only that article
+@pytest.mark.api
+def test_analyse_batch_endpoint_bug(request_data, mock_analyse_all_response):
+    failing = dict(request_data, id="failing")
+
+    async def analyse(article, **kwargs):
+        if article.id == "failing":
+            raise KeyError("people")
+        return mock_analyse_all_response
+
+    with patch(
+        "analytics.service.analysis_service.AnalysisService.analyse",
+        side_effect=analyse,
+    ):
+        response = client.post("/analyse/batch", json=[failing, request_data])
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert results[0]["id"] == "failing"
+        assert results[0]["result"] is None
+        assert results[0]["error"] == "Internal error"
+        assert results[1]["result"] == mock_analyse_all_response
+        assert results[1]["error"] is None
+
+
+@pytest.mark.api
+def test_analyse_endpoint_unknown_mode(request_data):
+    response = client.post("/analyse?mode=parallel", json=request_data)
+    assert response.status_code == 400
+
+
+def stream_patch(mock_analyse_all_response):
+    async def analyse_one(article, prompt_name, **kwargs):
+        return mock_analyse_all_response[prompt_name]
+
+    return patch(
+        "analytics.service.analysis_service.AnalysisService.analyse_one",
+        side_effect=analyse_one,
+    )
+
+
+# One line of JSON per task as it finishes, and a final line when all are done
+@pytest.mark.api
+def test_analyse_stream_ndjson(request_data, mock_analyse_all_response):
+    with stream_patch(mock_analyse_all_response):
+        response = client.post("/analyse/stream", json=request_data)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == len(mock_analyse_all_response) + 1
+    for line in lines[:-1]:
+        assert line["result"] == mock_analyse_all_response[line["task"]]
+    assert lines[-1] == {
+        "done": True,
+        "prompt_version": response.headers["X-Prompt-Version"],
+    }
+
+
+# The same events as server-sent events, each ending in a blank line
+@pytest.mark.api
+def test_analyse_stream_sse(request_data, mock_analyse_all_response):
+    with stream_patch(mock_analyse_all_response):
+        response = client.post("/analyse/stream?format=sse", json=request_data)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    assert response.text.endswith("\n\n")
+    events = [event.split("\n") for event in response.text[:-2].split("\n\n")]
+    assert all(len(event) == 2 for event in events)
+    assert all(event[0] == "event: result" for event in events[:-1])
+    assert events[-1][0] == "event: done"
+    assert json.loads(events[-1][1].removeprefix("data: "))["done"] is True
+
+
+async def streamed_answer(*pieces):
+    for piece in pieces:
+        yield piece
+
+
+# The items of one task are sent as the LLM writes them, and the whole answer last
+@pytest.mark.api
+@pytest.mark.parametrize("format", ["ndjson", "sse"])
+def test_analyse_stream_task(request_data, format):
+    chat = AsyncMock(
+        return_value=streamed_answer('["Helena ', 'Virtanen", "Ville', ' Lahtinen"]')
+    )
+    with patch("analytics.service.analysis_service.basic_chat", chat):
+        response = client.post(
+            f"/analyse/stream/people?format={format}", json=request_data
+        )
+    assert response.status_code == 200
+
+    if format == "sse":
+        events = response.text[:-2].split("\n\n")
+        names = [event.split("\n")[0] for event in events]
+        assert names == ["event: item", "event: item", "event: done"]
+        data = [json.loads(event.split("\n")[1][len("data: ") :]) for event in events]
+    else:
+        data = [json.loads(line) for line in response.text.splitlines()]
+    assert data == [
+        {"task": "people", "item": "Helena Virtanen"},
+        {"task": "people", "item": "Ville Lahtinen"},
+        {
+            "task": "people",
+            "result": ["Helena Virtanen", "Ville Lahtinen"],
+            "done": True,
+        },
+    ]
+
+
+async def failing_answer(*pieces):
+    for piece in pieces:
+        yield piece
+    raise TimeoutError("LLM call timed out")
+
+
+# An LLM error after the stream has started ends it with an error event
+@pytest.mark.api
+@pytest.mark.parametrize("format", ["ndjson", "sse"])
+def test_analyse_stream_task_error(request_data, format):
+    chat = AsyncMock(return_value=failing_answer('["Helena Virtanen", "Ville'))
+    with patch("analytics.service.analysis_service.basic_chat", chat):
+        response = client.post(
+            f"/analyse/stream/people?format={format}", json=request_data
+        )
+    assert response.status_code == 200
+
+    if format == "sse":
+        events = response.text[:-2].split("\n\n")
+        names = [event.split("\n")[0] for event in events]
+        assert names == ["event: item", "event: error"]
+        data = [json.loads(event.split("\n")[1][len("data: ") :]) for event in events]
+    else:
+        data = [json.loads(line) for line in response.text.splitlines()]
+    assert data == [
+        {"task": "people", "item": "Helena Virtanen"},
+        {"task": "people", "error": "LLM call timed out", "done": True},
+    ]
+
+
+@pytest.mark.api
+def test_analyse_stream_task_not_streamable(request_data):
+    response = client.post("/analyse/stream/theme_and_topics", json=request_data)
+    assert response.status_code == 422
@@ -0,0 +1,138 @@
+import asyncio
+import os
+import sys
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+# Hold the functions hand to the right folder so that imports work consistantly
+project_root = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.append(str(project_root))
+
+from backend_analytics.analytics.service.cache_service import (
+    MemoryCache,
+    ResponseCache,
+    SQLiteCache,
+    cache_key,
+)
+from backend_analytics.analytics.service.llm_service import Completion, basic_chat
+
+
+# The key changes with every part of the call
+def test_cache_key():
+    key = cache_key("gpt-4o", 0, "prompt")
+    assert key == cache_key("gpt-4o", 0, "prompt")
+    assert key != cache_key("gpt-4o-mini", 0, "prompt")
+    assert key != cache_key("gpt-4o", 0.5, "prompt")
+    assert key != cache_key("gpt-4o", 0, "another prompt")
+
+
+# The memory cache drops the least recently used entry when it is full
+@pytest.mark.asyncio
+async def test_memory_cache_lru():
+    cache = MemoryCache(max_size=2, ttl=60)
+    await cache.set("a", "1")
+    await cache.set("b", "2")
+    await cache.get("a")
+    await cache.set("c", "3")
+    assert await cache.get("a") == "1"
+    assert await cache.get("b") is None
+    assert await cache.get("c") == "3"
+
+
+# Entries expire after the ttl
+@pytest.mark.asyncio
+async def test_memory_cache_ttl():
+    cache = MemoryCache(max_size=2, ttl=0.01)
+    await cache.set("a", "1")
+    await asyncio.sleep(0.02)
+    assert await cache.get("a") is None
+
+
+@pytest.mark.asyncio
+async def test_sqlite_cache(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SQLiteCache(path, ttl=60)
+    await cache.set("a", "1")
+    assert await cache.get("a") == "1"
+
+    # A new connection to the same file still has the entry
+    assert await SQLiteCache(path, ttl=60).get("a") == "1"
+    assert await cache.get("b") is None
+
+
+# Only deterministic calls are cached by default
+def test_cache_enabled_for():
+    cache = ResponseCache(MemoryCache(max_size=2, ttl=60), max_temperature=0)
+    assert cache.enabled_for(0)
+    assert not cache.enabled_for(0.5)
+    assert not ResponseCache(None).enabled_for(0)
+
+
+# A second identical call is served from the cache without calling the LLM
+@pytest.mark.asyncio
+async def test_basic_chat_cache():
+    cache = ResponseCache(MemoryCache(max_size=10, ttl=60), max_temperature=0)
+    chat = AsyncMock(return_value="14")
+    with (
+        patch("backend_analytics.analytics.service.llm_service.response_cache", cache),
+        patch("backend_analytics.analytics.service.llm_service.chat_with_retry", chat),
+    ):
+        assert await basic_chat("What is 2+12?", 0, model="gpt-4o") == "14"
+        assert await basic_chat("What is 2+12?", 0, model="gpt-4o") == "14"
+        assert chat.await_count == 1
+
+        # Calls with a higher temperature always go to the LLM
+        await basic_chat("What is 2+12?", 1, model="gpt-4o")
+        await basic_chat("What is 2+12?", 1, model="gpt-4o")
+        assert chat.await_count == 3
+
+
+# Answers that `accept` rejects, e.g. ones that don't parse, are not cached
+@pytest.mark.asyncio
+async def test_basic_chat_cache_accept():
+    cache = ResponseCache(MemoryCache(max_size=10, ttl=60), max_temperature=0)
+    chat = AsyncMock(side_effect=["not json", '["Matti"]', "not used"])
+
+    def accept(answer):
+        return answer.startswith("[")
+
+    with (
+        patch("backend_analytics.analytics.service.llm_service.response_cache", cache),
+        patch("backend_analytics.analytics.service.llm_service.chat_with_retry", chat),
+    ):
+        assert await basic_chat("Names?", 0, model="gpt-4o", accept=accept) == (
+            "not json"
+        )
+        assert await basic_chat("Names?", 0, model="gpt-4o", accept=accept) == (
+            '["Matti"]'
+        )
+        assert await basic_chat("Names?", 0, model="gpt-4o", accept=accept) == (
+            '["Matti"]'
+        )
+        assert chat.await_count == 2
+
+
+# A streamed answer is cached once complete, and then served as one piece
+@pytest.mark.asyncio
+async def test_basic_chat_stream_cache():
+    cache = ResponseCache(MemoryCache(max_size=10, ttl=60), max_temperature=0)
+    provider = MagicMock()
+    provider.name = "test"
+
+    async def stream(message, temperature, model, system=None):
+        for text in ["1", "4"]:
+            yield Completion(text=text)
+
+    provider.stream = stream
+    with (
+        patch("backend_analytics.analytics.service.llm_service.response_cache", cache),
+        patch(
+            "backend_analytics.analytics.service.llm_service.providers.resolve",
+            return_value=provider,
+        ),
+    ):
+        first = await basic_chat("What is 2+12?", 0, model="gpt-4o", stream=True)
+        assert [piece async for piece in first] == ["1", "4"]
+        second = await basic_chat("What is 2+12?", 0, model="gpt-4o", stream=True)
+        assert [piece async for piece in second] == ["14"]
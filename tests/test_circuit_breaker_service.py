@@ -0,0 +1,96 @@
+import os
+import sys
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import openai
+import pytest
+
+# Hold the functions hand to the right folder so that imports work consistantly
+project_root = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.append(str(project_root))
+
+from backend_analytics.analytics.service import llm_service
+from backend_analytics.analytics.service.circuit_breaker_service import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+
+connection_error = openai.APIConnectionError(
+    request=httpx.Request("POST", "https://example.com")
+)
+
+
+async def fail(breaker):
+    with pytest.raises(openai.APIConnectionError):
+        async with breaker.guard():
+            raise connection_error
+
+
+# Failures in a row open the breaker, and then calls fail fast
+@pytest.mark.asyncio
+async def test_breaker_opens_after_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    for _ in range(3):
+        await fail(breaker)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        async with breaker.guard():
+            pass
+
+
+# After the timeout one trial call is let through, and a success closes the breaker
+@pytest.mark.asyncio
+async def test_breaker_half_open_trial():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    await fail(breaker)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+    # A failed trial opens the breaker again
+    await fail(breaker)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+
+# Errors caused by the request itself don't count against the provider
+@pytest.mark.asyncio
+async def test_breaker_ignores_request_errors():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    with pytest.raises(ValueError):
+        async with breaker.guard():
+            raise ValueError("bad request")
+    assert breaker.state == CLOSED
+
+
+# While the breaker is open the call goes to the fallback model, uncached
+@pytest.mark.asyncio
+async def test_basic_chat_uses_fallback_model():
+    # The classes as llm_service sees them
+    registry = llm_service.circuit_breakers
+    chat = AsyncMock(return_value="answer")
+    with (
+        patch.dict(registry.breakers, clear=True),
+        patch("backend_analytics.analytics.service.llm_service.chat_with_retry", chat),
+        patch.dict(
+            "backend_analytics.analytics.service.llm_service.settings.LLM_FALLBACK_MODELS",
+            {"ark-gpt-4o": "gpt-4o"},
+        ),
+    ):
+        registry.get("azure").set_state(OPEN)
+        assert (
+            await llm_service.basic_chat("message", 0, "ark-gpt-4o", cache=False)
+            == "answer"
+        )
+        assert chat.await_args.args == ("message", 0, "gpt-4o")
+
+        # Without a fallback the call fails fast
+        with pytest.raises(llm_service.CircuitOpenError):
+            await llm_service.basic_chat("message", 0, "ark-gpt-4o-mini", cache=False)
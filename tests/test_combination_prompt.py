@@ -8,10 +8,7 @@ import pytest
 project_root = os.path.abspath(os.path.join(__file__, "../.."))
 sys.path.append(str(project_root))
 
-from backend_analytics.analytics.service.json_service import (
-    parse_json,
-    strip_openai_json,
-)
+from backend_analytics.analytics.service.json_service import extract_json
 from backend_analytics.analytics.service.llm_service import basic_chat
 from backend_analytics.analytics.utils.transformer_service import (
     transform_to_content_request,
@@ -256,9 +253,7 @@ async def test_combination_prompt_long(async_client, service):
 
                 evaluation = await basic_chat(Eval_prompt, 0)
 
-                json_str = strip_openai_json(evaluation)
-
-                result_dict = parse_json(json_str, evaluation)
+                result_dict = extract_json(evaluation)
 
                 total = {}
 
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Hold the functions hand to the right folder so that imports work consistantly
+project_root = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.append(str(project_root))
+
+from backend_analytics.analytics.service.concurrency_service import (
+    AdaptiveLimiter,
+    gather_or_cancel,
+)
+
+
+def limiter():
+    return AdaptiveLimiter("test", initial=4, min_limit=1, max_limit=6)
+
+
+# Calls with a stable latency slowly raise the limit, up to the maximum
+@pytest.mark.asyncio
+async def test_limit_grows_when_stable():
+    adaptive = limiter()
+    for _ in range(100):
+        await adaptive.acquire()
+        await adaptive.release(latency=1.0)
+    assert adaptive.limit == 6
+
+
+# A rate limit error halves the limit, but never below the minimum
+@pytest.mark.asyncio
+async def test_limit_backs_off_on_overload():
+    adaptive = limiter()
+    await adaptive.acquire()
+    await adaptive.release(overloaded=True)
+    assert adaptive.limit == 2
+    for _ in range(5):
+        await adaptive.acquire()
+        await adaptive.release(overloaded=True)
+    assert adaptive.limit == 1
+
+
+# No more calls than the limit are let through at the same time
+@pytest.mark.asyncio
+async def test_limit_caps_in_flight():
+    adaptive = AdaptiveLimiter("test", initial=4, min_limit=1, max_limit=4)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with adaptive.slot():
+            peak = max(peak, adaptive.in_flight)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(call() for _ in range(20)))
+    assert peak == 4
+
+
+# The first exception cancels the rest and is raised, not a later one
+@pytest.mark.asyncio
+async def test_gather_or_cancel():
+    assert await gather_or_cancel(asyncio.sleep(0, "a"), asyncio.sleep(0, "b")) == [
+        "a",
+        "b",
+    ]
+
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def fail(delay, error):
+        await asyncio.sleep(delay)
+        raise error
+
+    with pytest.raises(KeyError):
+        await gather_or_cancel(
+            slow(), fail(0.05, ValueError()), fail(0.01, KeyError()), slow()
+        )
+    assert cancelled == [True, True]
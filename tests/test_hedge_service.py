@@ -0,0 +1,88 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Hold the functions hand to the right folder so that imports work consistantly
+project_root = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.append(str(project_root))
+
+from backend_analytics.analytics.service.hedge_service import (
+    HedgeBudget,
+    Hedger,
+    LatencyTracker,
+)
+
+
+def answer_after(delay, text):
+    async def call():
+        await asyncio.sleep(delay)
+        return text
+
+    return call
+
+
+def test_latency_percentile():
+    tracker = LatencyTracker(window=100, min_samples=10)
+    for latency in range(1, 10):
+        tracker.record("task", latency)
+    assert tracker.percentile("task", 0.95) is None
+    tracker.record("task", 10)
+    assert tracker.percentile("task", 0.95) == 10
+    assert tracker.percentile("task", 0.5) == 5
+
+
+def test_hedge_budget():
+    budget = HedgeBudget(percent=10)
+    budget.spend(1000)
+    assert budget.take(100)
+    assert not budget.take(1)
+
+
+# A slow primary call is hedged, the faster duplicate wins and the primary is cancelled
+@pytest.mark.asyncio
+async def test_slow_call_is_hedged():
+    hedger = Hedger(percentile=0.95, budget_percent=100, min_samples=1)
+    hedger.latencies.record("task", 0.01)
+    started = []
+
+    async def primary():
+        started.append("primary")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            started.append("cancelled")
+            raise
+
+    result = await hedger.run("task", 10, primary, answer_after(0, "hedge"))
+    await asyncio.sleep(0)
+    assert result == "hedge"
+    assert started == ["primary", "cancelled"]
+
+
+# No duplicate is sent when the primary is fast or the budget is used up
+@pytest.mark.asyncio
+async def test_hedge_not_sent():
+    hedger = Hedger(percentile=0.95, budget_percent=0, min_samples=1)
+    hedger.latencies.record("task", 0.01)
+
+    async def hedge():
+        raise AssertionError("the call should not be hedged")
+
+    assert await hedger.run("task", 10, answer_after(0, "fast"), hedge) == "fast"
+    assert await hedger.run("task", 10, answer_after(0.05, "slow"), hedge) == "slow"
+
+
+# If the first call to finish fails, the other one can still answer
+@pytest.mark.asyncio
+async def test_hedge_survives_failure():
+    hedger = Hedger(percentile=0.95, budget_percent=100, min_samples=1)
+    hedger.latencies.record("task", 0.01)
+
+    async def failing():
+        await asyncio.sleep(0.02)
+        raise ValueError("failed")
+
+    result = await hedger.run("task", 10, failing, answer_after(0.05, "hedge"))
+    assert result == "hedge"
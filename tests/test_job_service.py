@@ -0,0 +1,216 @@
+import asyncio
+import os
+import sqlite3
+import sys
+import time
+
+import pytest
+
+# Hold the functions hand to the right folder so that imports work consistantly
+project_root = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.append(str(project_root))
+
+from backend_analytics.analytics.service.job_service import JobQueue, JobWorkers
+
+article = {"id": "1", "title": "Otsikko", "body": "Teksti"}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "jobs.sqlite3")
+
+
+@pytest.fixture
+def queue(path):
+    return JobQueue(path, owner="a", lease=60)
+
+
+@pytest.mark.asyncio
+async def test_submit_and_claim(queue):
+    job_id = await queue.submit(article)
+    job = await queue.get(job_id)
+    assert job["status"] == "queued"
+    assert job["result"] is None
+
+    assert await queue.claim() == (job_id, article)
+    assert (await queue.get(job_id))["status"] == "running"
+    assert await queue.claim() is None
+    assert await queue.get("missing") is None
+
+
+@pytest.mark.asyncio
+async def test_claims_oldest_first(queue):
+    first = await queue.submit(article)
+    second = await queue.submit(article)
+    assert (await queue.claim())[0] == first
+    assert (await queue.claim())[0] == second
+
+
+@pytest.mark.asyncio
+async def test_complete_and_fail(queue):
+    done = await queue.submit(article)
+    failed = await queue.submit(article)
+    await queue.claim()
+    await queue.claim()
+
+    await queue.complete(done, {"people": ["Matti"]})
+    await queue.fail(failed, "timeout")
+
+    job = await queue.get(done)
+    assert job["status"] == "done"
+    assert job["result"] == {"people": ["Matti"]}
+    job = await queue.get(failed)
+    assert job["status"] == "failed"
+    assert job["error"] == "timeout"
+
+
+@pytest.mark.asyncio
+async def test_running_job_not_claimed_by_other_process(path, queue):
+    job_id = await queue.submit(article)
+    await queue.claim()
+
+    other = JobQueue(path, owner="b", lease=60)
+    assert await other.claim() is None
+    # Only the owner of the lease finishes the job
+    await other.complete(job_id, {"people": []})
+    assert (await queue.get(job_id))["status"] == "running"
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_claimed_again(path):
+    queue = JobQueue(path, owner="a", lease=0.05)
+    job_id = await queue.submit(article)
+    await queue.claim()
+    await asyncio.sleep(0.1)
+
+    other = JobQueue(path, owner="b", lease=60)
+    assert await other.claim() == (job_id, article)
+    # The first process has lost the job and can't finish it any more
+    assert not await queue.renew(job_id)
+    await queue.fail(job_id, "late")
+    await other.complete(job_id, {"people": ["Matti"]})
+    assert (await other.get(job_id))["status"] == "done"
+
+
+@pytest.mark.asyncio
+async def test_renewed_lease_is_not_claimed(path):
+    queue = JobQueue(path, owner="a", lease=0.2)
+    job_id = await queue.submit(article)
+    await queue.claim()
+    other = JobQueue(path, owner="b", lease=60)
+    for _ in range(3):
+        await asyncio.sleep(0.1)
+        assert await queue.renew(job_id)
+        assert await other.claim() is None
+
+
+@pytest.mark.asyncio
+async def test_purge_finished_jobs(queue):
+    done = await queue.submit(article)
+    await queue.claim()
+    await queue.complete(done, {"people": []})
+    queued = await queue.submit(article)
+
+    assert await queue.purge(time.time() - 60) == 0
+    assert await queue.purge(time.time() + 1) == 1
+    assert await queue.get(done) is None
+    assert (await queue.get(queued))["status"] == "queued"
+
+
+def test_adds_lease_columns_to_old_file(path):
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, "
+        "article TEXT NOT NULL, result TEXT, error TEXT, created REAL NOT NULL, "
+        "updated REAL NOT NULL)"
+    )
+    connection.close()
+
+    queue = JobQueue(path)
+    columns = {row[1] for row in queue.connection.execute("PRAGMA table_info(jobs)")}
+    assert {"claimed_by", "lease_until"} <= columns
+
+
+async def wait_for_status(queue, job_id, status):
+    for _ in range(100):
+        job = await queue.get(job_id)
+        if job["status"] == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Job {job_id} is {job['status']}, not {status}")
+
+
+@pytest.mark.asyncio
+async def test_workers_run_jobs(queue):
+    async def handler(article):
+        return {"title": article["title"]}
+
+    workers = JobWorkers(queue, handler=handler)
+    await workers.start(2)
+    try:
+        job_id = await queue.submit(article)
+        workers.notify()
+        job = await wait_for_status(queue, job_id, "done")
+        assert job["result"] == {"title": "Otsikko"}
+    finally:
+        await workers.stop()
+
+
+@pytest.mark.asyncio
+async def test_workers_record_failures(queue):
+    async def handler(article):
+        raise ValueError("no answer")
+
+    workers = JobWorkers(queue, handler=handler)
+    await workers.start(1)
+    try:
+        job_id = await queue.submit(article)
+        workers.notify()
+        job = await wait_for_status(queue, job_id, "failed")
+        assert job["error"] == "no answer"
+    finally:
+        await workers.stop()
+
+
+# A bug in the handler fails the job without stopping the worker
+@pytest.mark.asyncio
+async def test_workers_survive_bugs(queue):
+    async def handler(article):
+        if article["id"] == "bug":
+            raise KeyError("people")
+        return {"title": article["title"]}
+
+    workers = JobWorkers(queue, handler=handler)
+    await workers.start(1)
+    try:
+        failed = await queue.submit({**article, "id": "bug"})
+        done = await queue.submit(article)
+        workers.notify()
+        job = await wait_for_status(queue, failed, "failed")
+        assert job["error"] == "Internal error"
+        await wait_for_status(queue, done, "done")
+    finally:
+        await workers.stop()
+
+
+@pytest.mark.asyncio
+async def test_workers_renew_lease(path):
+    queue = JobQueue(path, owner="a", lease=0.15)
+    release = asyncio.Event()
+
+    async def handler(article):
+        await release.wait()
+        return {"people": []}
+
+    workers = JobWorkers(queue, handler=handler)
+    await workers.start(1)
+    try:
+        job_id = await queue.submit(article)
+        workers.notify()
+        await wait_for_status(queue, job_id, "running")
+        await asyncio.sleep(0.4)
+        assert await JobQueue(path, owner="b").claim() is None
+        release.set()
+        await wait_for_status(queue, job_id, "done")
+    finally:
+        await workers.stop()
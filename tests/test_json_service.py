@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+
+import pytest
+
+# Hold the functions hand to the right folder so that imports work consistantly
+project_root = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.append(str(project_root))
+
+from backend_analytics.analytics.service.json_service import (
+    JSONStreamParser,
+    extract_json,
+)
+
+
+@pytest.mark.parametrize(
+    "message, expected",
+    [
+        ('["Matti Meikäläinen"]', ["Matti Meikäläinen"]),
+        ('```json\n{"city": "Jyväskylä"}\n```', {"city": "Jyväskylä"}),
+        # Nested objects, and brackets and escaped quotes inside strings
+        (
+            'Tässä vastaus: {"alue": {"tone": "neutraali }", "analysis": "\\"x\\" ["}}',
+            {"alue": {"tone": "neutraali }", "analysis": '"x" ['}},
+        ),
+        # Text in brackets that isn't JSON is skipped
+        ('[huom] {"country": "Suomi"}', {"country": "Suomi"}),
+        ('Lista [ei valmis: ["Kuopio"]', ["Kuopio"]),
+        # The fenced block wins over JSON-like text before it
+        ('Esimerkki [1]\n```json\n["Lahti"]\n```', ["Lahti"]),
+    ],
+)
+def test_extract_json(message, expected):
+    assert extract_json(message) == expected
+
+
+def test_extract_json_errors():
+    assert extract_json("Ei henkilöitä.")["error"] == (
+        "Could not extract JSON from response"
+    )
+    assert extract_json("[Matti, Maija]")["error"] == "Failed to parse response as JSON"
+    assert "error" in extract_json(None)
+
+
+# Long answers that made the old regex backtrack are handled in linear time
+def test_extract_json_pathological():
+    assert "error" in extract_json("{" + "1" * 100_000)
+    assert extract_json("[ " * 50_000 + '{"a": 1}') == {"a": 1}
+
+
+# Brackets that close with the wrong bracket don't make the text scanned again
+def test_extract_json_mismatched_brackets():
+    started = time.perf_counter()
+    assert "error" in extract_json("{" * 20_000 + "]")
+    assert "error" in extract_json("[{" * 10_000 + "]" * 20_000)
+    assert "error" in extract_json("[" * 20_000 + "x" + "]" * 20_000)
+    assert time.perf_counter() - started < 1
+
+    assert extract_json('{"a": [1} ["Kuopio"]') == ["Kuopio"]
+    assert extract_json('Huom {"a": ["Lahti"] ]') == ["Lahti"]
+
+
+# The items of a streamed list come out as soon as each one is complete
+def test_stream_parser_list():
+    answer = (
+        '```json\n["Matti \\"M\\" Meikäläinen", "Virtanen, Maija", {"a": [1]}]\n```'
+    )
+    parser = JSONStreamParser()
+    items = []
+    for i in range(0, len(answer), 3):
+        items.extend(parser.feed(answer[i : i + 3]))
+    assert items == ['Matti "M" Meikäläinen', "Virtanen, Maija", {"a": [1]}]
+    assert parser.done
+
+
+def test_stream_parser_dict():
+    parser = JSONStreamParser()
+    assert parser.feed('{"country": "Suomi", "city": "Jyv') == [("country", "Suomi")]
+    assert parser.feed('äskylä", "neighborhood": "}"}') == [
+        ("city", "Jyväskylä"),
+        ("neighborhood", "}"),
+    ]
+
+
+def feed_in_pieces(answer, size=3):
+    parser = JSONStreamParser()
+    items = []
+    for i in range(0, len(answer), size):
+        items.extend(parser.feed(answer[i : i + size]))
+    return parser, items
+
+
+# Brackets in the text before the JSON are skipped once it is clear they aren't it
+@pytest.mark.parametrize(
+    "answer",
+    [
+        'Henkilöt [ks. alla]:\n["Matti Meikäläinen", "Maija Virtanen"]',
+        'Henkilöt [nimet alla]: ["Matti Meikäläinen", "Maija Virtanen"]',
+        'Huom {tärkeä}: ["Matti Meikäläinen", "Maija Virtanen"]',
+        'Vastaus [\n```json\n["Matti Meikäläinen", "Maija Virtanen"]\n```',
+        'Katso ["alla" ```json\n["Matti Meikäläinen", "Maija Virtanen"]\n```',
+    ],
+)
+def test_stream_parser_bracketed_preamble(answer):
+    parser, items = feed_in_pieces(answer)
+    assert items == ["Matti Meikäläinen", "Maija Virtanen"]
+    assert parser.done
@@ -81,14 +81,14 @@ async def test_basic_chat_retry():
 
     mock_create.side_effect = side_effect
 
-    # Patch the AsyncAzureOpenAI class to return our mock client
+    # Patch the client registry to return our mock client
     with patch(
-        "backend_analytics.analytics.service.llm_service.AsyncAzureOpenAI",
+        "backend_analytics.analytics.service.provider_service.clients.get",
         return_value=mock_client,
     ):
-        # Call the function that should retry
+        # Call the function that should retry, skipping the response cache
         result = await basic_chat(
-            "What is 2+12? Give only the final result of the equation", 0
+            "What is 2+12? Give only the final result of the equation", 0, cache=False
         )
 
         # Assert the result is correct
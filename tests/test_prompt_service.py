@@ -0,0 +1,71 @@
+import json
+import os
+import shutil
+import sys
+
+import pytest
+
+# Hold the functions hand to the right folder so that imports work consistantly
+project_root = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.append(str(project_root))
+
+from backend_analytics.analytics.service.prompt_service import PromptStore
+
+
+@pytest.fixture
+def prompts_file(tmp_path):
+    path = tmp_path / "prompts.json"
+    shutil.copy(os.path.join(project_root, "prompts.json"), path)
+    return path
+
+
+# Writes the file and moves its mtime on, as the mtime may not change within a test
+def rewrite(path, text):
+    mtime = os.path.getmtime(path)
+    path.write_text(text, encoding="utf-8")
+    os.utime(path, (mtime + 1, mtime + 1))
+
+
+def edited(path):
+    data = json.loads(path.read_text(encoding="utf-8"))
+    data["prompts"]["people"] += " Muokattu."
+    return json.dumps(data, ensure_ascii=False)
+
+
+# A changed file is loaded on the next check, with a new version
+def test_reload_on_change(prompts_file):
+    store = PromptStore(str(prompts_file), reload_interval=0.001)
+    first = store.get()
+    assert store.get() is first
+
+    rewrite(prompts_file, edited(prompts_file))
+    store.checked_at = 0
+    second = store.get()
+    assert second.version != first.version
+    assert second.prompts["people"].endswith(" Muokattu.")
+    assert second.task_versions["people"] != first.task_versions["people"]
+    assert second.task_versions["tone"] == first.task_versions["tone"]
+
+
+# A broken file is ignored and the previous prompts stay in use until it is fixed
+def test_reload_keeps_catalogue_on_bad_json(prompts_file):
+    store = PromptStore(str(prompts_file), reload_interval=0.001)
+    first = store.get()
+    fixed = edited(prompts_file)
+
+    rewrite(prompts_file, "{not json")
+    store.checked_at = 0
+    assert store.get() is first
+
+    rewrite(prompts_file, fixed)
+    store.checked_at = 0
+    assert store.get().version != first.version
+
+
+# Without a reload interval the file is never checked again
+def test_reload_turned_off(prompts_file):
+    store = PromptStore(str(prompts_file), reload_interval=0)
+    first = store.get()
+    rewrite(prompts_file, edited(prompts_file))
+    store.checked_at = 0
+    assert store.get() is first
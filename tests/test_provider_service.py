@@ -0,0 +1,330 @@
+import os
+import sys
+from unittest.mock import MagicMock
+
+import pytest
+from openai import BadRequestError, RateLimitError
+
+# Hold the functions hand to the right folder so that imports work consistantly
+project_root = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.append(str(project_root))
+
+from backend_analytics.analytics.service.provider_service import (
+    AnthropicProvider,
+    AzureProvider,
+    Deployment,
+    OpenAIProvider,
+    providers,
+)
+from backend_analytics.analytics.service.token_service import estimate_call_tokens
+
+
+def rate_limit_error():
+    response = MagicMock()
+    response.status_code = 429
+    response.headers = {}
+    return RateLimitError(message="Rate limit exceeded", response=response, body=None)
+
+
+# A fake client that answers with the name of the deployment, or raises the error
+def fake_client(answer=None, error=None):
+    async def create(**kwargs):
+        if error is not None:
+            raise error
+        completion = MagicMock()
+        completion.choices = [MagicMock()]
+        completion.choices[0].message.content = answer
+        completion.usage.prompt_tokens = 10
+        completion.usage.completion_tokens = 5
+        completion.usage.prompt_tokens_details.cached_tokens = 4
+        return completion
+
+    client = MagicMock()
+    client.chat.completions.create = create
+    return client
+
+
+def deployment(name, client, weight=1.0, structured_output=False):
+    pooled = Deployment(
+        name,
+        "https://example.com",
+        "key",
+        "gpt-4o",
+        ["gpt-4o"],
+        weight,
+        structured_output=structured_output,
+    )
+    pooled.client = lambda: client
+    return pooled
+
+
+def test_resolve_models():
+    assert providers.resolve("gpt-4o").name == "openai"
+    assert providers.resolve("claude-sonnet-4-20250514").name == "anthropic"
+    assert providers.resolve("o3").temperature("o3", 0) == 1
+    with pytest.raises(ValueError):
+        providers.resolve("not-a-model")
+
+
+# Calls go to the deployment with the fewest outstanding requests for its weight
+def test_least_outstanding_routing():
+    busy = deployment("busy", fake_client("busy"))
+    idle = deployment("idle", fake_client("idle"))
+    busy.outstanding = 3
+    provider = AzureProvider("azure", [busy, idle])
+    assert provider.candidates("gpt-4o")[0] is idle
+
+    heavy = deployment("heavy", fake_client("heavy"), weight=10)
+    heavy.outstanding = 3
+    provider = AzureProvider("azure", [idle, heavy])
+    idle.outstanding = 1
+    assert provider.candidates("gpt-4o")[0] is heavy
+
+
+# A deployment that is rate limited is skipped and the next one answers
+@pytest.mark.asyncio
+async def test_failover_on_rate_limit():
+    limited = deployment("limited", fake_client(error=rate_limit_error()))
+    healthy = deployment("healthy", fake_client("healthy"))
+    healthy.outstanding = 1  # make the limited one the first choice
+    provider = AzureProvider("azure", [limited, healthy])
+
+    completion = await provider.chat("prompt", 0, "gpt-4o")
+    assert completion.text == "healthy"
+    assert not limited.available()
+    assert limited.outstanding == 0
+
+    # All deployments failing raises the last error for the retry to handle
+    provider = AzureProvider("azure", [limited])
+    with pytest.raises(RateLimitError):
+        await provider.chat("prompt", 0, "gpt-4o")
+
+
+# The system message goes first, and the cached prompt tokens are read from the usage
+@pytest.mark.asyncio
+async def test_openai_system_message():
+    client = fake_client("answer")
+    create = client.chat.completions.create
+    sent = {}
+
+    async def record(**kwargs):
+        sent.update(kwargs)
+        return await create(**kwargs)
+
+    client.chat.completions.create = record
+    provider = OpenAIProvider("openai")
+    provider.client = lambda: client
+
+    completion = await provider.chat("article", 0, "gpt-4o", system="instructions")
+    assert [message["role"] for message in sent["messages"]] == ["system", "user"]
+    assert completion.cached_tokens == 4
+
+
+# The system message is marked for Anthropic's prompt cache
+@pytest.mark.asyncio
+async def test_anthropic_cache_control():
+    sent = {}
+
+    async def create(**kwargs):
+        sent.update(kwargs)
+        response = MagicMock()
+        response.content = [MagicMock(text="answer")]
+        response.usage.input_tokens = 10
+        response.usage.output_tokens = 5
+        response.usage.cache_read_input_tokens = 90
+        response.usage.cache_creation_input_tokens = 0
+        return response
+
+    client = MagicMock()
+    client.messages.create = create
+    provider = AnthropicProvider("anthropic")
+    provider.client = lambda: client
+
+    completion = await provider.chat("article", 0, "claude", system="instructions")
+    assert sent["system"][0]["cache_control"] == {"type": "ephemeral"}
+    assert completion.prompt_tokens == 100
+    assert completion.cached_tokens == 90
+
+
+def chunk(content=None, usage=None):
+    piece = MagicMock()
+    piece.choices = [MagicMock()] if content else []
+    if content:
+        piece.choices[0].delta.content = content
+    piece.usage = usage
+    return piece
+
+
+# Streamed answers come in pieces, with the tokens in the last chunk
+@pytest.mark.asyncio
+async def test_openai_stream():
+    usage = MagicMock(prompt_tokens=10, completion_tokens=3)
+    usage.prompt_tokens_details = None
+
+    async def chunks():
+        for piece in [chunk('["Matti'), chunk('"]'), chunk(usage=usage)]:
+            yield piece
+
+    sent = {}
+
+    async def create(**kwargs):
+        sent.update(kwargs)
+        return chunks()
+
+    client = MagicMock()
+    client.chat.completions.create = create
+    provider = OpenAIProvider("openai")
+    provider.client = lambda: client
+
+    pieces = [piece async for piece in provider.stream("prompt", 0, "gpt-4o")]
+    assert sent["stream"] is True
+    assert "".join(piece.text for piece in pieces) == '["Matti"]'
+    assert sum(piece.total_tokens for piece in pieces) == 13
+
+
+# The quota of the deployment that streamed the answer is corrected with its usage
+@pytest.mark.asyncio
+async def test_azure_stream_reconciles_deployment():
+    usage = MagicMock(prompt_tokens=10, completion_tokens=3)
+    usage.prompt_tokens_details = None
+
+    async def create(**kwargs):
+        async def chunks():
+            for piece in [chunk('["Matti"]'), chunk(usage=usage)]:
+                yield piece
+
+        return chunks()
+
+    client = MagicMock()
+    client.chat.completions.create = create
+    pooled = deployment("streaming", client)
+    pooled.limiter.reconcile = MagicMock()
+    provider = AzureProvider("azure", [pooled])
+
+    pieces = [piece async for piece in provider.stream("prompt", 0, "gpt-4o")]
+    assert "".join(piece.text for piece in pieces) == '["Matti"]'
+    pooled.limiter.reconcile.assert_called_once_with(estimate_call_tokens("prompt"), 13)
+
+
+# Models that support it are asked to answer in the JSON schema of the task, the
+# others get the prompt alone
+@pytest.mark.asyncio
+async def test_openai_json_schema():
+    client = fake_client('{"items": []}')
+    create = client.chat.completions.create
+    sent = []
+
+    async def record(**kwargs):
+        sent.append(kwargs)
+        return await create(**kwargs)
+
+    client.chat.completions.create = record
+    provider = OpenAIProvider("openai", structured_models=["gpt-4o"])
+    provider.client = lambda: client
+    schema = {"type": "object", "properties": {}}
+
+    await provider.chat("prompt", 0, "gpt-4o", schema=schema)
+    await provider.chat("prompt", 0, "gpt-3.5-turbo", schema=schema)
+    assert sent[0]["response_format"]["json_schema"]["schema"] == schema
+    assert sent[0]["response_format"]["json_schema"]["strict"] is True
+    assert "response_format" not in sent[1]
+
+
+# Anthropic is made to call a tool with the schema, and its input is the answer
+@pytest.mark.asyncio
+async def test_anthropic_tool_schema():
+    sent = {}
+
+    async def create(**kwargs):
+        sent.update(kwargs)
+        response = MagicMock()
+        response.content = [
+            MagicMock(type="text", text="Tässä vastaus"),
+            MagicMock(type="tool_use", input={"items": ["Matti Meikäläinen"]}),
+        ]
+        response.usage.input_tokens = 10
+        response.usage.output_tokens = 5
+        return response
+
+    client = MagicMock()
+    client.messages.create = create
+    provider = AnthropicProvider("anthropic", structured_models=["claude"])
+    provider.client = lambda: client
+    schema = {"type": "object", "properties": {}}
+
+    completion = await provider.chat("article", 0, "claude", schema=schema)
+    assert sent["tools"][0]["input_schema"] == schema
+    assert sent["tool_choice"] == {"type": "tool", "name": "answer"}
+    assert completion.text == '{"items": ["Matti Meikäläinen"]}'
+
+
+# Azure deployments only get the schema when they are set up for it
+@pytest.mark.asyncio
+async def test_azure_json_schema_per_deployment():
+    sent = []
+
+    def recording_client():
+        client = fake_client('{"items": []}')
+        create = client.chat.completions.create
+
+        async def record(**kwargs):
+            sent.append(kwargs)
+            return await create(**kwargs)
+
+        client.chat.completions.create = record
+        return client
+
+    schema = {"type": "object", "properties": {}}
+    for structured_output in (False, True):
+        pooled = deployment(
+            "d", recording_client(), structured_output=structured_output
+        )
+        provider = AzureProvider("azure", [pooled], structured_models=["gpt-4o"])
+        await provider.chat("prompt", 0, "gpt-4o", schema=schema)
+    assert "response_format" not in sent[0]
+    assert "response_format" in sent[1]
+
+
+# A model that rejects the schema is asked again without it, and so are later calls
+@pytest.mark.asyncio
+async def test_rejected_json_schema_falls_back():
+    response = MagicMock()
+    response.status_code = 400
+    response.headers = {}
+    rejected = BadRequestError(
+        message="Invalid parameter: 'response_format' of type 'json_schema' is not "
+        "supported with this model.",
+        response=response,
+        body=None,
+    )
+    client = fake_client('["Matti Meikäläinen"]')
+    create = client.chat.completions.create
+    sent = []
+
+    async def record(**kwargs):
+        sent.append(kwargs)
+        if "response_format" in kwargs:
+            raise rejected
+        return await create(**kwargs)
+
+    client.chat.completions.create = record
+    provider = OpenAIProvider("openai", structured_models=["gpt-4o"])
+    provider.client = lambda: client
+    schema = {"type": "object", "properties": {}}
+
+    completion = await provider.chat("prompt", 0, "gpt-4o", schema=schema)
+    assert completion.text == '["Matti Meikäläinen"]'
+    await provider.chat("prompt", 0, "gpt-4o", schema=schema)
+    assert ["response_format" in kwargs for kwargs in sent] == [True, False, False]
+
+    # Other bad requests are not retried
+    rejected = BadRequestError(message="content_filter", response=response, body=None)
+
+    async def refuse(**kwargs):
+        raise rejected
+
+    client.chat.completions.create = refuse
+    provider = OpenAIProvider("openai", structured_models=["gpt-4o"])
+    provider.client = lambda: client
+    with pytest.raises(BadRequestError):
+        await provider.chat("prompt", 0, "gpt-4o", schema=schema)
@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+# Hold the functions hand to the right folder so that imports work consistantly
+project_root = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.append(str(project_root))
+
+from backend_analytics.analytics.service.llm_service import Completion, stream_chat
+from backend_analytics.analytics.service.rate_limit_service import (
+    RateLimiter,
+    RateLimiterRegistry,
+)
+
+
+# Calls within the limit go through without waiting, the next one waits for a refill
+@pytest.mark.asyncio
+async def test_token_limit_waits():
+    limiter = RateLimiter("test", tpm=600)  # 10 tokens per second
+    start = time.monotonic()
+    await limiter.acquire(600)
+    assert time.monotonic() - start < 0.1
+
+    start = time.monotonic()
+    await limiter.acquire(5)
+    assert time.monotonic() - start >= 0.4
+
+
+# Using more tokens than estimated makes the following calls wait longer
+@pytest.mark.asyncio
+async def test_reconcile_with_usage():
+    limiter = RateLimiter("test", tpm=600)
+    await limiter.acquire(600)
+    limiter.reconcile(estimated_tokens=0, used_tokens=5)
+
+    start = time.monotonic()
+    await limiter.acquire(5)
+    assert time.monotonic() - start >= 0.9
+
+
+# A limit for a specific model is used before the limit of the provider
+def test_registry_lookup():
+    registry = RateLimiterRegistry(
+        {"azure": {"rpm": 100}, "azure/ark-gpt-4o": {"rpm": 10, "tpm": 1000}}
+    )
+    assert registry.get("azure", "ark-gpt-4o").name == "azure/ark-gpt-4o"
+    assert registry.get("azure", "ark-gpt-4o-mini").name == "azure"
+    assert registry.get("openai", "gpt-4o") is None
+
+
+# A streamed call reconciles its tokens also when the caller stops reading early
+@pytest.mark.asyncio
+async def test_stream_reconciles_when_stopped_early():
+    provider = MagicMock()
+    provider.name = "test"
+
+    async def stream(message, temperature, model, system=None):
+        yield Completion(text="1")
+        yield Completion(text="4", prompt_tokens=10, completion_tokens=2)
+
+    provider.stream = stream
+    limiter = MagicMock(acquire=AsyncMock())
+    with (
+        patch(
+            "backend_analytics.analytics.service.llm_service.providers.resolve",
+            return_value=provider,
+        ),
+        patch(
+            "backend_analytics.analytics.service.llm_service.rate_limiters.get",
+            return_value=limiter,
+        ),
+    ):
+        pieces = stream_chat("What is 2+12?", 0, "gpt-4o")
+        assert await anext(pieces) == "1"
+        await pieces.aclose()
+        estimated = limiter.acquire.await_args.args[0]
+        limiter.reconcile.assert_called_once_with(estimated, estimated)
+
+        limiter.reconcile.reset_mock()
+        assert [piece async for piece in stream_chat("What?", 0, "gpt-4o")] == [
+            "1",
+            "4",
+        ]
+        limiter.reconcile.assert_called_once_with(
+            limiter.acquire.await_args.args[0], 12
+        )
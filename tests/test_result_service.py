@@ -0,0 +1,127 @@
+import copy
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+# Hold the functions hand to the right folder so that imports work consistantly
+project_root = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.append(str(project_root))
+
+from backend_analytics.analytics.service.analysis_service import AnalysisService
+from backend_analytics.analytics.service.result_service import (
+    ResultStore,
+    get_result_store,
+)
+
+article = SimpleNamespace(id="1", title="title", kicker="", ingress="", body="body")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ResultStore(str(tmp_path / "results.sqlite3"))
+
+
+@pytest.mark.asyncio
+async def test_result_store_hit_and_miss(store):
+    assert await store.get("key") is None
+    await store.set("key", "hash", "v1", "gpt-4o", {"people": ["Matti"]})
+    assert await store.get("key") == {"people": ["Matti"]}
+
+
+# The same content analysed with another model or other prompts isn't a hit
+def test_result_key(service):
+    key = service.result_key(service.content_hash(article))
+    assert key != AnalysisService(model="gpt-4o").result_key(
+        service.content_hash(article)
+    )
+    service.catalogue = SimpleNamespace(version="other")
+    assert service.result_key(service.content_hash(article)) != key
+
+
+@pytest.mark.asyncio
+async def test_article_state(store):
+    assert await store.get_state("1") is None
+    await store.set_state("1", {"model": "gpt-4o"})
+    assert await store.get_state("1") == {"model": "gpt-4o"}
+
+
+# The store is only opened when it is first used, at the configured path
+def test_store_is_opened_on_first_use(tmp_path):
+    assert not (tmp_path / "analysis_results.sqlite3").exists()
+    get_result_store()
+    assert (tmp_path / "analysis_results.sqlite3").exists()
+
+
+# Answers of the LLM for every task of the analysis
+async def answer(prompt, task=None, **kwargs):
+    if task == "theme_and_topics" and kwargs.get("schema") is None:
+        return "Politiikka"
+    if task in ("hyperlocation", "tone", "user_need"):
+        return '{"vastaus": "ok"}'
+    return '["Matti Meikäläinen"]'
+
+
+def tasks_called(chat):
+    return {call.kwargs["task"] for call in chat.await_args_list}
+
+
+edited = SimpleNamespace(id="7", title="title", kicker="", ingress="", body="body")
+
+
+async def analyse_again(service, article):
+    chat = AsyncMock(side_effect=answer)
+    with patch("backend_analytics.analytics.service.analysis_service.basic_chat", chat):
+        results = await service.analyse(article)
+    return chat, results
+
+
+# An article sent again unchanged is served from the store without any LLM calls
+@pytest.mark.asyncio
+async def test_incremental_unchanged(service):
+    _, first = await analyse_again(service, edited)
+    chat, second = await analyse_again(service, edited)
+    assert chat.await_count == 0
+    assert second == first
+
+
+# A new version of one prompt only reruns its own task
+@pytest.mark.asyncio
+async def test_incremental_prompt_changed(service):
+    await analyse_again(service, edited)
+
+    catalogue = copy.copy(service.catalogue)
+    catalogue.version = "v2"
+    catalogue.task_versions = {**catalogue.task_versions, "tone": "v2"}
+    service.catalogue = catalogue
+    chat, results = await analyse_again(service, edited)
+
+    assert tasks_called(chat) == {"tone"}
+    assert results["prompt_version"] == "v2"
+    assert results["people"] == ["Matti Meikäläinen"]
+
+
+# A change to the body of the article reruns every task
+@pytest.mark.asyncio
+async def test_incremental_body_changed(service):
+    await analyse_again(service, edited)
+    changed = SimpleNamespace(**{**vars(edited), "body": "new body"})
+    chat, _ = await analyse_again(service, changed)
+    assert tasks_called(chat) == set(service.prompts)
+
+
+# A state saved before the content hash was stored reruns every task
+def test_stale_tasks_old_state(service):
+    content_hash = service.content_hash(edited)
+    state = {
+        "model": service.model,
+        "fields": {"title": "title", "kicker": "", "ingress": "", "body": "body"},
+        "task_versions": service.catalogue.task_versions,
+        "results": {prompt_name: ["Matti"] for prompt_name in service.prompts},
+    }
+    assert service.stale_tasks(content_hash, state) == list(service.prompts)
+
+    state["content_hash"] = content_hash
+    assert service.stale_tasks(content_hash, state) == []
@@ -0,0 +1,77 @@
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+# Hold the functions hand to the right folder so that imports work consistantly
+project_root = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.append(str(project_root))
+
+from backend_analytics.analytics.service.retry_service import (
+    RetryBudget,
+    RetryPolicy,
+)
+
+parse_error = {"error": "Failed to parse response as JSON", "raw_response": "..."}
+
+
+# Parse errors are retried until the answer can be parsed
+@pytest.mark.asyncio
+async def test_retry_until_parsed():
+    policy = RetryPolicy(max_attempts=4, backoff=0)
+    call = AsyncMock(side_effect=[parse_error, parse_error, ["Matti Meikäläinen"]])
+    result = await policy.run(call, task="people")
+    assert result == ["Matti Meikäläinen"]
+    assert [c.args[0] for c in call.await_args_list] == [1, 2, 3]
+
+
+# The last parse error is returned once the attempts run out
+@pytest.mark.asyncio
+async def test_retry_max_attempts():
+    policy = RetryPolicy(max_attempts=3, backoff=0)
+    call = AsyncMock(return_value=parse_error)
+    assert await policy.run(call, task="people") == parse_error
+    assert call.await_count == 3
+
+
+# The budget is shared between the calls of a task and stops its retries when it is
+# used up, without taking the retries of the other tasks
+@pytest.mark.asyncio
+async def test_retry_budget():
+    policy = RetryPolicy(max_attempts=4, backoff=0)
+    budget = RetryBudget(2)
+    call = AsyncMock(return_value=parse_error)
+    await policy.run(call, task="people", budget=budget)
+    assert call.await_count == 3
+    await policy.run(call, task="people", budget=budget)
+    assert call.await_count == 4
+    await policy.run(call, task="locations", budget=budget)
+    assert call.await_count == 7
+
+
+def test_retry_temperature():
+    policy = RetryPolicy(max_attempts=4, temperature_step=0.2)
+    assert policy.temperature(0, 1) == 0
+    assert policy.temperature(0, 2) == pytest.approx(0.2)
+    assert policy.temperature(0.9, 3) == 1.0
+
+
+# analyse_one awaits the retry, and returns the parsed result instead of a coroutine
+@pytest.mark.asyncio
+async def test_analyse_one_retries_parse_errors(service):
+    article = SimpleNamespace(title="title", kicker="", ingress="", body="body")
+    chat = AsyncMock(side_effect=["not json", '["Matti Meikäläinen"]'])
+    with (
+        patch("backend_analytics.analytics.service.analysis_service.basic_chat", chat),
+        patch(
+            "backend_analytics.analytics.service.analysis_service.parse_retry.backoff",
+            0,
+        ),
+    ):
+        result = await service.analyse_one(article, "people")
+    assert result == ["Matti Meikäläinen"]
+    assert chat.await_count == 2
+    # The retry skips the cache so the broken answer isn't served again
+    assert chat.await_args_list[1].kwargs["cache"] is False
@@ -0,0 +1,89 @@
+import os
+import sys
+
+# Hold the functions hand to the right folder so that imports work consistantly
+project_root = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.append(str(project_root))
+
+from backend_analytics.analytics.service.schema_service import (
+    matches_task_schema,
+    task_schemas,
+    unwrap,
+    user_need_schema,
+)
+
+tone = {"yleissävy": {"Positiivinen": "", "Negatiivinen": "", "Neutraali": ""}}
+user_needs = {
+    "pohjat": {"Tiedä": "", "Toimi": ""},
+    "tarpeet": {"Kerro mitä tapahtui (Tiedä)": "", "Anna neuvoja (Toimi)": ""},
+}
+
+
+# Every object in a strict schema requires all of its properties and no others
+def assert_strict(schema):
+    if schema.get("type") == "object":
+        assert schema["additionalProperties"] is False
+        assert schema["required"] == list(schema["properties"])
+        for child in schema["properties"].values():
+            assert_strict(child)
+    elif schema.get("type") == "array":
+        assert_strict(schema["items"])
+
+
+def test_task_schemas_are_strict():
+    schemas = task_schemas(tone, user_needs)
+    for schema in schemas.values():
+        assert_strict(schema)
+
+    tone_schema = schemas["tone"]["properties"]["yleissävy"]["properties"]["tone"]
+    assert tone_schema["enum"] == ["Positiivinen", "Negatiivinen", "Neutraali"]
+
+
+# The needs are grouped under their base need in the detailed scoring
+def test_user_need_schema():
+    schema = user_need_schema(user_needs)
+    detailed = schema["properties"]["detailed_scoring"]["properties"]
+    assert list(detailed["Tiedä"]["properties"]) == ["Kerro mitä tapahtui"]
+    assert list(detailed["Toimi"]["properties"]) == ["Anna neuvoja"]
+
+    # Needs without a known base need get no schema, and are parsed from the text
+    assert user_need_schema({"pohjat": {"Tiedä": ""}, "tarpeet": {"Neuvo": ""}}) is None
+
+
+def test_unwrap():
+    assert unwrap({"items": ["Matti Meikäläinen"]}) == ["Matti Meikäläinen"]
+    assert unwrap({"city": "Lahti"}) == {"city": "Lahti"}
+    assert unwrap(["Lahti"]) == ["Lahti"]
+
+
+def test_matches_task_schema():
+    schemas = task_schemas(tone, user_needs)
+    assert matches_task_schema(["Matti Meikäläinen"], schemas["people"])
+    assert not matches_task_schema(["Matti", 1], schemas["people"])
+    assert matches_task_schema(
+        {"country": "Suomi", "city": "Lahti", "neighborhood": ""},
+        schemas["hyperlocation"],
+    )
+    assert not matches_task_schema({"city": "Lahti"}, schemas["hyperlocation"])
+
+    answer = {"yleissävy": {"analysis": "", "tone": "Neutraali"}}
+    assert matches_task_schema(answer, schemas["tone"])
+    answer["yleissävy"]["tone"] = "neutraali"
+    assert not matches_task_schema(answer, schemas["tone"])
+
+    user_need = {
+        "analysis": "",
+        "drive": "Tiedä",
+        "scoring": {"Tiedä": 80, "Toimi": 20.5},
+        "detailed_scoring": {
+            "Tiedä": {"Kerro mitä tapahtui": 80},
+            "Toimi": {"Anna neuvoja": 20},
+        },
+    }
+    assert matches_task_schema(user_need, schemas["user_need"])
+    assert not matches_task_schema({"scoring": {}}, schemas["user_need"])
+    user_need["scoring"]["Toimi"] = True
+    assert not matches_task_schema(user_need, schemas["user_need"])
+    user_need["scoring"]["Toimi"] = 20
+    user_need["extra"] = ""
+    assert not matches_task_schema(user_need, schemas["user_need"])
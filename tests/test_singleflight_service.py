@@ -0,0 +1,168 @@
+import asyncio
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+
+# Hold the functions hand to the right folder so that imports work consistantly
+project_root = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.append(str(project_root))
+
+from backend_analytics.analytics.service.cache_service import (
+    MemoryCache,
+    ResponseCache,
+)
+from backend_analytics.analytics.service.llm_service import basic_chat
+from backend_analytics.analytics.service.singleflight_service import SingleFlight
+
+
+# Calls with the same key that run at the same time share one call
+@pytest.mark.asyncio
+async def test_single_flight_shares_call():
+    single_flight = SingleFlight("test")
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    results = await asyncio.gather(
+        *(single_flight.run("key", call) for _ in range(5)),
+        single_flight.run("other", call),
+    )
+    assert results == ["answer"] * 6
+    assert len(calls) == 2
+    assert single_flight.calls == {}
+
+
+# An error is given to every caller, and the next call runs again
+@pytest.mark.asyncio
+async def test_single_flight_error():
+    single_flight = SingleFlight("test")
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    results = await asyncio.gather(
+        single_flight.run("key", call),
+        single_flight.run("key", call),
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+    with pytest.raises(ValueError):
+        await single_flight.run("key", call)
+
+
+# The call goes on while someone waits for it, and is cancelled with the last caller
+@pytest.mark.asyncio
+async def test_single_flight_cancel():
+    single_flight = SingleFlight("test")
+    release = asyncio.Event()
+
+    async def call():
+        await release.wait()
+        return "answer"
+
+    first = asyncio.create_task(single_flight.run("key", call))
+    second = asyncio.create_task(single_flight.run("key", call))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+    assert await second == "answer"
+
+    release.clear()
+    callers = [asyncio.create_task(single_flight.run("key", call)) for _ in range(2)]
+    await asyncio.sleep(0)
+    future = single_flight.calls["key"]
+    for caller in callers:
+        caller.cancel()
+    await asyncio.gather(*callers, return_exceptions=True)
+    assert single_flight.calls == {}
+    assert single_flight.waiters == {}
+    await asyncio.sleep(0)
+    assert future.cancelled()
+
+
+# The same article analysed twice at once calls the LLM only once per prompt
+@pytest.mark.asyncio
+async def test_basic_chat_coalesces_identical_calls():
+    cache = ResponseCache(MemoryCache(max_size=10, ttl=60), max_temperature=0)
+    calls = []
+
+    async def chat(message, temperature, model, system=None, schema=None):
+        calls.append(message)
+        await asyncio.sleep(0.01)
+        return "14"
+
+    with (
+        patch("backend_analytics.analytics.service.llm_service.response_cache", cache),
+        patch("backend_analytics.analytics.service.llm_service.chat_with_retry", chat),
+    ):
+        results = await asyncio.gather(
+            *(basic_chat("What is 2+12?", 0, model="gpt-4o") for _ in range(3))
+        )
+    assert results == ["14", "14", "14"]
+    assert len(calls) == 1
+
+
+# Deterministic calls are coalesced also when they aren't cached, calls at a higher
+# temperature never are
+@pytest.mark.asyncio
+async def test_basic_chat_coalesces_uncached_calls():
+    calls = []
+
+    async def chat(message, temperature, model, system=None, schema=None):
+        calls.append(temperature)
+        await asyncio.sleep(0.01)
+        return "14"
+
+    with patch("backend_analytics.analytics.service.llm_service.chat_with_retry", chat):
+        await asyncio.gather(
+            *(
+                basic_chat("What is 2+12?", 0, model="gpt-4o", cache=False)
+                for _ in range(3)
+            )
+        )
+        assert calls == [0]
+        await asyncio.gather(
+            *(basic_chat("What is 2+12?", 0.5, model="gpt-4o") for _ in range(3))
+        )
+        assert calls == [0, 0.5, 0.5, 0.5]
+
+
+# Cancelling every caller of a coalesced call cancels the call to the LLM, e.g. when
+# the client of a stream goes away
+@pytest.mark.asyncio
+async def test_basic_chat_cancels_call_with_last_caller():
+    started = asyncio.Event()
+    cancelled = []
+
+    async def chat(message, temperature, model, system=None, schema=None):
+        started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(message)
+            raise
+
+    with patch("backend_analytics.analytics.service.llm_service.chat_with_retry", chat):
+        callers = [
+            asyncio.create_task(
+                basic_chat("What is 2+12?", 0, model="gpt-4o", cache=False)
+            )
+            for _ in range(2)
+        ]
+        await started.wait()
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        assert cancelled == []
+
+        callers[1].cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        for _ in range(5):
+            await asyncio.sleep(0)
+    assert cancelled == ["What is 2+12?"]
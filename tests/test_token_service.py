@@ -0,0 +1,96 @@
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+
+# Hold the functions hand to the right folder so that imports work consistantly
+project_root = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.append(str(project_root))
+
+from backend_analytics.analytics.service.token_service import (
+    GAP,
+    TokenBudget,
+    estimate_tokens,
+)
+
+paragraphs = [f"Kappale {i}. " + "Sanoja ja lauseita. " * 20 for i in range(10)]
+text = "\n".join(paragraphs)
+
+
+@pytest.fixture
+def budget():
+    with (
+        patch(
+            "backend_analytics.analytics.service.token_service.settings.LLM_OUTPUT_TOKEN_RESERVE",
+            100,
+        ),
+        patch(
+            "backend_analytics.analytics.service.token_service.settings.ARTICLE_TOKEN_BUDGET",
+            500,
+        ),
+    ):
+        yield TokenBudget()
+
+
+def test_context_limits(budget):
+    assert budget.context_limit("gpt-4.1") > budget.context_limit("gemma3:27b")
+    with patch(
+        "backend_analytics.analytics.service.token_service.settings.LLM_CONTEXT_LIMITS",
+        {"gemma3:27b": 32768},
+    ):
+        assert budget.context_limit("gemma3:27b") == 32768
+
+    # Only "head_tail" is capped by ARTICLE_TOKEN_BUDGET, the chunks are as big as
+    # the context of the model allows
+    assert budget.budget("gpt-4o", "full", overhead=1000) == 128_000 - 1100
+    assert budget.budget("gpt-4o", "chunk", overhead=1000) == 128_000 - 1100
+    assert budget.budget("gpt-4o", "head_tail", overhead=1000) == 500
+    assert budget.budget("gemma3:27b", "full", overhead=8100) == 1
+    with pytest.raises(ValueError):
+        budget.budget("gpt-4o", "middle")
+
+
+# A text over the budget keeps its beginning and end, within the budget
+def test_fit_head_tail(budget):
+    assert budget.fit("Lyhyt teksti.", "gpt-4o", "head_tail") == "Lyhyt teksti."
+
+    fitted = budget.fit(text, "gpt-4o", "head_tail")
+    assert estimate_tokens(fitted) <= 500
+    head, tail = fitted.split(GAP)
+    assert text.startswith(head)
+    assert text.endswith(tail)
+    assert len(head) > len(tail)
+
+    # The full strategy only cuts what doesn't fit in the context
+    assert budget.fit(text, "gpt-4o", "full") == text
+    assert budget.fit(text, "gemma3:27b", "full", overhead=7500) != text
+
+
+# The chunks split on paragraphs, each fits the context and together they have it all
+def test_split(budget):
+    assert budget.split(text, "gpt-4o") == [text]
+
+    small_context = patch(
+        "backend_analytics.analytics.service.token_service.settings.LLM_CONTEXT_LIMITS",
+        {"gemma3:27b": 600},
+    )
+    with small_context:
+        chunks = budget.split(text, "gemma3:27b")
+        assert len(chunks) > 1
+        assert all(estimate_tokens(chunk) <= 500 for chunk in chunks)
+        assert "\n".join(chunks) == text
+        assert budget.split("Lyhyt teksti.", "gemma3:27b") == ["Lyhyt teksti."]
+
+        # A paragraph longer than the budget is split on its sentences
+        chunks = budget.split("Pitkä lause. " * 300, "gemma3:27b")
+    assert all(estimate_tokens(chunk) <= 500 for chunk in chunks)
+    assert all(chunk.endswith("lause.") for chunk in chunks)
+
+    # A sentence longer than the budget is cut into parts that have all of it
+    with small_context:
+        sentence = "Pitkä" + " lause" * 1000 + "."
+        chunks = budget.split(sentence, "gemma3:27b")
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 500 for chunk in chunks)
+    assert "".join(chunks) == sentence